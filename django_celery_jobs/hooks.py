@@ -97,6 +97,11 @@ class JobResponseMiddleware(MiddlewareMixin):
                 reverse('job_token_obtain'),
                 reverse('job_asserts', kwargs=dict(path=''))
             ]
+
+            # Scraped by Prometheus with its own static token
+            if getattr(settings, 'DJANGO_CELERY_JOBS_METRICS_TOKEN', None):
+                exempt_path_list.append(reverse('api_metrics'))
+
             self.__dict__[attr] = exempt_path_list
 
         return self.__dict__[attr]
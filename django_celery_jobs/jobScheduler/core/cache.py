@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+__all__ = ('LRUCache', )
+
+
+class LRUCache:
+    """ A thread-safe and size-bounded LRU mapping with hit/miss counters """
+    _missing = object()
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, self._missing)
+
+            if value is self._missing:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        """ Returns the cached value, `factory()` is called to create it when missing """
+        value = self.get(key, self._missing)
+
+        if value is self._missing:
+            value = factory()
+            self.set(key, value)
+
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize)
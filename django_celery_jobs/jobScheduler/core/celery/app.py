@@ -2,84 +2,165 @@ from __future__ import absolute_import
 
 import logging
 import traceback
+from collections import namedtuple
 
 from celery import Celery
 from django.conf import settings
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 
+from .pool import RemoteAppPool
 from .utils import handle_task_router
 
 logger = logging.getLogger("celery.worker")
 
+# job: JobPeriodicModel or None(the task is sent by the default app), task: compiled task of remote app
+ResolvedJob = namedtuple('ResolvedJob', ('job', 'config', 'broker_url', 'task'))
+
 
 class AppDispatcher:
-    APPS_CACHE = {}
+    APPS_CACHE = RemoteAppPool(
+        maxsize=getattr(settings, 'DJANGO_CELERY_JOBS_REMOTE_APP_MAXSIZE', 32),
+        ttl=getattr(settings, 'DJANGO_CELERY_JOBS_REMOTE_APP_TTL', 3600),
+        broker_pool_limit=getattr(settings, 'DJANGO_CELERY_JOBS_REMOTE_BROKER_POOL_LIMIT', 4),
+        health_check_interval=getattr(settings, 'DJANGO_CELERY_JOBS_REMOTE_APP_HEALTH_CHECK', 60),
+    )
+    RESOLVED_CACHE = {}  # PeriodicTask name -> ResolvedJob
 
     def __init__(self, scheduler, entry, **kwargs):
         self.entry = entry
         self.scheduler = scheduler
         self.app = scheduler.app
+        self.celery_name = None
 
-    def get_task(self):
-        job_obj = self._get_job()
-        config_obj = job_obj.config
+    @classmethod
+    def invalidate(cls, name=None):
+        """ Drop the resolved jobs, it is called when the schedule was changed """
+        if name is None:
+            cls.RESOLVED_CACHE.clear()
+        else:
+            cls.RESOLVED_CACHE.pop(name, None)
 
-        if config_obj.category != 1:
-            raise ValueError("JobConfigModel<id:%s> is not a broker config" % config_obj.id)
+    @classmethod
+    def invalidate_config(cls, config_id):
+        """ JobConfigModel was changed or deleted, close its apps and drop the jobs resolved with it """
+        cls.APPS_CACHE.invalidate(tag=config_id)
 
-        celery_name = 'Celery:{0.host}:{0.virtual}'.format(config_obj)
-        if celery_name not in self.APPS_CACHE:
-            celery_app = Celery(main=celery_name, broker=config_obj.as_url())
+        for name, resolved in list(cls.RESOLVED_CACHE.items()):
+            if resolved.config is not None and resolved.config.id == config_id:
+                cls.RESOLVED_CACHE.pop(name, None)
 
-            # Attention timezone, make sure beat's the timezone for scheduled tasks is the same
-            if self.app:
-                timezone = self.app.conf.timezone
-                enable_utc = self.app.conf.enable_utc
-            else:
-                timezone = settings.TIME_ZONE
-                enable_utc = settings.USE_TZ  # TIME_ZONE is UTC, USE_TZ=True
+    def _create_app(self, celery_name, broker_url):
+        celery_app = Celery(main=celery_name, broker=broker_url)
 
-            celery_app.conf.timezone = timezone
-            celery_app.conf.enable_utc = enable_utc
+        # Attention timezone, make sure beat's the timezone for scheduled tasks is the same
+        if self.app:
+            timezone = self.app.conf.timezone
+            enable_utc = self.app.conf.enable_utc
+        else:
+            timezone = settings.TIME_ZONE
+            enable_utc = settings.USE_TZ  # TIME_ZONE is UTC, USE_TZ=True
 
-            self.APPS_CACHE[celery_name] = celery_app
+        celery_app.conf.timezone = timezone
+        celery_app.conf.enable_utc = enable_utc
 
-            # Clean existed task
-            for name in list(celery_app.tasks.keys()):
-                celery_app.tasks.unregister(name)
-        else:
-            celery_app = self.APPS_CACHE[celery_name]
+        # Clean existed task
+        for name in list(celery_app.tasks.keys()):
+            celery_app.tasks.unregister(name)
+
+        return celery_app
+
+    def get_task(self):
+        task_name = self.entry.task
+        resolved = self._resolve(task_name)
+
+        job_obj = resolved.job
+        config_obj = resolved.config
+
+        if config_obj.category != 1:
+            raise ValueError("JobConfigModel<id:%s> is not a broker config" % config_obj.id)
+
+        celery_name = self.celery_name = 'Celery:{0.host}:{0.virtual}'.format(config_obj)
+        celery_app = self.APPS_CACHE.get(celery_name, resolved.broker_url, factory=self._create_app, tag=config_obj.id)
+
+        # The app may be evicted and created again, the task must be bound to the current one
+        if resolved.task is not None and resolved.task.app is celery_app:
+            return resolved.task
 
         func = job_obj.compile_task_func()
-        task_name = func.__name__
+        func_name = func.__name__
 
-        if task_name in celery_app.tasks:
-            return celery_app.tasks[task_name]
+        # The resolved job was invalidated, maybe the source code has been changed
+        if func_name in celery_app.tasks:
+            celery_app.tasks.unregister(func_name)
 
-        task = celery_app.task(func, name=task_name)
+        task = celery_app.task(func, name=func_name)
         celery_app.tasks.register(task)
         handle_task_router(task=task, app=celery_app)
 
+        self.RESOLVED_CACHE[task_name] = resolved._replace(task=task)
         return task
 
+    def get_producer(self):
+        """ The long-lived producer of the remote app, call it after `get_task` """
+        return self.APPS_CACHE.get_producer(self.celery_name)
+
+    def release_producer(self):
+        self.APPS_CACHE.release_producer(self.celery_name)
+
+    def _resolve(self, name):
+        resolved = self.RESOLVED_CACHE.get(name)
+
+        if resolved is not None:
+            return resolved
+
+        try:
+            job_obj = self._query_job(name)
+        except (ObjectDoesNotExist, MultipleObjectsReturned) as e:
+            job_obj = None
+            logger.info(str(e))
+        except Exception:
+            # Database is unavailable, not cached and retry at next dispatch
+            logger.error(traceback.format_exc())
+            return ResolvedJob(job=None, config=None, broker_url=None, task=None)
+
+        config_obj = job_obj.config if job_obj else None
+        broker_url = config_obj.as_url() if config_obj and config_obj.category == 1 else None
+
+        resolved = ResolvedJob(job=job_obj, config=config_obj, broker_url=broker_url, task=None)
+        self.RESOLVED_CACHE[name] = resolved
+
+        return resolved
+
     def _get_job(self, name=None, silent=True):
+        task_name = name or self.entry.task
+        job_obj = self._resolve(task_name).job
+
+        if job_obj is None and silent:
+            logger.error('PeriodicJobModel<name:%s> does not exist', task_name)
+
+        return job_obj
+
+    @staticmethod
+    def _query_job(task_name):
         from django_celery_beat.models import PeriodicTask
 
-        task_name = name or self.entry.task
-        try:
-            periodic_task_obj = PeriodicTask.objects.get(name=task_name)
-            job_queryset = periodic_task_obj.periodic_task.select_related('config').all()
+        periodic_task_obj = PeriodicTask.objects.get(name=task_name)
+        job_queryset = periodic_task_obj.periodic_task.select_related('config').all()
 
-            if len(job_queryset) > 1:
-                raise MultipleObjectsReturned('PeriodicJobModel<name:%s> must one' % task_name)
+        if len(job_queryset) > 1:
+            raise MultipleObjectsReturned('PeriodicJobModel<name:%s> must one' % task_name)
 
-            if not job_queryset:
-                raise ObjectDoesNotExist('PeriodicJobModel<name:%s> does not exist' % task_name)
+        if not job_queryset:
+            raise ObjectDoesNotExist('PeriodicJobModel<name:%s> does not exist' % task_name)
 
-            return job_queryset[0]
-        except Exception:
-            if silent:
-                logger.error(traceback.format_exc())
+        return job_queryset[0]
 
     def is_default_app(self, name):
         return not bool(self._get_job(name=name, silent=False))
+
+
+@receiver([post_save, post_delete], sender='django_celery_jobs.JobConfigModel')
+def invalidate_config_apps(sender, instance, **kwargs):
+    AppDispatcher.invalidate_config(instance.id)
@@ -0,0 +1,94 @@
+import heapq
+
+from celery.beat import event_t
+
+__all__ = ('ScheduleHeap', )
+
+
+class ScheduleHeap:
+    """ Min-heap of beat entries keyed on the next run time
+
+    Each entry name has at most one alive event: the one holding the entry object registered
+    in `_entries`. Replaced or removed entries are left in the heap and dropped lazily when they
+    reach the top, so changing one entry costs O(log n) instead of rebuilding the whole heap.
+    """
+    priority = 5
+
+    def __init__(self):
+        self._events = []
+        self._entries = {}
+        self._times = {}  # name -> run time of the alive event
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def push(self, entry, when):
+        self._entries[entry.name] = entry
+        self._times[entry.name] = when
+        heapq.heappush(self._events, event_t(when, self.priority, entry))
+
+        # Too many dead events after lots of changes, compact it
+        if len(self._events) > 2 * len(self._entries) + 64:
+            self._compact()
+
+    def discard(self, name):
+        self._entries.pop(name, None)
+        self._times.pop(name, None)
+
+    def peek(self):
+        events = self._events
+
+        while events and self._entries.get(events[0].entry.name) is not events[0].entry:
+            heapq.heappop(events)
+
+        return events[0] if events else None
+
+    def pop_due(self, now):
+        """ Pop all alive events whose run time is up, the caller must push them back """
+        due_events = []
+
+        while True:
+            event = self.peek()
+            if event is None or event.time > now:
+                break
+
+            heapq.heappop(self._events)
+            self.discard(event.entry.name)
+            due_events.append(event)
+
+        return due_events
+
+    def update(self, old_schedule, new_schedule, when, changed):
+        """ Patch the heap with the difference between two schedules
+
+        The heap always holds the entries of `new_schedule`: an entry is advanced and saved through
+        the schedule, an old entry object left in the heap would lose its run state.
+
+        :param old_schedule: dict, name -> entry which the heap was built from
+        :param new_schedule: dict, name -> entry which is fresh read from database
+        :param when: callable, entry -> run time of the entry
+        :param changed: callable, (alive entry, new entry) -> whether the run time must be computed again
+        """
+        old_schedule = old_schedule or {}
+
+        for name in old_schedule:
+            if name not in new_schedule:
+                self.discard(name)
+
+        for name, entry in new_schedule.items():
+            # The alive entry, not the one of `old_schedule`, it was advanced by the runs
+            alive_entry = self._entries.get(name)
+
+            # Entry not edited, the new entry takes the run time of the old one
+            if alive_entry is not None and not changed(alive_entry, entry):
+                self.push(entry, self._times[name])
+            else:
+                self.push(entry, when(entry))
+
+    def _compact(self):
+        alive = [event for event in self._events if self._entries.get(event.entry.name) is event.entry]
+        heapq.heapify(alive)
+        self._events = alive
@@ -0,0 +1,90 @@
+import time
+import uuid
+import logging
+import platform
+
+from redis.exceptions import WatchError
+
+__all__ = ('LeaderLease', )
+
+logger = logging.getLogger("celery.worker")
+
+
+class LeaderLease:
+    """ A renewable lease in redis, the beat holding it is the leader
+
+    The lease is taken by `SET NX PX` and renewed by a compare-and-expire in a WATCH transaction,
+    so a beat never renews the lease of another one. The holder counts the lease from the time it
+    sent the request, which is earlier than redis does, so it gives up the lease before another
+    beat can take it.
+
+    :param redis_conn: redis client
+    :param key: str, key of the lease
+    :param ttl: float, seconds, a dead leader is replaced after it
+    """
+
+    def __init__(self, redis_conn, key='django_celery_jobs:beat_leader', ttl=10):
+        self.redis_conn = redis_conn
+        self.key = key
+        self.ttl = ttl
+        self.token = '%s:%s' % (platform.node(), uuid.uuid4().hex)
+
+        self._expires_at = 0
+
+    @property
+    def is_held(self):
+        return time.monotonic() < self._expires_at
+
+    def acquire_or_renew(self):
+        """ Returns True if this node holds the lease after the call """
+        started_at = time.monotonic()
+        ttl_ms = int(self.ttl * 1000)
+
+        try:
+            if self.is_held:
+                acquired = self._renew(ttl_ms)
+            else:
+                acquired = self.redis_conn.set(self.key, self.token, px=ttl_ms, nx=True) or self._renew(ttl_ms)
+        except Exception:
+            logger.error('Acquire the leader lease<%s> failed', self.key, exc_info=True)
+            return self.is_held  # Keep it until it expires locally, redis may be back before it
+
+        if acquired:
+            if not self.is_held:
+                logger.warning("%s<%s> is the leader now", platform.system(), self.token)
+
+            self._expires_at = started_at + self.ttl
+        else:
+            self._expires_at = 0
+
+        return bool(acquired)
+
+    def release(self):
+        """ Delete the lease if it is still held by this node, a follower takes it at once """
+        self._expires_at = 0
+
+        try:
+            self._compare_and(lambda pipe: pipe.delete(self.key))
+        except Exception:
+            logger.error('Release the leader lease<%s> failed', self.key, exc_info=True)
+
+    def _renew(self, ttl_ms):
+        return self._compare_and(lambda pipe: pipe.pexpire(self.key, ttl_ms))
+
+    def _compare_and(self, command):
+        with self.redis_conn.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                value = pipe.get(self.key)
+
+                if isinstance(value, bytes):
+                    value = value.decode()
+
+                if value != self.token:
+                    return False
+
+                pipe.multi()
+                command(pipe)
+                return bool(pipe.execute()[0])
+            except WatchError:
+                return False
@@ -0,0 +1,202 @@
+import time
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+__all__ = ('RemoteAppPool', )
+
+logger = logging.getLogger("celery.worker")
+
+
+class PooledApp:
+    __slots__ = ('app', 'broker_url', 'tag', 'producer', 'created', 'checked', 'used', 'healthy', 'checker')
+
+    def __init__(self, app, broker_url, tag=None):
+        now = time.monotonic()
+
+        self.app = app
+        self.tag = tag
+        self.producer = None
+        self.broker_url = broker_url
+        self.created = self.checked = self.used = now
+
+        self.healthy = True
+        self.checker = None  # Thread of the running health check
+
+
+class RemoteAppPool:
+    """ Celery apps of the remote brokers, bounded by LRU and TTL eviction
+
+    :param maxsize: int, the maximum count of apps, the least recently used one is closed first
+    :param ttl: int, seconds, an app older than it is closed and created again
+    :param broker_pool_limit: int, the maximum connections of the broker pool of each app
+    :param health_check_interval: int, seconds, an app idle longer than it checks the broker connection in a
+        background thread, the app failed the check is created again at next use
+    """
+
+    def __init__(self, maxsize=32, ttl=3600, broker_pool_limit=4, health_check_interval=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.broker_pool_limit = broker_pool_limit
+        self.health_check_interval = health_check_interval
+
+        self.hits = self.misses = self.evictions = self.failed_checks = 0
+
+        self._apps = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._apps)
+
+    def __contains__(self, name):
+        return name in self._apps
+
+    def get(self, name, broker_url, factory, tag=None):
+        """ Returns the app named `name`, `factory(name, broker_url)` is called to create it
+
+        :param tag: e.g. JobConfigModel id, the apps of a tag can be invalidated together
+        """
+        with self._lock:
+            pooled = self._apps.get(name)
+            now = time.monotonic()
+
+            if pooled is not None:
+                if pooled.broker_url != broker_url or now - pooled.created > self.ttl or not self._is_healthy(pooled):
+                    self._evict(name)
+                    pooled = None
+
+            if pooled is None:
+                self.misses += 1
+
+                app = factory(name, broker_url)
+                app.conf.broker_pool_limit = self.broker_pool_limit
+
+                pooled = self._apps[name] = PooledApp(app, broker_url=broker_url, tag=tag)
+
+                while len(self._apps) > self.maxsize:
+                    self._evict(next(iter(self._apps)))
+            else:
+                self.hits += 1
+
+            pooled.used = now
+            self._apps.move_to_end(name)
+
+            return pooled.app
+
+    def get_producer(self, name):
+        """ The long-lived producer of the app, messages to the same broker are published
+            on one connection and channel instead of acquiring them for every message.
+        """
+        with self._lock:
+            pooled = self._apps.get(name)
+
+            if pooled is None:
+                return None
+
+            if pooled.producer is None:
+                app = pooled.app
+                pooled.producer = app.amqp.Producer(app.connection_for_write(), auto_declare=False)
+
+            return pooled.producer
+
+    def release_producer(self, name):
+        """ Drop the producer after publishing failed, it is connected again at next use """
+        with self._lock:
+            pooled = self._apps.get(name)
+
+            if pooled is not None:
+                self._release_producer(pooled)
+
+    def invalidate(self, name=None, tag=None):
+        """ Close the apps by name or tag, all apps if both are None """
+        with self._lock:
+            if name is not None:
+                names = [name] if name in self._apps else []
+            elif tag is not None:
+                names = [key for key, pooled in self._apps.items() if pooled.tag == tag]
+            else:
+                names = list(self._apps)
+
+            for key in names:
+                self._evict(key)
+
+    def stats(self):
+        now = time.monotonic()
+
+        with self._lock:
+            apps = [
+                dict(
+                    name=name, tag=pooled.tag,
+                    age=round(now - pooled.created, 3), idle=round(now - pooled.used, 3),
+                    broker_pool_limit=pooled.app.conf.broker_pool_limit,
+                    has_producer=pooled.producer is not None,
+                )
+                for name, pooled in self._apps.items()
+            ]
+
+            return dict(
+                size=len(self._apps), maxsize=self.maxsize,
+                hits=self.hits, misses=self.misses,
+                evictions=self.evictions, failed_checks=self.failed_checks,
+                apps=apps,
+            )
+
+    def _is_healthy(self, pooled):
+        """ False if the last check failed, the check never blocks the caller, e.g. the beat tick """
+        if not pooled.healthy:
+            return False
+
+        now = time.monotonic()
+
+        if not self.health_check_interval or now - pooled.used < self.health_check_interval:
+            return True
+
+        if now - pooled.checked < self.health_check_interval:
+            return True
+
+        if pooled.checker is None or not pooled.checker.is_alive():
+            pooled.checked = now
+            pooled.checker = threading.Thread(target=self._check, args=(pooled, ), daemon=True)
+            pooled.checker.start()
+
+        return True
+
+    def _check(self, pooled):
+        try:
+            with pooled.app.pool.acquire(block=True, timeout=5) as conn:
+                conn.ensure_connection(max_retries=1)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+            with self._lock:
+                self.failed_checks += 1
+                pooled.healthy = False
+
+    def _evict(self, name):
+        pooled = self._apps.pop(name, None)
+
+        if pooled is None:
+            return
+
+        self.evictions += 1
+        self._release_producer(pooled)
+
+        try:
+            pooled.app.close()  # Release the connections and producers of the broker pool
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    @staticmethod
+    def _release_producer(pooled):
+        producer, pooled.producer = pooled.producer, None
+
+        if producer is None:
+            return
+
+        try:
+            connection = producer.connection
+            producer.release()
+            connection and connection.release()
+        except Exception:
+            logger.error(traceback.format_exc())
@@ -41,7 +41,7 @@ def load_beat(sender, **kwargs):
 
     from django_celery_beat.models import PeriodicTask
     from django_celery_jobs.jobScheduler.trigger.cron import CronTrigger
-    from django_celery_jobs.tasks.task_synchronous_jobs import watch_periodic_tasks
+    from django_celery_jobs.tasks.task_synchronous_jobs import watch_periodic_tasks, prune_job_results
 
     trigger = CronTrigger.from_crontab('* * * * *')
     PeriodicTask.objects.get_or_create(
@@ -49,6 +49,14 @@ def load_beat(sender, **kwargs):
         crontab_id=trigger.get_trigger_schedule()['crontab_id'], enabled=True,
     )
 
+    # Result rows are pruned only when the retention is configured
+    if getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_RETENTION_DAYS', None):
+        trigger = CronTrigger.from_crontab('17 * * * *')  # Hourly
+        PeriodicTask.objects.get_or_create(
+            name=prune_job_results.name, task=prune_job_results.name,
+            crontab_id=trigger.get_trigger_schedule()['crontab_id'], enabled=True,
+        )
+
 
 @import_modules.connect
 def discover_tasks(sender, **kwargs):
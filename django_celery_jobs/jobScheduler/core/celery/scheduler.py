@@ -1,31 +1,29 @@
+import time
 import uuid
-import string
-import random
 import logging
 import platform
-import warnings
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from celery.beat import _evaluate_entry_args, _evaluate_entry_kwargs
 from celery.utils import cached_property
 from celery.schedules import schedstate
 
-import django
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Q, Min
 from django.db.models.base import ModelBase
-from django.core.cache import caches
 
-try:
-    from django.core.cache.backends.redis import RedisCache
-except ModuleNotFoundError:
-    warnings.warn("The version of django you installed is %s" % django.get_version())
-    from django_redis.cache import RedisCache
-
-from django_celery_beat.schedulers import DatabaseScheduler
+from django_celery_beat.schedulers import DatabaseScheduler, ModelEntry
 
 from .app import AppDispatcher
+from .heap import ScheduleHeap
+from .lease import LeaderLease
+from ..writer import BufferedWriter
+from .. import metrics
+from ..version import schedule_version
+from ..notifier import get_redis_connection, get_change_notifier
 from django_celery_jobs import models
 
 logger = logging.getLogger("celery.worker")
@@ -42,6 +40,7 @@ class ModelDict(dict):
 class SyncScheduledTask:
     on_finalized = False
     Models = ModelDict()
+    overlap_seconds = getattr(settings, 'DJANGO_CELERY_JOBS_SYNC_OVERLAP', 60)
 
     def __init__(self, scheduler):
         self.scheduler = scheduler
@@ -80,7 +79,56 @@ class SyncScheduledTask:
         queryset = self.get_periodic_jobs()
         enable_queryset = queryset.filter(**kwargs).all()
 
-        for instance in enable_queryset:
+        self._sync_jobs(enable_queryset)
+
+    def sync_changed_schedules(self, since=None):
+        """ Only sync the jobs changed or expired since the last pass, all jobs if `since` is None
+
+        :param since: datetime, returned by the last pass
+        :return: datetime, the high-water mark to pass in next time
+        """
+        now = timezone.datetime.now()
+        queryset = self.get_periodic_jobs()
+
+        if since is not None:
+            # Look back a little, the clocks of api servers and beat may be not the same
+            lookback = since - timedelta(seconds=self.overlap_seconds)
+            q = Q(update_time__gte=lookback) | Q(deadline_run_time__gt=lookback, deadline_run_time__lte=now)
+            queryset = queryset.filter(q)
+
+        self._sync_jobs(queryset)
+        return now
+
+    def next_deadline(self, now=None):
+        """ The earliest deadline of the enabled jobs after now, the jobs must be synced again at it """
+        now = now or timezone.datetime.now()
+        queryset = self.Models.JobPeriodic.objects.filter(is_enabled=True, is_del=False, deadline_run_time__gt=now)
+
+        return queryset.aggregate(deadline=Min('deadline_run_time'))['deadline']
+
+    def sync_changed_configs(self, since=None):
+        """ Invalidate the remote apps whose JobConfigModel was changed since the last pass
+
+        :param since: datetime, returned by the last pass
+        :return: datetime, the high-water mark to pass in next time
+        """
+        now = timezone.datetime.now()
+
+        if since is not None:
+            lookback = since - timedelta(seconds=self.overlap_seconds)
+            config_ids = self.Models.JobConfig.objects.filter(update_time__gte=lookback).values_list('id', flat=True)
+
+            for config_id in config_ids:
+                AppDispatcher.invalidate_config(config_id)
+
+        return now
+
+    def _sync_jobs(self, queryset):
+        for instance in queryset:
+            # The code, config or broker of the job may be changed, it's resolved again at next dispatch
+            if instance.periodic_task:
+                AppDispatcher.invalidate(instance.periodic_task.name)
+
             now = timezone.datetime.now()
             is_enabled = bool(instance.is_enabled)
             deadline_run_time = instance.deadline_run_time
@@ -143,38 +191,288 @@ class SyncScheduledTask:
                 logger.warning("Job<%s> is stop, now: %s", job.title, timezone.datetime.now())
 
 
+class JobModelEntry(ModelEntry):
+    # Not compared when the schedule is reloaded, they are changed by every save
+    IGNORED_FIELDS = ('last_run_at', 'date_changed', 'description')
+
+    def __init__(self, model, app=None):
+        self.stored_last_run_at = model.last_run_at  # `ModelEntry` sets it to now when it never ran
+        super().__init__(model, app=app)
+
+    def is_changed(self, other):
+        """ Whether `other` loaded from database is not the same as this entry, all fields of the models are compared,
+            `ScheduleEntry.__eq__` misses `start_time`, `one_off`, `last_run_at` and so on.
+        """
+        if self.stored_last_run_at != getattr(other, 'stored_last_run_at', other.model.last_run_at):
+            return True
+
+        if self.schedule != other.schedule:
+            return True
+
+        fields = [f.attname for f in self.model._meta.concrete_fields if f.name not in self.IGNORED_FIELDS]
+        return any(getattr(self.model, name) != getattr(other.model, name) for name in fields)
+
+
 class BeatScheduler(DatabaseScheduler):
+    Entry = JobModelEntry
+    _job_sync_mark = None  # High-water mark of the incremental job sync
+    _config_sync_mark = None
+    _job_version = None  # `schedule_version` which the jobs were synced at
+    _next_deadline = None
+    _next_poll = 0  # Monotonic time of the next whole check when the changes are notified
+    _syncing = False
+    _lease_checked_at = None  # Monotonic time of the last lease request, `lease` mode only
+    _is_leader = False
+
+    @property
+    def schedule(self):
+        """ Same as `DatabaseScheduler.schedule`, but the heap is patched by the changed entries
+            instead of being invalidated, thousands of unchanged entries are not evaluated again.
+
+            With a change notifier, the notified jobs are applied at once and the database is
+            only checked every `change_poll_interval` seconds in case some events were lost.
+        """
+        initial = update = False
+        subscription = self.change_subscription  # Subscribe before the initial read, no event is missed
+
+        if self._initial_read:
+            initial = update = True
+            self._initial_read = False
+        elif not self._syncing:
+            self.apply_notified_changes(subscription)
+
+            if self.should_poll(subscription) and self.schedule_changed():
+                update = True
+
+        if update:
+            self.sync_entries()
+            old_schedule, self._schedule = self._schedule, self.all_as_schedule()
+
+            if not initial and self._heap is not None:
+                self._heap.update(old_schedule, self._schedule, when=self._next_when, changed=self._entry_changed)
+
+        return self._schedule
+
+    @staticmethod
+    def _entry_changed(old_entry, new_entry):
+        if isinstance(old_entry, JobModelEntry):
+            return old_entry.is_changed(new_entry)
+
+        return old_entry != new_entry
+
+    def _next_when(self, entry):
+        is_due, next_call_delay = entry.is_due()
+        return self._when(entry, 0 if is_due else next_call_delay) or 0
+
+    def sync_entries(self):
+        """ Save the run state of the dispatched entries, the schedule isn't reloaded meanwhile """
+        self._syncing = True
+        try:
+            self.sync()  # `sync` reads `schedule` again
+        finally:
+            self._syncing = False
+
+    def populate_heap(self, **kwargs):
+        heap = ScheduleHeap()
+
+        for entry in self.schedule.values():
+            heap.push(entry, self._next_when(entry))
+
+        self._heap = heap
+
+    def tick(self, **kwargs):
+        """ Run a tick, only the entries on top of the heap whose run time is up are evaluated
+
+        Returns:
+            float: preferred delay in seconds for next call.
+        """
+        begin = time.perf_counter()
+
+        try:
+            return self._tick(**kwargs)
+        finally:
+            metrics.BEAT_TICK_SECONDS.observe(time.perf_counter() - begin)
+            metrics.flush()
+
+    def _tick(self, **kwargs):
+        max_interval = self.max_interval
+        schedule = self.schedule  # Read changes once, the heap is patched in place
+
+        if self.lock_mode == 'lease' and not self.is_leader():
+            # Follower: the schedule is kept warm but never evaluated
+            return min(max_interval, self.lease_renew_interval)
+
+        if self._heap is None:
+            self.populate_heap()
+
+        heap = self._heap
+        event = heap.peek()
+
+        if event is None:
+            return max_interval
+
+        now = self._when(event.entry, 0)
+        events = heap.pop_due(now)
+        entries = [event.entry for event in events]
+
+        sched_states = [None] * len(entries)
+        metrics.BEAT_ENTRIES_EVALUATED.inc(len(entries))
+
+        if self.lock_mode == 'batch':
+            try:
+                sched_states = self.is_due_many(entries)
+            except Exception:
+                logger.error(traceback.format_exc())
+                sched_states = [schedstate(is_due=False, next=max_interval) for _ in entries]
+
+        lease = self.leader_lease if self.lock_mode == 'lease' else None
+
+        for event, entry, sched_state in zip(events, entries, sched_states):
+            if lease is not None and not lease.is_held:
+                # The lease expired during the tick and another beat may lead, it's not sent twice
+                logger.warning('Leader lease lost during the tick, entry %s is left to the new leader', entry.name)
+                heap.push(entry, event.time)
+                continue
+
+            try:
+                is_due, next_time_to_run = sched_state or self.is_due(entry)
+
+                if is_due:
+                    metrics.BEAT_LATENESS_SECONDS.observe(max(self._when(entry, 0) - event.time, 0))
+                    next_entry = self.reserve(entry)
+                    self.apply_entry(entry, producer=self.producer)
+                    heap.push(next_entry, self._when(next_entry, next_time_to_run))
+                else:
+                    heap.push(entry, self._when(entry, next_time_to_run))
+            except Exception:
+                logger.error(traceback.format_exc())
+
+                # Retry it at next wakeup, never lose the entry from the heap
+                if entry.name in schedule and entry.name not in heap:
+                    heap.push(entry, self._when(entry, max_interval))
+
+        if self.change_subscription is not None:
+            max_interval = min(max_interval, self.change_notify_interval)  # Wake up to apply the notified changes
+
+        if self.lock_mode == 'lease':
+            # A new leader reads the run state from database, save it before the lease is lost
+            self._dirty and self.sync_entries()
+            max_interval = min(max_interval, self.lease_renew_interval)
+
+        event = heap.peek()
+        if event is None:
+            return max_interval
+
+        return min(max(event.time - self._when(event.entry, 0), 0), max_interval)
+
     @cached_property
     def redis_conn(self):
+        return get_redis_connection()
+
+    @cached_property
+    def change_subscription(self):
+        """ Subscription of the changed jobs, None if no notifier is configured and every tick polls the database """
+        notifier = get_change_notifier()
+
+        if notifier is None:
+            return None
+
         try:
-            from django_redis import get_redis_connection
+            return notifier.subscribe()
+        except Exception:
+            logger.error(traceback.format_exc())
 
-            _cache = get_redis_connection()
-        except (ModuleNotFoundError, NotImplementedError):
-            # default is redis, use raw redis
-            djcache = caches['default']
-            if not isinstance(djcache, RedisCache):
-                try:
-                    djcache = caches['redis']
-                except AttributeError:
-                    djcache = None
+    @cached_property
+    def change_poll_interval(self):
+        return getattr(settings, 'DJANGO_CELERY_JOBS_CHANGE_POLL_INTERVAL', 60)
+
+    @cached_property
+    def change_notify_interval(self):
+        return getattr(settings, 'DJANGO_CELERY_JOBS_CHANGE_NOTIFY_INTERVAL', 1.0)
 
-            if djcache:
-                return djcache._cache.get_client(None, write=True)
+    @cached_property
+    def result_writer(self):
+        """ Write the dispatch records in background, the beat loop is never blocked by the INSERT """
+        if not getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_ASYNC', True):
+            return None
+
+        model = models.JobScheduledResultModel
+        return BufferedWriter(
+            model=model, builder=model.build_result,
+            batch_size=getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_BATCH_SIZE', 200),
+            flush_interval=getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_FLUSH_INTERVAL', 1.0),
+            maxsize=getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_QUEUE_SIZE', 10000),
+            put_timeout=getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_PUT_TIMEOUT', 0),
+        )
+
+    @cached_property
+    def lock_mode(self):
+        """ How multi beats compete for a due entry
+            entry: one redis `SET NX` round trip per entry
+            batch: all due entries of a tick are claimed in one redis pipeline
+            lease: beats elect a leader by a renewable lease, only the leader evaluates the entries
+        """
+        return getattr(settings, 'DJANGO_CELERY_JOBS_BEAT_LOCK_MODE', 'entry')
+
+    @cached_property
+    def lease_ttl(self):
+        """ Seconds, a dead leader is replaced in `lease_ttl + lease_renew_interval` at most """
+        return getattr(settings, 'DJANGO_CELERY_JOBS_BEAT_LEASE_TTL', 10)
 
-        logger.error('Fuck, redis client not find from settings.CACHES')
+    @cached_property
+    def lease_renew_interval(self):
+        return getattr(settings, 'DJANGO_CELERY_JOBS_BEAT_LEASE_RENEW_INTERVAL', self.lease_ttl / 3.0)
+
+    @cached_property
+    def leader_lease(self):
+        if not self.redis_conn:
+            return None
+
+        key = getattr(settings, 'DJANGO_CELERY_JOBS_BEAT_LEASE_KEY', 'django_celery_jobs:beat_leader')
+        return LeaderLease(self.redis_conn, key=key, ttl=self.lease_ttl)
+
+    def is_leader(self):
+        """ Renew or acquire the lease every `lease_renew_interval` seconds, else the last result is used """
+        lease = self.leader_lease
+
+        # Not distributed redis lock
+        if lease is None:
+            return True
+
+        now = time.monotonic()
+
+        if self._lease_checked_at is None or now - self._lease_checked_at >= self.lease_renew_interval:
+            self._lease_checked_at = now
+            is_leader = lease.acquire_or_renew()
+
+            if is_leader and not self._is_leader:
+                self.on_promoted()
+
+            self._is_leader = is_leader
+
+        return self._is_leader and lease.is_held
+
+    def on_promoted(self):
+        """ The entries of a follower may be behind the last leader, read them again from database """
+        self._initial_read = True
+        self._heap = None
+        AppDispatcher.invalidate()
+
+    @staticmethod
+    def _lock_expire(next_run_time):
+        return (int(next_run_time) - 1) * 1000  # milliseconds
 
     def is_due(self, entry):
         sched_state = (_, next_run_time) = entry.is_due()
-        uniq_val = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(22))
 
-        # Not distributed redis lock
-        if not self.redis_conn:
+        # Not distributed redis lock, or only the leader evaluates entries
+        if not self.redis_conn or self.lock_mode == 'lease':
             return sched_state
 
         # Multi scheduler to run
         key = entry.task
-        default_expire = (int(next_run_time) - 1) * 1000  # milliseconds
+        uniq_val = uuid.uuid4().hex
+        default_expire = self._lock_expire(next_run_time)
         log_args = [platform.system(), platform.node(), key]
 
         # Important:
@@ -184,14 +482,71 @@ class BeatScheduler(DatabaseScheduler):
         # distributed locks are used to ensure that only one scheduler is triggered in during `wakeup_interval`
         try:
             if default_expire > 0 and self.redis_conn.set(key, uniq_val, px=default_expire, nx=True):
+                metrics.BEAT_LOCKS.inc(result='won')
                 logger.warning("%s<%s> apply scheduled<%s> succeed, now: %s", *(log_args + [datetime.now()]))
                 return entry.is_due()
+
+            default_expire > 0 and metrics.BEAT_LOCKS.inc(result='lost')
         except Exception as e:
             logger.error(traceback.format_exc())
 
         # logger.warning("%s<%s> apply scheduled<%s> passed, now: %s", *(log_args + [datetime.now()]))
         return schedstate(is_due=False, next=next_run_time)
 
+    def is_due_many(self, entries):
+        """ Same as `is_due`, but the due entries of one tick are claimed together
+
+        :param entries: list, candidate entries whose run time is up
+        :return: list of schedstate, in the same order of `entries`
+        """
+        sched_states = [entry.is_due() for entry in entries]
+
+        # Not distributed redis lock
+        if not self.redis_conn:
+            return sched_states
+
+        lock_items = [
+            (entry.task, self._lock_expire(next_run_time))
+            for entry, (is_due, next_run_time) in zip(entries, sched_states) if is_due
+        ]
+        won_keys = self.acquire_locks(lock_items)
+
+        results = []
+        for entry, sched_state in zip(entries, sched_states):
+            if sched_state.is_due and entry.task in won_keys:
+                won_keys.discard(entry.task)  # Entries of the same task are dispatched once as `is_due`
+                results.append(sched_state)
+            else:
+                results.append(schedstate(is_due=False, next=sched_state.next))
+
+        return results
+
+    def acquire_locks(self, lock_items):
+        """ Claim distributed locks with one redis pipeline round trip
+
+        :param lock_items: list of (key, expire milliseconds)
+        :return: set, the keys which this node won
+        """
+        keys = []
+        uniq_val = uuid.uuid4().hex
+        pipe = self.redis_conn.pipeline(transaction=False)
+
+        for key, expire in lock_items:
+            if expire > 0:
+                keys.append(key)
+                pipe.set(key, uniq_val, px=expire, nx=True)
+
+        if not keys:
+            return set()
+
+        won_keys = {key for key, acquired in zip(keys, pipe.execute()) if acquired}
+        metrics.BEAT_LOCKS.inc(len(won_keys), result='won')
+        metrics.BEAT_LOCKS.inc(len(keys) - len(won_keys), result='lost')
+        log_args = [platform.system(), platform.node(), len(won_keys), len(keys), datetime.now()]
+        logger.warning("%s<%s> apply scheduled %s/%s succeed, now: %s", *log_args)
+
+        return won_keys
+
     def apply_async(self, entry, producer=None, advance=True, **kwargs):
         entry = self.reserve(entry) if advance else entry
         task = self.app.tasks.get(entry.task)
@@ -208,22 +563,158 @@ class BeatScheduler(DatabaseScheduler):
         run_date = timezone.now()
         scheduled_kw = dict(sched_id=str(uuid.uuid1()).replace('-', ''), name=entry.task,
                             periodic_task_id=entry.model.id, is_success=True, run_date=run_date)
+        broker, begin = 'default', time.perf_counter()
 
         try:
             if task and not dispatcher.is_default_app(name=entry.task):
                 dispatch_task = dispatcher.get_task()
-                return dispatch_task.apply_async(entry_args, entry_kwargs, producer=None, **entry.options)
+                broker = dispatcher.celery_name
+
+                try:
+                    remote_producer = dispatcher.get_producer()
+                    return dispatch_task.apply_async(entry_args, entry_kwargs, producer=remote_producer, **entry.options)
+                except Exception:
+                    dispatcher.release_producer()
+                    raise
             else:
                 return super().apply_async(entry, producer, advance, **kwargs)
         except Exception as e:
             exc_info = traceback.format_exc()
             scheduled_kw.update(is_success=False, traceback=exc_info[-2800:])
+            metrics.DISPATCH_FAILURES.inc(broker=broker)
         finally:
-            SyncScheduledTask.Models.JobScheduledResult.add_result(**scheduled_kw)
+            metrics.DISPATCH_SECONDS.observe(time.perf_counter() - begin, broker=broker)
+
+            if self.result_writer:
+                self.result_writer.put(**scheduled_kw)
+            else:
+                models.JobScheduledResultModel.add_result(**scheduled_kw)
+
+    def close(self):
+        super().close()
+        metrics.flush(force=True)
+
+        if self.lock_mode == 'lease' and self.leader_lease is not None:
+            self.leader_lease.release()
+
+        if self.change_subscription is not None:
+            self.change_subscription.close()
+
+        if self.result_writer:
+            self.result_writer.stop()
+
+    def should_poll(self, subscription):
+        """ Whether to check the database for changes at this tick """
+        if subscription is None:
+            return True
+
+        now = time.monotonic()
+        deadline_reached = self._next_deadline is not None and timezone.datetime.now() >= self._next_deadline
+
+        if now < self._next_poll and not deadline_reached:
+            return False
+
+        self._next_poll = now + self.change_poll_interval
+        return True
+
+    def apply_notified_changes(self, subscription):
+        if subscription is None:
+            return
+
+        job_ids = subscription.poll()
+
+        if job_ids is None:
+            self._next_poll = 0  # Events may be lost, check the database at once
+        elif job_ids:
+            try:
+                self.apply_changes(job_ids)
+            except Exception:
+                logger.error(traceback.format_exc())
+                self._next_poll = 0
+
+    def apply_changes(self, job_ids):
+        """ Sync the changed jobs and patch their entries into the schedule and the heap
+
+        :param job_ids: iterable, ids of JobPeriodicModel
+        """
+        sync_task = SyncScheduledTask(scheduler=self)
+        jobs = list(sync_task.Models.JobPeriodic.objects.filter(id__in=job_ids).select_related('periodic_task'))
+
+        if len(jobs) < len(set(job_ids)):
+            self._next_poll = 0  # Deleted rows, their entries are found by the whole check
+
+        sync_task._sync_jobs([job for job in jobs if not job.is_del])
+        task_ids = {job.periodic_task_id for job in jobs if job.periodic_task_id}
+
+        if not task_ids:
+            return
+
+        old_schedule = self._schedule or {}
+        new_schedule = {name: entry for name, entry in old_schedule.items() if entry.model.id not in task_ids}
+
+        for name in set(old_schedule).difference(new_schedule):
+            AppDispatcher.invalidate(name)
+
+            # Save the run state of the replaced entry, else it is lost and the entry may run again
+            if name in self._dirty:
+                self._dirty.discard(name)
+                try:
+                    old_schedule[name].save()
+                except Exception:
+                    logger.error(traceback.format_exc())
+
+        for model in self.Model.objects.enabled().filter(id__in=task_ids):
+            try:
+                new_schedule[model.name] = self.Entry(model, app=self.app)
+            except ValueError:
+                pass
+
+        self._schedule = new_schedule
+
+        if self._heap is not None:
+            self._heap.update(old_schedule, new_schedule, when=self._next_when, changed=self._entry_changed)
+
+        logger.info('Schedule changes applied, jobs: %s, entries: %s', len(jobs), len(task_ids))
+
+    def jobs_changed(self):
+        """ Whether the jobs must be synced: the version was bumped or a job reached its deadline.
+            An idle beat reads the version only, the jobs are not queried.
+        """
+        if self._job_sync_mark is None:
+            return True
+
+        try:
+            version = schedule_version.get()
+        except Exception:
+            logger.error(traceback.format_exc())
+            return True  # Never miss a change
+
+        if version != self._job_version:
+            return True
+
+        return self._next_deadline is not None and timezone.datetime.now() >= self._next_deadline
+
+    def sync_jobs(self):
+        # Read the version before the sync, a bump during the sync is seen at next tick
+        self._job_version = schedule_version.get()
+
+        sync_task = SyncScheduledTask(scheduler=self)
+        self._job_sync_mark = sync_task.sync_changed_schedules(since=self._job_sync_mark)
+        self._config_sync_mark = sync_task.sync_changed_configs(since=self._config_sync_mark)
+        self._next_deadline = sync_task.next_deadline(now=self._job_sync_mark)
 
     def schedule_changed(self):
-        SyncScheduledTask(scheduler=self).sync_all_schedules()
+        begin = time.perf_counter()
+
+        if self.jobs_changed():
+            self.sync_jobs()
+
+        changed = super().schedule_changed()
+
+        if changed:
+            AppDispatcher.invalidate()
 
-        return super().schedule_changed()
+        metrics.BEAT_SCHEDULE_CHANGED_SECONDS.observe(time.perf_counter() - begin)
+        return changed
 
 
@@ -25,3 +25,14 @@ class DeployModeError(Exception):
 
 class DuplicatedError(Exception):
     pass
+
+
+class BulkJobError(ValueError):
+    """ Rows of a bulk job operation are invalid, nothing was written
+
+    :param errors: list of (row index, message)
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        messages = '; '.join('#%s: %s' % (index, message) for index, message in errors[:10])
+        super(BulkJobError, self).__init__(u'%s invalid rows, %s' % (len(errors), messages))
@@ -0,0 +1,286 @@
+import json
+import time
+import bisect
+import logging
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+__all__ = (
+    'Counter', 'Histogram', 'MetricsRegistry', 'BaseMetricsExporter', 'LocalMetricsExporter',
+    'RedisMetricsExporter', 'registry', 'get_metrics_exporter', 'flush', 'render_text',
+)
+
+logger = logging.getLogger("celery.worker")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric<%s> labels must be %s' % (self.name, self.labelnames))
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self, values):
+        """ (sample name, labels, value) of the values stored in the registry """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        if value:
+            self.registry.add(self.name, self._key(labels), value)
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """ Cumulative buckets of Prometheus, `observe` only increases counters, so the values of beats can be summed """
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        self.registry.add(self.name, key + ('le', index), 1)
+        self.registry.add(self.name, key + ('sum', ), value)
+
+    def samples(self, values):
+        size = len(self.labelnames)
+        grouped = {}
+
+        for key, value in values.items():
+            grouped.setdefault(key[:size], {})[key[size:]] = value
+
+        for key, group in grouped.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+
+            for index, bound in enumerate(self.buckets + (float('inf'), )):
+                cumulative += group.get(('le', index), 0)
+                yield self.name + '_bucket', dict(labels, le=format_value(bound)), cumulative
+
+            yield self.name + '_sum', labels, group.get(('sum', ), 0)
+            yield self.name + '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """ Counters and histograms of this process, all values only increase """
+
+    def __init__(self):
+        self.metrics = {}
+        self._values = {}  # metric name -> {key: value}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(self, name, documentation, labelnames, buckets=buckets))
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add(self, name, key, value):
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def snapshot(self):
+        """ {metric name: {key: value}}, a copy """
+        with self._lock:
+            return {name: dict(values) for name, values in self._values.items()}
+
+
+class BaseMetricsExporter:
+    """ Export the metrics of beat and collect them for the Prometheus endpoint
+
+    `export` is called by beat every `DJANGO_CELERY_JOBS_METRICS_EXPORT_INTERVAL` seconds,
+    `collect` is called by the endpoint, which may run in another process.
+    """
+
+    warning = None  # Rendered as a comment by the endpoint
+
+    def export(self, registry):
+        pass
+
+    def collect(self, registry):
+        """ Returns {metric name: {key: value}} """
+        return registry.snapshot()
+
+
+class LocalMetricsExporter(BaseMetricsExporter):
+    """ The endpoint shows the metrics of its own process, for beat embedded in the web process and tests """
+    warning = 'The local metrics exporter only shows the metrics of this process, not of beat running elsewhere'
+
+
+class RedisMetricsExporter(BaseMetricsExporter):
+    """ The increments since the last export are added into a redis hash, the metrics of all beats are summed """
+
+    def __init__(self, redis_conn=None, key='django_celery_jobs:metrics'):
+        self._redis_conn = redis_conn
+        self.key = key
+        self._exported = {}
+
+    @property
+    def redis_conn(self):
+        if self._redis_conn is None:
+            from .notifier import get_redis_connection
+
+            self._redis_conn = get_redis_connection()
+
+        return self._redis_conn
+
+    def export(self, registry):
+        snapshot = registry.snapshot()
+        pipe = self.redis_conn.pipeline(transaction=False)
+        increments = 0
+
+        for name, values in snapshot.items():
+            exported = self._exported.get(name, {})
+
+            for key, value in values.items():
+                delta = value - exported.get(key, 0)
+
+                if delta:
+                    pipe.hincrbyfloat(self.key, json.dumps([name, key]), delta)
+                    increments += 1
+
+        if increments:
+            pipe.execute()
+
+        self._exported = snapshot
+
+    def collect(self, registry):
+        values = {}
+
+        for field, value in self.redis_conn.hgetall(self.key).items():
+            name, key = json.loads(field)
+            values.setdefault(name, {})[tuple(key)] = float(value)
+
+        return values
+
+
+registry = MetricsRegistry()
+
+BEAT_TICK_SECONDS = registry.histogram(
+    'django_celery_jobs_beat_tick_seconds', 'Duration of a beat tick')
+BEAT_ENTRIES_EVALUATED = registry.counter(
+    'django_celery_jobs_beat_entries_evaluated_total', 'Entries whose run time was up and were evaluated')
+BEAT_LOCKS = registry.counter(
+    'django_celery_jobs_beat_locks_total', 'Distributed locks of the due entries', ('result', ))
+BEAT_SCHEDULE_CHANGED_SECONDS = registry.histogram(
+    'django_celery_jobs_beat_schedule_changed_seconds', 'Duration of schedule_changed, including the job sync')
+BEAT_LATENESS_SECONDS = registry.histogram(
+    'django_celery_jobs_beat_lateness_seconds', 'Dispatch time minus the scheduled time of an entry')
+DISPATCH_SECONDS = registry.histogram(
+    'django_celery_jobs_dispatch_seconds', 'Duration of sending a task to its broker', ('broker', ))
+DISPATCH_FAILURES = registry.counter(
+    'django_celery_jobs_dispatch_failures_total', 'Tasks failed to be sent to their broker', ('broker', ))
+
+_exporter = None
+_exported_at = 0
+
+
+def get_metrics_exporter():
+    """ The exporter set by `DJANGO_CELERY_JOBS_METRICS_EXPORTER`: 'redis', 'local' or a dotted path.
+
+    If it's not set, 'redis' is used when a redis cache is configured, or else 'local' with a warning.
+    """
+    global _exporter
+
+    if _exporter is None:
+        name = getattr(settings, 'DJANGO_CELERY_JOBS_METRICS_EXPORTER', None)
+
+        if name is None:
+            from .notifier import get_redis_connection
+
+            redis_conn = get_redis_connection()
+            name = 'local' if redis_conn is None else 'redis'
+
+            if redis_conn is None:
+                logger.warning('No redis cache for the metrics, %s, set DJANGO_CELERY_JOBS_METRICS_EXPORTER to '
+                               'silence it', LocalMetricsExporter.warning)
+
+        if name == 'redis':
+            _exporter = RedisMetricsExporter(key=getattr(settings, 'DJANGO_CELERY_JOBS_METRICS_KEY', 'django_celery_jobs:metrics'))
+        elif name == 'local':
+            _exporter = LocalMetricsExporter()
+        else:
+            _exporter = import_string(name)()
+
+    return _exporter
+
+
+def flush(force=False):
+    """ Export the metrics if the interval elapsed, beat calls it at every tick """
+    global _exported_at
+
+    now = time.monotonic()
+    interval = getattr(settings, 'DJANGO_CELERY_JOBS_METRICS_EXPORT_INTERVAL', 10)
+
+    if not force and now - _exported_at < interval:
+        return
+
+    _exported_at = now
+
+    try:
+        get_metrics_exporter().export(registry)
+    except Exception:
+        logger.error('Export the metrics failed', exc_info=True)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def render_text(values=None):
+    """ The Prometheus text exposition format (0.0.4) of the metrics """
+    lines = []
+
+    if values is None:
+        exporter = get_metrics_exporter()
+        values = exporter.collect(registry)
+
+        if exporter.warning:
+            lines.append('# WARNING %s' % exporter.warning)
+
+    for name, metric in registry.metrics.items():
+        lines.append('# HELP %s %s' % (name, metric.documentation))
+        lines.append('# TYPE %s %s' % (name, metric.type))
+
+        for sample_name, labels, value in metric.samples(values.get(name, {})):
+            if labels:
+                label_text = ','.join('%s="%s"' % (k, escape_label(v)) for k, v in labels.items())
+                sample_name = '%s{%s}' % (sample_name, label_text)
+
+            lines.append('%s %s' % (sample_name, format_value(value)))
+
+    return '\n'.join(lines) + '\n'
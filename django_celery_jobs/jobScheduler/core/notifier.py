@@ -0,0 +1,248 @@
+import json
+import logging
+import threading
+import warnings
+from collections import deque
+
+import django
+from django.conf import settings
+from django.dispatch import receiver
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils.module_loading import import_string
+
+try:
+    from django.core.cache.backends.redis import RedisCache
+except ModuleNotFoundError:
+    warnings.warn("The version of django you installed is %s" % django.get_version())
+    from django_redis.cache import RedisCache
+
+__all__ = (
+    'get_redis_connection', 'BaseChangeNotifier', 'LocalChangeNotifier', 'RedisChangeNotifier',
+    'get_change_notifier', 'notify_jobs_changed',
+)
+
+logger = logging.getLogger("celery.worker")
+
+
+def get_redis_connection():
+    """ The redis client of `settings.CACHES`, None if no redis cache is configured """
+    try:
+        from django_redis import get_redis_connection as get_django_redis_connection
+
+        return get_django_redis_connection()
+    except (ModuleNotFoundError, NotImplementedError):
+        # default is redis, use raw redis
+        djcache = caches['default']
+        if not isinstance(djcache, RedisCache):
+            try:
+                djcache = caches['redis']
+            except Exception:
+                djcache = None
+
+        if djcache:
+            return djcache._cache.get_client(None, write=True)
+
+    logger.error('Fuck, redis client not find from settings.CACHES')
+
+
+class BaseSubscription:
+    max_messages = 1000  # Drained in one poll, the rest is left to next poll
+
+    def poll(self):
+        """ Drain the received events without blocking
+
+        :return: set of job ids, None if events may be lost and the whole schedule must be checked
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class BaseChangeNotifier:
+    """ Carry the ids of the changed jobs from the api servers to the beats
+
+    Events are lossy: a beat which is down or disconnected misses them, so it must still check
+    the whole schedule at a long interval.
+    """
+
+    def publish(self, job_ids):
+        raise NotImplementedError
+
+    def subscribe(self):
+        """ Returns a subscription, the events published after it are received by its `poll` """
+        raise NotImplementedError
+
+    def publish_on_commit(self, job_ids):
+        """ Publish after the current transaction was committed, beat mustn't read the jobs before it """
+        job_ids = [job_id for job_id in job_ids if job_id is not None]
+
+        if job_ids:
+            transaction.on_commit(lambda: self._safe_publish(job_ids))
+
+    def _safe_publish(self, job_ids):
+        try:
+            self.publish(job_ids)
+        except Exception:
+            logger.error('Publish the changed jobs<%s> failed', job_ids[:10], exc_info=True)
+
+    @staticmethod
+    def dumps(job_ids):
+        return json.dumps({'jobs': sorted(job_ids)})
+
+    @staticmethod
+    def loads(message):
+        return set(json.loads(message)['jobs'])
+
+
+class LocalSubscription(BaseSubscription):
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self.events = deque()
+
+    def poll(self):
+        job_ids = set()
+
+        for _ in range(self.max_messages):
+            try:
+                job_ids.update(self.events.popleft())
+            except IndexError:
+                break
+
+        return job_ids
+
+    def close(self):
+        self.notifier.unsubscribe(self)
+
+
+class LocalChangeNotifier(BaseChangeNotifier):
+    """ In-process bus, the beat must run in the same process with the writers, e.g. tests """
+
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def publish(self, job_ids):
+        job_ids = list(job_ids)
+
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.events.append(job_ids)
+
+    def subscribe(self):
+        subscription = LocalSubscription(self)
+
+        with self._lock:
+            self._subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+
+class RedisSubscription(BaseSubscription):
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self.pubsub = None
+        self.connect()
+
+    def connect(self):
+        # Not `ignore_subscribe_messages`, `get_message` returns None for an ignored message, `poll` would stop at it
+        self.pubsub = self.notifier.redis_conn.pubsub()
+        self.pubsub.subscribe(self.notifier.channel)
+
+    def poll(self):
+        job_ids = set()
+
+        try:
+            if self.pubsub is None:
+                self.connect()
+                return None  # Events were lost while disconnected
+
+            for _ in range(self.max_messages):
+                message = self.pubsub.get_message(timeout=0)
+                if message is None:
+                    break
+
+                if message['type'] == 'message':
+                    job_ids.update(self.notifier.loads(message['data']))
+        except Exception:
+            logger.error('Receive the changed jobs failed', exc_info=True)
+            self.close()
+            return None
+
+        return job_ids
+
+    def close(self):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except Exception:
+                pass
+
+            self.pubsub = None
+
+
+class RedisChangeNotifier(BaseChangeNotifier):
+    """ Redis pub/sub on `channel`, every beat subscribes to it """
+
+    def __init__(self, redis_conn=None, channel='django_celery_jobs:schedule_changes'):
+        self._redis_conn = redis_conn
+        self.channel = channel
+
+    @property
+    def redis_conn(self):
+        if self._redis_conn is None:
+            self._redis_conn = get_redis_connection()
+
+        return self._redis_conn
+
+    def publish(self, job_ids):
+        self.redis_conn.publish(self.channel, self.dumps(job_ids))
+
+    def subscribe(self):
+        return RedisSubscription(self)
+
+
+_notifier = None
+
+
+def get_change_notifier():
+    """ The notifier set by `DJANGO_CELERY_JOBS_CHANGE_NOTIFIER`: 'redis', 'local' or a dotted path,
+        None(default) disables it and beat polls the database at every tick.
+    """
+    global _notifier
+
+    if _notifier is None:
+        name = getattr(settings, 'DJANGO_CELERY_JOBS_CHANGE_NOTIFIER', None)
+
+        if not name:
+            return None
+
+        if name == 'redis':
+            _notifier = RedisChangeNotifier(
+                channel=getattr(settings, 'DJANGO_CELERY_JOBS_CHANGE_CHANNEL', 'django_celery_jobs:schedule_changes'),
+            )
+        elif name == 'local':
+            _notifier = LocalChangeNotifier()
+        else:
+            _notifier = import_string(name)()
+
+    return _notifier
+
+
+def notify_jobs_changed(job_ids):
+    notifier = get_change_notifier()
+
+    if notifier is not None:
+        notifier.publish_on_commit(job_ids)
+
+
+@receiver([post_save, post_delete], sender='django_celery_jobs.JobPeriodicModel')
+def notify_job_changed(sender, instance, **kwargs):
+    notify_jobs_changed([instance.pk])
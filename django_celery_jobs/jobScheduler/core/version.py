@@ -0,0 +1,88 @@
+import time
+import random
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.dispatch import receiver
+from django.core.cache import caches
+from django.db import transaction, DatabaseError
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+
+__all__ = ('ScheduleVersion', 'schedule_version')
+
+logger = logging.getLogger("celery.worker")
+
+
+class ScheduleVersion:
+    """ A counter bumped by every change of the jobs, the beat syncs the jobs only when it was changed
+
+    The counter is kept in the cache if it is shared by processes (redis), else in the single row
+    of JobScheduleVersionModel. Only equality is compared: a counter lost by the cache eviction starts
+    again from a time-based random seed, not 1, so it never returns to a version a beat has seen.
+
+    :param backend: 'cache' | 'db' | None, None is 'cache' when the cache is redis
+    :param cache_alias: str, alias of settings.CACHES
+    """
+    key = 'django_celery_jobs:schedule_version'
+    row_id = 1
+
+    def __init__(self, backend=None, cache_alias='default'):
+        self._backend = backend
+        self.cache_alias = cache_alias
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            cache = caches[self.cache_alias]
+            is_shared = 'redis' in cache.__class__.__module__.lower()
+            self._backend = 'cache' if is_shared else 'db'
+
+        return self._backend
+
+    def get(self):
+        """ Returns the current version, None if it has never been bumped """
+        if self.backend == 'cache':
+            return caches[self.cache_alias].get(self.key)
+
+        model = apps.get_model('django_celery_jobs', 'JobScheduleVersionModel')
+        return model.objects.filter(id=self.row_id).values_list('version', flat=True).first()
+
+    @staticmethod
+    def new_seed():
+        """ Milliseconds in the high bits and random low bits, fits in the 64-bit integer of redis `INCR` """
+        return (int(time.time() * 1000) << 20) + random.getrandbits(20)
+
+    def bump(self):
+        """ Bump it after the current transaction was committed, the beat mustn't read the version
+            of a change before the change itself is visible.
+        """
+        transaction.on_commit(self._bump)
+
+    def _bump(self):
+        try:
+            if self.backend == 'cache':
+                cache = caches[self.cache_alias]
+
+                if not cache.add(self.key, self.new_seed(), timeout=None):
+                    cache.incr(self.key)
+            else:
+                model = apps.get_model('django_celery_jobs', 'JobScheduleVersionModel')
+
+                if not model.objects.filter(id=self.row_id).update(version=F('version') + 1):
+                    model.objects.get_or_create(id=self.row_id, defaults=dict(version=self.new_seed()))
+        except (ValueError, DatabaseError):
+            logger.error('Bump the schedule version failed', exc_info=True)
+
+
+schedule_version = ScheduleVersion(
+    backend=getattr(settings, 'DJANGO_CELERY_JOBS_SCHEDULE_VERSION_BACKEND', None),
+    cache_alias=getattr(settings, 'DJANGO_CELERY_JOBS_SCHEDULE_VERSION_CACHE', 'default'),
+)
+
+
+@receiver([post_save, post_delete], sender='django_celery_jobs.JobPeriodicModel')
+@receiver([post_save, post_delete], sender='django_celery_jobs.JobConfigModel')
+def bump_schedule_version(sender, **kwargs):
+    schedule_version.bump()
@@ -0,0 +1,152 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+import traceback
+
+from django.db import close_old_connections, connection
+
+__all__ = ('BufferedWriter', )
+
+logger = logging.getLogger("celery.worker")
+
+
+class BufferedWriter:
+    """ Buffer model rows in a bounded queue, a background thread writes them with `bulk_create`
+
+    :param model: django model class of the rows
+    :param builder: callable(**kwargs) -> unsaved model instance, default is the model class
+    :param batch_size: int, maximum rows of one `bulk_create`
+    :param flush_interval: float, seconds, maximum time a row waits in the buffer
+    :param maxsize: int, capacity of the queue
+    :param put_timeout: float, seconds to block the caller when the queue is full,
+        the row is dropped and counted after it, 0 is to drop at once
+    """
+    _STOP = object()
+
+    def __init__(self, model, builder=None, batch_size=200, flush_interval=1.0, maxsize=10000, put_timeout=0):
+        self.model = model
+        self.builder = builder or model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+
+        self.written = self.dropped = self.failed = 0
+
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize)
+        self._atexit_registered = False
+
+    def put(self, **kwargs):
+        """ Returns False if the row is dropped because the buffer is full """
+        self._ensure_started()
+
+        try:
+            if self.put_timeout:
+                self._queue.put(kwargs, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(kwargs)
+        except queue.Full:
+            self.dropped += 1
+
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning('BufferedWriter<%s> is full, %s rows dropped', self.model.__name__, self.dropped)
+            return False
+
+        return True
+
+    def stop(self, timeout=None):
+        """ Drain the buffered rows to database and stop the background thread """
+        thread = self._thread
+
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        return dict(
+            queued=self._queue.qsize(), written=self.written,
+            dropped=self.dropped, failed=self.failed,
+        )
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        thread = self._thread
+
+        if thread is not None and thread.is_alive() and self._pid == pid:
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+                return
+
+            # After fork, the rows buffered belong to the parent process
+            if self._pid is not None and self._pid != pid:
+                self._queue = queue.Queue(self.maxsize)
+
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='BufferedWriter', daemon=True)
+            self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.stop, timeout=5)
+                self._atexit_registered = True
+
+    def _run(self):
+        try:
+            stopping = False
+
+            while not stopping:
+                batch, stopping = self._take()
+                batch and self._write(batch)
+        finally:
+            connection.close()
+
+    def _take(self):
+        """ Block for the first row, then collect rows until the batch is full or `flush_interval` passed """
+        batch = []
+        deadline = None
+
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if item is self._STOP:
+                # Drain all rows which are still in the queue
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        return batch, True
+
+                    if item is not self._STOP:
+                        batch.append(item)
+
+            batch.append(item)
+            deadline = deadline or time.monotonic() + self.flush_interval
+
+        return batch, False
+
+    def _write(self, batch):
+        close_old_connections()
+
+        try:
+            objs = [self.builder(**kwargs) for kwargs in batch]
+            self.model.objects.bulk_create(objs, batch_size=self.batch_size)
+            self.written += len(objs)
+        except Exception:
+            self.failed += len(batch)
+            logger.error(traceback.format_exc())
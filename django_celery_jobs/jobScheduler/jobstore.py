@@ -5,9 +5,12 @@ from collections import OrderedDict
 from django.utils import timezone
 from django.db import transaction, DatabaseError
 from django.core.exceptions import ObjectDoesNotExist
-from django_celery_beat.models import PeriodicTask
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
 
 from .trigger.base import BaseTrigger
+from .core.exceptions import BulkJobError
+from .core.version import schedule_version
+from .core.notifier import notify_jobs_changed
 from ..models import JobPeriodicModel, BeatPeriodicTaskModel
 
 __all__ = ('JobStore', )
@@ -18,7 +21,7 @@ class JobStore:
         self.job_id = options.pop("job_id", None)
         self.trigger = options.pop('trigger', None)
 
-        if isinstance(self.trigger, BaseTrigger):
+        if not isinstance(self.trigger, BaseTrigger):
             raise ValueError("trigger must be instance of BaseTrigger's subclass")
 
         self._options = deepcopy(options)
@@ -91,6 +94,7 @@ class JobStore:
     def _get_beat_task_opts(self, **options):
         approved = self._init_model_default(model_or_object=PeriodicTask)
         approved.update(
+            task=options.pop('task', approved['task']),
             priority=options.pop('priority', approved['priority']),
             exchange=options.pop('exchange', approved['exchange']),
             routing_key=options.pop('routing_key', approved['routing_key']),
@@ -177,18 +181,213 @@ class JobStore:
             beat_task.save()
             self.job.save()
 
+    @classmethod
+    def add_jobs(cls, stores, batch_size=500, rows=None):
+        """ Create the jobs of many JobStore in one transaction
+
+        All rows are validated before writing, then PeriodicTask and JobPeriodicModel are
+        created by `bulk_create`, the beat is notified once instead of once per row.
+
+        :param stores: list of JobStore, made like `add_job`
+        :param rows: list, row numbers of the stores reported by BulkJobError, default is the indexes
+        :return: list of created JobPeriodicModel
+        """
+        beat_tasks, jobs, indexes, errors = [], [], [], []
+
+        for index, store in zip(rows or range(len(stores)), stores):
+            try:
+                store.trigger.get_next_run_time()  # Invalid cron expression raises
+                beat_task = PeriodicTask(**store._get_beat_task_opts(**store._options))
+                cls._clean_beat_task(beat_task)
+
+                job = JobPeriodicModel(**store._get_job_opts(**store._options))
+            except Exception as e:
+                errors.append((index, str(e)))
+                continue
+
+            beat_tasks.append(beat_task)
+            jobs.append(job)
+            indexes.append(index)
+
+        errors.extend(cls._check_unique(PeriodicTask, 'name', zip(indexes, [task.name for task in beat_tasks])))
+        errors.extend(cls._check_unique(JobPeriodicModel, 'title', zip(indexes, [job.title for job in jobs])))
+
+        if errors:
+            raise BulkJobError(sorted(errors))
+
+        with transaction.atomic():
+            PeriodicTask.objects.bulk_create(beat_tasks, batch_size=batch_size)
+
+            # MySQL doesn't return the primary keys of bulk_create
+            if any(task.pk is None for task in beat_tasks):
+                task_ids = cls._values_in(PeriodicTask, 'name', [task.name for task in beat_tasks], 'id')
+                for task in beat_tasks:
+                    task.pk = task_ids[task.name]
+
+            for task, job in zip(beat_tasks, jobs):
+                job.periodic_task_id = task.pk
+
+            JobPeriodicModel.objects.bulk_create(jobs, batch_size=batch_size)
+
+            if any(job.pk is None for job in jobs):
+                job_ids = cls._values_in(JobPeriodicModel, 'title', [job.title for job in jobs], 'id')
+                for job in jobs:
+                    job.pk = job_ids[job.title]
+
+            if beat_tasks:
+                PeriodicTasks.update_changed()
+                schedule_version.bump()  # `bulk_create` doesn't send signals
+                notify_jobs_changed([job.pk for job in jobs])
+
+        return jobs
+
+    @classmethod
+    def modify_jobs(cls, stores, batch_size=500, rows=None):
+        """ Update the jobs of many JobStore (made like `update_job`) with `bulk_update` in one transaction
+
+        :param rows: list, row numbers of the stores reported by BulkJobError, default is the indexes
+        """
+        job_ids = [store.job_id for store in stores]
+        queryset = JobPeriodicModel.objects.filter(**cls._job_lookup_kwargs()).select_related('periodic_task')
+        jobs = {}
+
+        for i in range(0, len(job_ids), batch_size):
+            jobs.update(queryset.in_bulk(job_ids[i:i + batch_size]))
+
+        now = timezone.now()
+        changed = OrderedDict([(PeriodicTask, ({}, set())), (JobPeriodicModel, ({}, set()))])
+        names, titles, errors = [], [], []
+
+        for index, store in zip(rows or range(len(stores)), stores):
+            job = store._job_instance = jobs.get(store.job_id)
+
+            if job is None:
+                errors.append((index, "JobPeriodicModel<id:%s> not exist" % store.job_id))
+                continue
+
+            try:
+                model_opts = [(job, store._get_job_opts(**store._options))]
+                if job.periodic_task:
+                    model_opts.append((job.periodic_task, store._get_beat_task_opts(**store._options)))
+            except Exception as e:
+                errors.append((index, str(e)))
+                continue
+
+            for orm_object, approved_opts in model_opts:
+                objects, fields = changed[orm_object.__class__]
+                objects[orm_object.pk] = orm_object
+
+                for name, new_value in approved_opts.items():
+                    if new_value and getattr(orm_object, name) != new_value:
+                        setattr(orm_object, name, new_value)
+                        fields.add(name)
+
+            titles.append((index, job.title))
+            job.periodic_task and names.append((index, job.periodic_task.name))
+
+        errors.extend(cls._check_unique(PeriodicTask, 'name', names, exclude_ids=changed[PeriodicTask][0]))
+        errors.extend(cls._check_unique(JobPeriodicModel, 'title', titles, exclude_ids=jobs))
+
+        if errors:
+            raise BulkJobError(sorted(errors))
+
+        with transaction.atomic():
+            for model, (objects, fields) in changed.items():
+                if not fields:
+                    continue
+
+                # `bulk_update` doesn't set auto_now fields
+                auto_now_fields = [f.name for f in model._meta.fields if getattr(f, 'auto_now', False)]
+                for orm_object in objects.values():
+                    for name in auto_now_fields:
+                        setattr(orm_object, name, now)
+
+                model.objects.bulk_update(objects.values(), sorted(fields.union(auto_now_fields)), batch_size=batch_size)
+
+            # A change of the jobs only bumps the version, the beats sync the rows and drop their resolved tasks
+            changed[PeriodicTask][1] and PeriodicTasks.update_changed()
+            changed[JobPeriodicModel][1] and schedule_version.bump()
+
+            if changed[PeriodicTask][1] or changed[JobPeriodicModel][1]:
+                notify_jobs_changed(list(changed[JobPeriodicModel][0]))
+
+        return [store.job for store in stores]
+
+    @classmethod
+    def remove_jobs(cls, job_ids):
+        """ Soft delete the jobs and disable their beat tasks with two UPDATE, returns the count of removed jobs """
+        queryset = JobPeriodicModel.objects.filter(id__in=job_ids, is_del=False)
+
+        with transaction.atomic():
+            PeriodicTask.objects\
+                .filter(id__in=queryset.exclude(periodic_task_id=None).values('periodic_task_id'))\
+                .update(enabled=False, date_changed=timezone.now())
+            count = queryset.update(is_del=True, is_enabled=False, update_time=timezone.now())
+
+            if count:
+                PeriodicTasks.update_changed()
+                schedule_version.bump()
+                notify_jobs_changed(job_ids)
+
+        return count
+
+    @staticmethod
+    def _clean_beat_task(beat_task):
+        """ The same as `PeriodicTask.save`, but no query is made """
+        beat_task.exchange = beat_task.exchange or None
+        beat_task.routing_key = beat_task.routing_key or None
+        beat_task.queue = beat_task.queue or None
+        beat_task.headers = beat_task.headers or None
+
+        if not beat_task.enabled:
+            beat_task.last_run_at = None
+
+        beat_task._clean_expires()
+
+    @classmethod
+    def _check_unique(cls, model, field_name, indexed_values, exclude_ids=()):
+        """ Returns (row index, message) of the values duplicated in the rows or with the database
+
+        :param indexed_values: iterable of (row index, value)
+        :param exclude_ids: primary keys of the rows being updated, they don't conflict with themselves
+        """
+        errors, seen = [], {}
+
+        for index, value in indexed_values:
+            if value in seen:
+                errors.append((index, '%s<%s> is duplicated with row %s' % (field_name, value, seen[value])))
+            seen.setdefault(value, index)
+
+        existed = cls._values_in(model, field_name, list(seen), 'id')
+        for value, pk in existed.items():
+            if pk not in exclude_ids:
+                errors.append((seen[value], '%s<%s> already exists' % (field_name, value)))
+
+        return errors
+
+    @staticmethod
+    def _values_in(model, field_name, values, value_field, batch_size=500):
+        """ {field value: value_field} of the rows, queried in chunks to bound the count of SQL parameters """
+        result = {}
+
+        for i in range(0, len(values), batch_size):
+            lookup = {field_name + '__in': values[i:i + batch_size]}
+            result.update(model.objects.filter(**lookup).values_list(field_name, value_field))
+
+        return result
+
+    @staticmethod
+    def _job_lookup_kwargs():
+        return dict(periodic_task_id__gt=0, is_enabled=True, is_del=False)
+
     def _lookup_job(self, job_ids=None):
-        q = dict(
-            periodic_task_id__gt=0,
-            is_enabled=True, is_del=False
-        )
-        queryset = JobPeriodicModel.objects.filter(**q).all()
+        queryset = JobPeriodicModel.objects.filter(**self._job_lookup_kwargs()).all()
 
         if job_ids is None:  # All jobs
             return queryset
 
         if isinstance(job_ids, (list, tuple)):
-            return queryset.filetr(id__in=job_ids)
+            return queryset.filter(id__in=job_ids)
 
         assert isinstance(job_ids, int), ValueError('Parameter `job_ids` type not allowed')
         return queryset.filter(id=job_ids).first()
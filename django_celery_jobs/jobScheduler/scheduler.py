@@ -7,6 +7,7 @@ from tzlocal import get_localzone
 from .jobstore import JobStore
 from .trigger.base import BaseTrigger
 from .trigger.cron import CronTrigger
+from .core.exceptions import BulkJobError
 from .core.celery.utils import get_celery_app, autodiscover_tasks
 from ..models import CeleryNativeTaskModel
 
@@ -79,12 +80,42 @@ class JobSchedulerHandler:
     def remove_job(self, job_id):
         return self._lookup_jobstore(job_id=job_id).remove_job()
 
+    def add_jobs(self, iterable, rows=None):
+        """ Create many jobs in one transaction, each item is the options of `add_job` """
+        stores, rows = self._lookup_jobstores(iterable, rows=rows)
+        return self.JOBSTORE_CLASS.add_jobs(stores, rows=rows)
+
+    def modify_jobs(self, iterable, rows=None):
+        """ Update many jobs in one transaction, each item is the options of `modify_job` with `job_id` """
+        stores, rows = self._lookup_jobstores(iterable, rows=rows)
+        return self.JOBSTORE_CLASS.modify_jobs(stores, rows=rows)
+
+    def remove_jobs(self, job_ids):
+        return self.JOBSTORE_CLASS.remove_jobs(list(job_ids))
+
     def _lookup_jobstore(self, **opts):
         trigger = opts.pop('trigger', 'cron')
         trigger = self._create_trigger(trigger, **opts)
 
         return self.JOBSTORE_CLASS(trigger=trigger, **opts)
 
+    def _lookup_jobstores(self, iterable, rows=None):
+        """ Returns the stores and their row numbers, the rows whose store can't be made are raised by BulkJobError """
+        options_list = list(iterable)
+        rows = rows or list(range(len(options_list)))
+        stores, errors = [], []
+
+        for row, options in zip(rows, options_list):
+            try:
+                stores.append(self._lookup_jobstore(**options))
+            except Exception as e:
+                errors.append((row, str(e)))
+
+        if errors:
+            raise BulkJobError(errors)
+
+        return stores, rows
+
     def _create_trigger(self, trigger=None, **options):
         if isinstance(trigger, BaseTrigger):
             return trigger
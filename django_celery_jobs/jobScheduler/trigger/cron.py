@@ -1,12 +1,18 @@
 import six
+import time
+import threading
 from collections import OrderedDict
 from croniter import croniter
 
 from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
 from django.utils import timezone as tzinfo
+from django.db.models.signals import post_save, post_delete
 from django_celery_beat.models import CrontabSchedule
 
 from .base import BaseTrigger
+from .cronexpr import compile_cron
 
 __all__ = ['CronTrigger']
 
@@ -25,6 +31,12 @@ class CronTrigger(BaseTrigger):
     ORDERED_FIELDS = ('minute', 'hour', 'day_of_month', 'month_of_year', 'day_of_week')
     __slots__ = ORDERED_FIELDS + ('expression', 'timezone')
 
+    # (expression, timezone) -> CrontabSchedule id, the whole table is loaded at the first use
+    CRONTAB_CACHE = {}
+    CRONTAB_CACHE_TTL = getattr(settings, 'DJANGO_CELERY_JOBS_CRONTAB_CACHE_TTL', 600)
+    _crontab_cache_loaded = None
+    _crontab_cache_lock = threading.Lock()
+
     def __init__(self, minute=None, hour=None, day_of_month=None, month_of_year=None,
                  day_of_week=None, timezone=None, **kwargs):
         self.timezone = timezone or settings.TIME_ZONE
@@ -49,36 +61,99 @@ class CronTrigger(BaseTrigger):
                    month_of_year=values[3], day_of_week=values[4], timezone=timezone)
 
     def get_next_run_time(self, now=None):
-        cron = croniter(self.expression, now or tzinfo.datetime.now())
-        return cron.get_next(tzinfo.datetime)
+        return self.get_run_times(1, now=now)[0]
 
     def get_last_run_time(self, max_times, now=None):
-        last_run_time = None
-        cron = croniter(self.expression, now or tzinfo.datetime.now())
+        return self.get_nth_run_time(max_times, now=now) if max_times else None
 
-        for _ in range(max_times):
-            last_run_time = cron.get_next(tzinfo.datetime)
+    def get_next_time_range(self, max_times=None, now=None, fmt=False):
+        next_time_list = self.get_run_times(max_times or self.max_times, now=now)
 
-        return last_run_time
+        if fmt:
+            return [next_run_time.strftime("%Y-%m-%d %H:%M:%S") for next_run_time in next_time_list]
 
-    def get_next_time_range(self, max_times=None, now=None, fmt=False):
-        next_time_list = []
-        cron = croniter(self.expression, now or tzinfo.datetime.now())
+        return next_time_list
 
-        for i in range(max_times or self.max_times):
-            next_run_time = cron.get_next(tzinfo.datetime)
+    def get_nth_run_time(self, n, now=None):
+        """ Returns the `n`th (from 1) run datetime after `now`, e.g. the deadline of `max_run_cnt` runs
 
-            if fmt:
-                next_time_list.append(next_run_time.strftime("%Y-%m-%d %H:%M:%S"))
-            else:
-                next_time_list.append(next_run_time)
+        The compiled expression counts the runs per month and per day to jump to it,
+        the runs before it are not enumerated.
+        """
+        now = now or tzinfo.datetime.now()
+        compiled = compile_cron(self.expression) if now.tzinfo is None else None
 
-        return next_time_list
+        if compiled is not None:
+            return compiled.get_nth(n, now)
+
+        return self.get_run_times(n, now=now)[-1]
+
+    def get_run_times(self, max_times, now=None):
+        """ Returns the next `max_times` run datetimes after `now`
+
+        The compiled expression produces them in batch, croniter is stepped one by one
+        only for the aware datetime or the expression which can't be compiled (`L`, `#`, ...)
+        """
+        now = now or tzinfo.datetime.now()
+        compiled = compile_cron(self.expression) if now.tzinfo is None else None
+
+        if compiled is not None:
+            return compiled.get_next_range(max_times, now)
+
+        cron = croniter(self.expression, now)
+        return [cron.get_next(tzinfo.datetime) for _ in range(max_times)]
 
     def get_trigger_schedule(self):
-        obj, created = CrontabSchedule.objects.get_or_create(**self._crons, timezone=self.timezone)
-        return dict(crontab_id=obj.id)
+        self.warm_crontab_cache()
+
+        key = (self.expression, str(self.timezone))
+        crontab_id = self.CRONTAB_CACHE.get(key)
+
+        if crontab_id is None:
+            obj, created = CrontabSchedule.objects.get_or_create(**self._crons, timezone=self.timezone)
+            crontab_id = obj.id
+
+            # The row may be created by the current transaction, it's unknown to others until committed,
+            # and a rolled back id must never be cached
+            transaction.on_commit(lambda: self.CRONTAB_CACHE.__setitem__(key, crontab_id))
+
+        return dict(crontab_id=crontab_id)
+
+    @classmethod
+    def warm_crontab_cache(cls, force=False):
+        """ Load all CrontabSchedule ids with one query, it's loaded again after `CRONTAB_CACHE_TTL`
+            seconds to drop the crontabs deleted by other processes.
+        """
+        loaded = cls._crontab_cache_loaded
+        if not force and loaded is not None and time.monotonic() - loaded < cls.CRONTAB_CACHE_TTL:
+            return
+
+        with cls._crontab_cache_lock:
+            if not force and cls._crontab_cache_loaded is not loaded:
+                return  # Loaded by another thread
+
+            crontab_ids = {}
+            queryset = CrontabSchedule.objects.order_by('-id').values_list('id', 'timezone', *cls.ORDERED_FIELDS)
+
+            # Ordered by -id, the smallest id wins if the crontabs are duplicated
+            for crontab_id, timezone, *crons in queryset.iterator():
+                crontab_ids[(" ".join(crons), str(timezone))] = crontab_id
+
+            cls.CRONTAB_CACHE = crontab_ids
+            cls._crontab_cache_loaded = time.monotonic()
+
+    @classmethod
+    def invalidate_crontab(cls, crontab_id):
+        """ The crontab was edited or deleted """
+        for key, value in list(cls.CRONTAB_CACHE.items()):
+            if value == crontab_id:
+                cls.CRONTAB_CACHE.pop(key, None)
 
     def __str__(self):
         return '<%s>: %s' % (self.timezone, self.expression)
 
+
+@receiver([post_save, post_delete], sender=CrontabSchedule)
+def invalidate_crontab_cache(sender, instance, created=False, **kwargs):
+    if not created:
+        CronTrigger.invalidate_crontab(instance.id)
@@ -0,0 +1,207 @@
+import calendar
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from croniter import croniter, CroniterBadDateError
+
+from ..core.cache import LRUCache
+
+__all__ = ('CompiledCron', 'compile_cron')
+
+# Years searched without any occurrence before giving up, the same as croniter
+MAX_YEARS_BETWEEN_MATCHES = 50
+
+
+class CompiledCron:
+    """ A 5-field crontab expression compiled into per-field bitsets
+
+    The expression is parsed by `croniter.expand`, so the syntax and errors are the same as croniter.
+    Days of a month are a 31-bit mask (bit 0 is day 1), the matched days of a month are one AND/OR
+    of the masks, and every matched day yields all its (hour, minute) offsets in one batch.
+
+    Expressions using `L`, `#` or `W` are not compiled, `CompiledCron.compile` returns None for them.
+    """
+    __slots__ = ('expression', 'months', 'day_offsets', 'dom_mask', 'dow_masks', 'day_or', '_month_cache')
+
+    ALL_DAYS = (1 << 31) - 1
+
+    def __init__(self, expression, minutes, hours, days, months, weekdays):
+        self.expression = expression
+        self.months = tuple(sorted(months))
+
+        # Minutes of the day of every firing, e.g. `30 8,20 * * *` -> (510, 1230)
+        self.day_offsets = tuple(sorted(h * 60 + m for h in hours for m in minutes))
+
+        self.dom_mask = self.ALL_DAYS if days is None else sum(1 << (d - 1) for d in days)
+
+        # dow_masks[w]: days of the month matching the weekdays, when day 1 is the weekday w (Monday is 0)
+        self.dow_masks = None
+        if weekdays is not None:
+            cron_weekdays = {(w - 1) % 7 for w in weekdays}  # cron: Sunday is 0 and 7
+            self.dow_masks = tuple(
+                sum(1 << (d - 1) for d in range(1, 32) if (first + d - 1) % 7 in cron_weekdays)
+                for first in range(7)
+            )
+
+        # Like cron, days are matched by either field when both of them are restricted
+        self.day_or = days is not None and weekdays is not None
+        self._month_cache = {}
+
+    @classmethod
+    def compile(cls, expression):
+        """ Returns None when the expression has fields which are not supported """
+        expanded, nth_weekday_of_month = croniter.expand(expression)
+
+        if nth_weekday_of_month or len(expanded) != 5:
+            return None
+
+        fields = []
+        for values in expanded:
+            if any(isinstance(v, str) and v != '*' for v in values):
+                return None  # `L` of day_of_month or day_of_week
+
+            fields.append(None if '*' in values else [int(v) for v in values])
+
+        minutes, hours, days, months, weekdays = fields
+
+        return cls(
+            expression,
+            minutes=range(60) if minutes is None else minutes,
+            hours=range(24) if hours is None else hours,
+            days=days,
+            months=range(1, 13) if months is None else months,
+            weekdays=weekdays,
+        )
+
+    def month_mask(self, year, month):
+        """ Bitset of the days firing in the month """
+        key = (year, month)
+        mask = self._month_cache.get(key)
+
+        if mask is None:
+            first_weekday, days_in_month = calendar.monthrange(year, month)
+            dom_mask = self.dom_mask
+
+            if self.dow_masks is None:
+                mask = dom_mask
+            elif self.day_or:
+                mask = dom_mask | self.dow_masks[first_weekday]
+            else:
+                mask = self.dow_masks[first_weekday]
+
+            mask &= (1 << days_in_month) - 1
+
+            if len(self._month_cache) > 1024:
+                self._month_cache.clear()
+            self._month_cache[key] = mask
+
+        return mask
+
+    def iter_days(self, start):
+        """ Yields the firing dates from the date of `start` (included) """
+        year, month, day = start.year, start.month, start.day
+        last_matched_year = year
+
+        while year - last_matched_year <= MAX_YEARS_BETWEEN_MATCHES:
+            for m in self.months:
+                if m < month:
+                    continue
+
+                d = day if m == month else 1
+                mask = self.month_mask(year, m) >> (d - 1)
+
+                while mask:
+                    skipped = (mask & -mask).bit_length() - 1  # Jump to the lowest set bit
+                    d += skipped
+                    last_matched_year = year
+                    yield datetime(year, m, d)
+
+                    mask >>= skipped + 1
+                    d += 1
+
+            year, month, day = year + 1, 1, 1
+
+        raise CroniterBadDateError('failed to find next date')
+
+    def get_next_range(self, max_times, start):
+        """ Returns `max_times` firing datetimes strictly after `start` (naive datetime) """
+        start = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        first_offset = start.hour * 60 + start.minute
+
+        offsets = self.day_offsets
+        deltas = [timedelta(minutes=offset) for offset in offsets]
+
+        results = []
+        start_date = datetime(start.year, start.month, start.day)
+
+        for day in self.iter_days(start_date):
+            index = bisect_left(offsets, first_offset) if day == start_date else 0
+            results.extend(day + delta for delta in deltas[index:max_times - len(results) + index])
+
+            if len(results) >= max_times:
+                break
+
+        return results
+
+    def get_nth(self, n, start):
+        """ Returns the `n`th (from 1) firing datetime after `start` without enumerating the former ones
+
+        Whole months are skipped by the count of their firing days, then the day and the time
+        of the day are located in the month by the quotient and remainder of the count per day.
+        """
+        if n < 1:
+            raise ValueError('n must be greater than 0')
+
+        start = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        offsets = self.day_offsets
+        per_day = len(offsets)
+
+        # The partial first day
+        start_date = datetime(start.year, start.month, start.day)
+        if start.month in self.months and self.month_mask(start.year, start.month) >> (start.day - 1) & 1:
+            index = bisect_left(offsets, start.hour * 60 + start.minute)
+
+            if n <= per_day - index:
+                return start_date + timedelta(minutes=offsets[index + n - 1])
+            n -= per_day - index
+
+        # From the next day on, whole days and months
+        next_date = start_date + timedelta(days=1)
+        year, month, day = next_date.year, next_date.month, next_date.day
+        last_matched_year = year
+
+        while year - last_matched_year <= MAX_YEARS_BETWEEN_MATCHES:
+            for m in self.months:
+                if m < month:
+                    continue
+
+                d = day if m == month else 1
+                mask = self.month_mask(year, m) >> (d - 1)
+                count = bin(mask).count('1') * per_day
+
+                if not count:
+                    continue
+
+                last_matched_year = year
+                if n > count:
+                    n -= count
+                    continue
+
+                day_index, offset_index = divmod(n - 1, per_day)
+                for _ in range(day_index):
+                    mask &= mask - 1  # Clear the lowest set bit
+
+                d += (mask & -mask).bit_length() - 1
+                return datetime(year, m, d) + timedelta(minutes=offsets[offset_index])
+
+            year, month, day = year + 1, 1, 1
+
+        raise CroniterBadDateError('failed to find next date')
+
+
+_compiled_cache = LRUCache(maxsize=256)
+
+
+def compile_cron(expression):
+    """ The cached `CompiledCron` of the expression, None if it can't be compiled """
+    return _compiled_cache.get_or_set(expression, lambda: CompiledCron.compile(expression))
@@ -1,18 +1,82 @@
+import os
+import time
 import socket
+import hashlib
+import platform
 import croniter
 
+from celery.utils.nodenames import default_nodename
+
+from django.conf import settings
 from django.utils import timezone
 
+from .core.cache import LRUCache
+from .trigger.cronexpr import compile_cron
+
+# Process-wide compiled job functions: sha1(func_name + source) -> function
+compiled_func_cache = LRUCache(maxsize=getattr(settings, 'DJANGO_CELERY_JOBS_COMPILED_FUNC_CACHE_SIZE', 1024))
+
 
 def get_ip_addr():
+    """ The ip of the default route, no packet is sent by connecting an udp socket.
+        On air-gapped hosts without the route, the ip resolved by hostname is used.
+    """
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(('8.8.8.8', 80))
-        ip = s.getsockname()[0]
-    finally:
-        s.close()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(('8.8.8.8', 80))
+            return s.getsockname()[0]
+    except OSError:
+        pass
+
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return '127.0.0.1'
+
+
+class HostIdentity:
+    """ system, node and ip of the current process, computed once and refreshed after fork or `ttl` seconds """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+        self._pid = None
+        self._expires = 0
+        self._identity = None
+
+    def get(self):
+        now = time.monotonic()
+
+        if self._identity is None or self._pid != os.getpid() or now > self._expires:
+            self._identity = dict(
+                system=platform.system(),
+                node=default_nodename(None),
+                ip_address=get_ip_addr(),
+            )
+            self._pid = os.getpid()
+            self._expires = now + self.ttl
 
-    return ip
+        return dict(self._identity)
+
+
+host_identity = HostIdentity(ttl=getattr(settings, 'DJANGO_CELERY_JOBS_HOST_IDENTITY_TTL', 300))
+
+
+def compile_func(source_code, func_name):
+    """ Compile the job source code and returns the function named `func_name`,
+        the same source code is parsed and compiled only once per process.
+    """
+    source_code = source_code.strip()
+    key = hashlib.sha1(('%s\0%s' % (func_name, source_code)).encode('utf-8')).hexdigest()
+
+    def _compile():
+        namespace = {'__builtins__': {}}
+        code = compile(source_code, '<job:%s>' % func_name, 'exec')
+        exec(code, namespace)
+
+        return namespace.get(func_name)
+
+    return compiled_func_cache.get_or_set(key, _compile)
 
 
 def get_trigger_next_range(trigger, start_time=None, run_times=None):
@@ -27,12 +91,18 @@ def get_trigger_next_range(trigger, start_time=None, run_times=None):
     if isinstance(start_time, (str, bytes)):
         start_time = timezone.datetime.strptime(start_time, dt_fmt)
 
-    run_time_list = []
     max_times = int(run_times or 10)
+    compiled = compile_cron(" ".join(cron_expr_list)) if start_time.tzinfo is None else None
+
+    if compiled is not None:
+        # All execution times are produced in one batch
+        return [next_run_time.strftime(dt_fmt) for next_run_time in compiled.get_next_range(max_times, start_time)]
+
+    run_time_list = []
     cron = croniter.croniter(" ".join(cron_expr_list), start_time=start_time)
 
     # The latest 10 execution times
-    for i in range(run_times):
+    for i in range(max_times):
         next_run_time = cron.get_next(timezone.datetime)
         run_time_list.append(next_run_time.strftime(dt_fmt))
 
@@ -0,0 +1,61 @@
+import time
+
+from croniter import croniter
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from django_celery_jobs.jobScheduler.trigger.cronexpr import CompiledCron
+
+DEFAULT_EXPRESSIONS = (
+    '* * * * *',
+    '*/5 9-18 * * mon-fri',
+    '30 2 1,15 * *',
+    '0 0 13 * 5',
+    '15 10 * 1,7 1-5',
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the compiled cron expression against croniter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-e', '--expr', action='append', dest='expressions', help='Cron expression, repeatable')
+        parser.add_argument('-n', '--times', type=int, default=1000, help='Occurrences computed in each run')
+        parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs of each expression, the best is reported')
+
+    def handle(self, *args, **options):
+        times, repeat = options['times'], options['repeat']
+        start = timezone.datetime.now()
+
+        self.stdout.write('%-28s %12s %12s %9s' % ('expression', 'croniter(ms)', 'compiled(ms)', 'speedup'))
+
+        for expression in options['expressions'] or DEFAULT_EXPRESSIONS:
+            compiled = CompiledCron.compile(expression)
+            if compiled is None:
+                raise CommandError('Expression <%s> can not be compiled' % expression)
+
+            expected, croniter_cost = self.timeit(repeat, lambda: self.run_croniter(expression, times, start))
+            result, compiled_cost = self.timeit(repeat, lambda: compiled.get_next_range(times, start))
+
+            if result != expected:
+                raise CommandError('Expression <%s>: compiled result differs from croniter' % expression)
+
+            self.stdout.write('%-28s %12.3f %12.3f %8.1fx' % (
+                expression, croniter_cost * 1000, compiled_cost * 1000, croniter_cost / max(compiled_cost, 1e-9)
+            ))
+
+    @staticmethod
+    def run_croniter(expression, times, start):
+        cron = croniter(expression, start)
+        return [cron.get_next(timezone.datetime) for _ in range(times)]
+
+    @staticmethod
+    def timeit(repeat, func):
+        result, best = None, float('inf')
+
+        for _ in range(max(repeat, 1)):
+            begin = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - begin)
+
+        return result, best
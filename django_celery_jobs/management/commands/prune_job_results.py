@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from django_celery_jobs.retention import ResultRetention
+
+
+class Command(BaseCommand):
+    help = 'Roll the old result rows up into hourly and daily rollups, then delete them in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-d', '--days', type=int, default=None, help='Days of the result rows to keep')
+        parser.add_argument('-c', '--chunk-size', type=int, default=None, help='Rows deleted in one transaction')
+        parser.add_argument('-m', '--max-chunks', type=int, default=None, help='Stop after the chunks of each table')
+
+    def handle(self, *args, **options):
+        retention = ResultRetention(
+            days=options['days'], chunk_size=options['chunk_size'], max_chunks=options['max_chunks'],
+        )
+
+        for name, deleted in retention.run().items():
+            self.stdout.write('%s: %s rows deleted' % (name, deleted))
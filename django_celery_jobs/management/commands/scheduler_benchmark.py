@@ -0,0 +1,320 @@
+import gc
+import os
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from datetime import timedelta
+
+import celery
+import django
+from celery import Celery
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from django_celery_beat.models import PeriodicTask, PeriodicTasks, CrontabSchedule, IntervalSchedule
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from django_celery_jobs.models import JobConfigModel, JobPeriodicModel
+from django_celery_jobs.jobScheduler.core import metrics
+from django_celery_jobs.jobScheduler.core.version import schedule_version
+from django_celery_jobs.jobScheduler.core.celery.app import AppDispatcher
+from django_celery_jobs.jobScheduler.core.celery.scheduler import BeatScheduler
+from django_celery_jobs.tasks.task_synchronous_jobs import watch_periodic_tasks
+
+# One function per job, the task name must be registered by the job sync to be sent by AppDispatcher
+TASK_SOURCE_CODE = '''
+def %s(*args, **kwargs):
+    return None
+'''
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+
+    index = min(int(round(q / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Phase:
+    """ Latencies, SQL queries and peak memory of the calls run in a phase """
+
+    def __init__(self, name, trace_memory=True):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.latencies = []
+        self.queries = 0
+        self.peak_memory = None
+        self.extra = {}
+
+        self._wrapper = None
+
+    def __enter__(self):
+        gc.collect()
+        self.trace_memory and tracemalloc.reset_peak()
+
+        self._wrapper = connection.execute_wrapper(self.count_query)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def run(self, func, *args, **kwargs):
+        begin = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - begin)
+
+        return result
+
+    def as_dict(self):
+        latencies = sorted(latency * 1000 for latency in self.latencies)
+        calls = len(latencies)
+
+        return dict(
+            calls=calls,
+            mean_ms=sum(latencies) / calls if calls else None,
+            p50_ms=percentile(latencies, 50),
+            p90_ms=percentile(latencies, 90),
+            p99_ms=percentile(latencies, 99),
+            max_ms=latencies[-1] if calls else None,
+            queries=self.queries,
+            queries_per_call=self.queries / calls if calls else None,
+            peak_memory_kb=self.peak_memory // 1024 if self.peak_memory is not None else None,
+            **self.extra
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the beat scheduler with synthetic jobs seeded into a throwaway SQLite database, '
+        'fakeredis for the locks and the in-memory transport of Celery, the report is JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--size', type=int, action='append', dest='sizes',
+                            help='Jobs seeded, repeatable, default 1000, 10000 and 100000')
+        parser.add_argument('-r', '--repeat', type=int, default=20, help='Calls of sync_jobs or schedule_changed in each phase')
+        parser.add_argument('-t', '--ticks', type=int, default=20, help='Beat ticks run')
+        parser.add_argument('-a', '--apply', type=int, default=200, help='Entries sent by apply_async')
+        parser.add_argument('--changes', type=int, default=10, help='Jobs changed before each schedule_changed')
+        parser.add_argument('--due-ratio', type=float, default=0.01, help='Ratio of the jobs due every 2 seconds')
+        parser.add_argument('--expired-ratio', type=float, default=0.01, help='Ratio of the jobs whose deadline passed')
+        parser.add_argument('--lock-mode', choices=('entry', 'batch', 'lease'), default='batch', help='How beats claim entries')
+        parser.add_argument('--no-memory', action='store_true', help='Not trace the memory, it slows the calls')
+        parser.add_argument('-o', '--output', help='Write the report to the file instead of stdout')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark seeds a throwaway database, run it with a SQLite `DATABASES`')
+
+        if fakeredis is None:
+            raise CommandError('fakeredis is required: pip install fakeredis')
+
+        trace_memory = not options['no_memory']
+        trace_memory and tracemalloc.start()
+
+        report = dict(
+            environment=dict(
+                python=platform.python_version(), django=django.get_version(), celery=celery.__version__,
+                platform=platform.platform(), created=timezone.now().isoformat(),
+            ),
+            options={name: options[name] for name in (
+                'repeat', 'ticks', 'apply', 'changes', 'due_ratio', 'expired_ratio', 'lock_mode',
+            )},
+            runs=[],
+        )
+
+        try:
+            for size in options['sizes'] or (1000, 10000, 100000):
+                self.stderr.write('Benchmark %s jobs ...' % size)
+                report['runs'].append(self.run_size(size, options, trace_memory))
+        finally:
+            trace_memory and tracemalloc.stop()
+
+        output = json.dumps(report, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run_size(self, size, options, trace_memory):
+        old_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+
+        # A file, the in-memory database is kept by the shared cache and not clean for the next size
+        test_settings['NAME'] = os.path.join(tempfile.gettempdir(), 'django_celery_jobs_benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        AppDispatcher.invalidate()
+
+        try:
+            phases = self.run_phases(size, options, trace_memory)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+
+        return dict(size=size, phases={phase.name: phase.as_dict() for phase in phases})
+
+    def run_phases(self, size, options, trace_memory):
+        phases = []
+
+        def phase(name):
+            phases.append(Phase(name, trace_memory=trace_memory))
+            return phases[-1]
+
+        with phase('seed') as p:
+            p.run(self.seed, size, options['due_ratio'])
+
+        scheduler = self.create_scheduler(options['lock_mode'])
+
+        with phase('initial_read') as p:
+            p.run(scheduler.populate_heap)
+
+        with phase('sync_jobs.full') as p:
+            p.run(scheduler.sync_jobs)
+
+        # An idle tick: the jobs synced at every tick, against only the version read when nothing changed
+        with phase('sync_jobs.ungated') as p:
+            for _ in range(options['repeat']):
+                p.run(scheduler.sync_jobs)
+
+        with phase('sync_jobs.gated') as p:
+            for _ in range(options['repeat']):
+                p.run(lambda: scheduler.jobs_changed() and scheduler.sync_jobs())
+
+        with phase('schedule_changed.idle') as p:
+            for _ in range(options['repeat']):
+                p.run(scheduler.schedule_changed)
+
+        job_ids = list(JobPeriodicModel.objects.order_by('id').values_list('id', flat=True)[:options['changes']])
+
+        with phase('schedule_changed.changed') as p:
+            for _ in range(options['repeat']):
+                self.change_jobs(job_ids)
+                p.run(scheduler.schedule_changed)
+
+        with phase('tick') as p:
+            for _ in range(options['ticks']):
+                delay = p.run(scheduler.tick)
+                time.sleep(min(delay, 0.5))
+
+        entries = list(scheduler.schedule.values())[:options['apply']]
+
+        sent, failed = self.dispatch_counts()
+
+        with phase('apply_async') as p:
+            for entry in entries:
+                p.run(scheduler.apply_async, entry, producer=scheduler.producer, advance=False)
+
+        dispatches, failures = self.dispatch_counts()
+        p.extra.update(remote_dispatches=dispatches - sent, failed_dispatches=failures - failed)
+
+        # The jobs are routed to the app of their JobConfigModel, not the default app
+        if entries and (p.extra['remote_dispatches'] != len(entries) or p.extra['failed_dispatches']):
+            raise CommandError('%(remote_dispatches)s of %(calls)s entries sent by AppDispatcher, '
+                               '%(failed_dispatches)s failed' % p.as_dict())
+
+        self.expire_jobs(int(size * options['expired_ratio']))
+
+        with phase('watch_periodic_tasks') as p:
+            p.run(watch_periodic_tasks)
+
+        scheduler.close()
+        return phases
+
+    @staticmethod
+    def create_scheduler(lock_mode):
+        app = Celery('django_celery_jobs_benchmark', broker='memory://')
+        app.conf.timezone = settings.TIME_ZONE
+        app.conf.enable_utc = settings.USE_TZ
+        scheduler = BeatScheduler(app=app, lazy=True)
+
+        scheduler.redis_conn = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+        scheduler.lock_mode = lock_mode
+        scheduler.result_writer = None  # Results are written in the phase, not by a thread
+        scheduler.change_subscription = None
+
+        return scheduler
+
+    @staticmethod
+    def dispatch_counts():
+        """ (dispatches, failures) sent by the apps of JobConfigModel, read from the metrics """
+        durations = metrics.registry.snapshot().get(metrics.DISPATCH_SECONDS.name, {})
+        failures = metrics.registry.snapshot().get(metrics.DISPATCH_FAILURES.name, {})
+
+        dispatches = sum(value for key, value in durations.items() if key[0] != 'default' and key[1] == 'le')
+        return dispatches, sum(value for key, value in failures.items() if key[0] != 'default')
+
+    @staticmethod
+    def change_jobs(job_ids):
+        now = timezone.datetime.now()
+        JobPeriodicModel.objects.filter(id__in=job_ids).update(update_time=now)
+        PeriodicTask.objects.filter(periodic_task__id__in=job_ids).update(date_changed=now)
+
+        PeriodicTasks.update_changed()
+        schedule_version._bump()
+
+    @staticmethod
+    def expire_jobs(count):
+        job_ids = list(JobPeriodicModel.objects.order_by('-id').values_list('id', flat=True)[:count])
+        deadline_run_time = timezone.datetime.now() - timedelta(minutes=1)
+
+        JobPeriodicModel.objects.filter(id__in=job_ids).update(deadline_run_time=deadline_run_time)
+
+    @staticmethod
+    def seed(size, due_ratio, batch_size=2000):
+        """ Jobs of cron `*/n` minutes, `due_ratio` of them run every 2 seconds to keep the ticks busy """
+        config = JobConfigModel.objects.create(category=1, transport='memory', host='localhost')
+        crontabs = [CrontabSchedule.objects.create(minute='*/%s' % n) for n in range(1, 31)]
+        interval = IntervalSchedule.objects.create(every=2, period=IntervalSchedule.SECONDS)
+
+        now = timezone.datetime.now().replace(microsecond=0)
+        due_every = int(1 / due_ratio) if due_ratio else 0
+
+        for start in range(0, size, batch_size):
+            indexes = range(start, min(start + batch_size, size))
+            beat_tasks = [
+                PeriodicTask(
+                    name='benchmark_task_%s' % i, task='benchmark_task_%s' % i, enabled=True,
+                    interval=interval if due_every and i % due_every == 0 else None,
+                    crontab=None if due_every and i % due_every == 0 else crontabs[i % len(crontabs)],
+                )
+                for i in indexes
+            ]
+            PeriodicTask.objects.bulk_create(beat_tasks)
+
+            if any(task.pk is None for task in beat_tasks):
+                task_ids = dict(PeriodicTask.objects.filter(name__in=[task.name for task in beat_tasks])
+                                .values_list('name', 'id'))
+                for task in beat_tasks:
+                    task.pk = task_ids[task.name]
+
+            JobPeriodicModel.objects.bulk_create([
+                JobPeriodicModel(
+                    title='Benchmark job %s' % i, config=config, periodic_task_id=task.pk, is_enabled=True,
+                    max_run_cnt=100000, first_run_time=now, func_name=task.task,
+                    task_source_code=TASK_SOURCE_CODE % task.task, deadline_run_time=now + timedelta(days=365),
+                )
+                for i, task in zip(indexes, beat_tasks)
+            ])
+
+        # Not changed by the last sync window of beat
+        JobPeriodicModel.objects.update(update_time=now - timedelta(days=1))
+        PeriodicTasks.update_changed()
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jobperiodicmodel',
+            index=models.Index(fields=['update_time'], name='periodic_task_update_time_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_jobs', '0002_jobperiodicmodel_update_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jobperiodicmodel',
+            index=models.Index(fields=['is_enabled', 'is_del', 'deadline_run_time'], name='periodic_task_deadline_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+import logging
+
+from django.db import migrations, transaction, DatabaseError
+
+logger = logging.getLogger('django')
+
+# table -> columns searched by `django_celery_jobs.search`
+SEARCH_COLUMNS = {
+    'django_celery_jobs_periodic_task': ('title', 'remark'),
+    'django_celery_jobs_native_jobs': ('name', 'task'),
+}
+
+
+def index_name(table, column):
+    return '%s_%s_search_idx' % (table.replace('django_celery_jobs_', 'jobs_'), column)
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'mysql':
+        sql = 'CREATE FULLTEXT INDEX `{name}` ON `{table}` (`{column}`) WITH PARSER ngram'
+    elif connection.vendor == 'postgresql':
+        try:
+            with transaction.atomic(using=connection.alias):
+                schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError as e:
+            logger.warning('pg_trgm is not available, search falls back to the sequential scan: %s', e)
+            return
+
+        sql = 'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" USING gin ("{column}" gin_trgm_ops)'
+    else:
+        return  # NgramSearchBackend indexes in process
+
+    for table, columns in SEARCH_COLUMNS.items():
+        for column in columns:
+            schema_editor.execute(sql.format(name=index_name(table, column), table=table, column=column))
+
+
+def drop_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'mysql':
+        sql = 'DROP INDEX `{name}` ON `{table}`'
+    elif connection.vendor == 'postgresql':
+        sql = 'DROP INDEX IF EXISTS "{name}"'
+    else:
+        return
+
+    for table, columns in SEARCH_COLUMNS.items():
+        for column in columns:
+            schema_editor.execute(sql.format(name=index_name(table, column), table=table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_jobs', '0003_jobperiodicmodel_deadline_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
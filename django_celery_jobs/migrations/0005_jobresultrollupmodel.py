@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_jobs', '0004_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobResultRollupModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('is_del', models.BooleanField(default=False, verbose_name='是否删除')),
+                ('source', models.SmallIntegerField(blank=True, choices=[(1, 'scheduled'), (2, 'runner')], default=1, verbose_name='Source')),
+                ('period', models.SmallIntegerField(blank=True, choices=[(1, 'hour'), (2, 'day')], default=1, verbose_name='Period')),
+                ('period_start', models.DateTimeField(blank=True, default='1979-01-01 00:00:00', verbose_name='Period Start')),
+                ('periodic_task_id', models.IntegerField(blank=True, default=0, verbose_name='Periodic Task Id')),
+                ('total_cnt', models.IntegerField(blank=True, default=0, verbose_name='Total Count')),
+                ('success_cnt', models.IntegerField(blank=True, default=0, verbose_name='Success Count')),
+                ('failure_cnt', models.IntegerField(blank=True, default=0, verbose_name='Failure Count')),
+                ('cost_histogram', models.JSONField(blank=True, default=list, verbose_name='Cost Seconds Histogram')),
+                ('cost_p50', models.FloatField(blank=True, default=None, null=True, verbose_name='Cost Seconds P50')),
+                ('cost_p90', models.FloatField(blank=True, default=None, null=True, verbose_name='Cost Seconds P90')),
+                ('cost_p99', models.FloatField(blank=True, default=None, null=True, verbose_name='Cost Seconds P99')),
+            ],
+            options={
+                'db_table': 'django_celery_jobs_result_rollup',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='jobresultrollupmodel',
+            constraint=models.UniqueConstraint(fields=('source', 'period', 'period_start', 'periodic_task_id'), name='result_rollup_period_uniq'),
+        ),
+    ]
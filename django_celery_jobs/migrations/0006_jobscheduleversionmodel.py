@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_jobs', '0005_jobresultrollupmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobScheduleVersionModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('is_del', models.BooleanField(default=False, verbose_name='是否删除')),
+                ('version', models.BigIntegerField(blank=True, default=1, verbose_name='Version')),
+            ],
+            options={
+                'db_table': 'django_celery_jobs_schedule_version',
+            },
+        ),
+    ]
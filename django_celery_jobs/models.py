@@ -1,6 +1,5 @@
 import json
 import logging
-import platform
 import traceback
 from itertools import chain
 from urllib.parse import quote_plus
@@ -10,14 +9,15 @@ from django.db import models, transaction
 from django.contrib.auth import get_user_model
 
 from celery import states
-from celery.utils.nodenames import default_nodename
 from django_celery_beat.models import PeriodicTask, cronexp
 from django_celery_results.models import TaskResult, TASK_STATE_CHOICES
 
 from .jobScheduler.trigger.cron import CronTrigger
 from .jobScheduler.core.enums.deploy import DeployModeEnum
 from .jobScheduler.core.exceptions import DeployModeError
-from .jobScheduler.utils import get_ip_addr, get_trigger_next_range
+from .jobScheduler.utils import host_identity, compile_func
+from .jobScheduler.core.version import schedule_version  # noqa, bump the version when jobs are changed
+from .jobScheduler.core import notifier  # noqa, publish the changed jobs to beats
 
 UserModel = get_user_model()
 DEFAULT_TIME = "1979-01-01 00:00:00"
@@ -37,6 +37,14 @@ class BaseAbstractModel(models.Model):
         abc_fields = [_field.name for _field in BaseAbstractModel._meta.fields]
         return [f.name for f in cls._meta.fields if f.name not in abc_fields]
 
+    @classmethod
+    def new_object(cls, **kwargs):
+        """ new object, not saved """
+        fields = cls.fields()
+        new_kwargs = {key: value for key, value in kwargs.items() if key in fields}
+
+        return cls(**new_kwargs)
+
     @classmethod
     def create_object(cls, **kwargs):
         """ create object """
@@ -54,15 +62,19 @@ class BaseAbstractModel(models.Model):
 
         cleaned_attrs and self.save()
 
+    @classmethod
+    def _result_kwargs(cls, **kwargs):
+        return dict(host_identity.get(), **kwargs)
+
+    @classmethod
+    def build_result(cls, **kwargs):
+        """ result object with the host info, not saved. eg: to bulk create """
+        return cls.new_object(**cls._result_kwargs(**kwargs))
+
     @classmethod
     def add_result(cls, **kwargs):
         try:
-            return cls.create_object(
-                **dict(
-                    system=platform.system(), node=default_nodename(None),
-                    ip_address=get_ip_addr(), **kwargs
-                )
-            )
+            return cls.create_object(**cls._result_kwargs(**kwargs))
         except Exception:
             logging.error(traceback.format_exc())
 
@@ -132,6 +144,10 @@ class JobPeriodicModel(BaseAbstractModel):
     class Meta:
         db_table = 'django_celery_jobs_periodic_task'
         ordering = ["-id"]
+        indexes = [
+            models.Index(fields=['update_time'], name='periodic_task_update_time_idx'),
+            models.Index(fields=['is_enabled', 'is_del', 'deadline_run_time'], name='periodic_task_deadline_idx'),
+        ]
 
     @classmethod
     def perform_save(cls, serializer):
@@ -146,8 +162,7 @@ class JobPeriodicModel(BaseAbstractModel):
         # Other kwargs to create or update
         kwargs = {}
         if max_run_cnt:
-            run_next_time_list = get_trigger_next_range(trigger, run_times=max_run_cnt)
-            kwargs['deadline_run_time'] = timezone.datetime.strptime(run_next_time_list[-1], "%Y-%m-%d %H:%M:%S")
+            kwargs['deadline_run_time'] = trigger.get_nth_run_time(max_run_cnt)
 
         if not job_id:
             # create periodic task
@@ -180,10 +195,7 @@ class JobPeriodicModel(BaseAbstractModel):
         if not self.task_source_code:
             return
 
-        namespace = {'__builtins__': {}}
-        func_source_code = self.task_source_code.strip()
-        exec(func_source_code, namespace)
-        func = namespace.get(self.func_name)
+        func = compile_func(self.task_source_code, self.func_name)
 
         assert func, "PeriodicJobModel<id:%s>'s `func_name` does not exist" % self.id
         return func
@@ -198,6 +210,10 @@ class JobPeriodicModel(BaseAbstractModel):
 
     @property
     def native_task_name(self):
+        # Annotated by `CeleryNativeTaskModel.name_subquery`, no query for each row
+        if 'native_name' in self.__dict__:
+            return self.native_name or ''
+
         native_obj = CeleryNativeTaskModel.objects.filter(task=self.periodic_task.task, is_del=False).first()
         return native_obj.name if native_obj else ''
 
@@ -215,6 +231,12 @@ class CeleryNativeTaskModel(BaseAbstractModel):
         db_table = 'django_celery_jobs_native_jobs'
         ordering = ["-id"]
 
+    @classmethod
+    def name_subquery(cls, task):
+        """ Subquery of the native task name, eg: task=OuterRef('periodic_task__task') """
+        queryset = cls.objects.filter(task=task, is_del=False).values('name')[:1]
+        return models.Subquery(queryset, output_field=models.CharField())
+
     @classmethod
     def create_or_update_native_task(cls, **kwargs):
         task = kwargs.get('task')
@@ -227,6 +249,50 @@ class CeleryNativeTaskModel(BaseAbstractModel):
 
         return cls.create_object(**kwargs)
 
+    @classmethod
+    def bulk_sync_native_tasks(cls, native_tasks, stopped_desc='自动监控->停止'):
+        """ Diff the registered tasks with the rows loaded once, only the changed rows are written
+
+        :param native_tasks: list of dict, eg: JobSchedulerHandler.get_celery_native_tasks()
+        :return: dict, count of the created, updated and deleted rows
+        """
+        fields = cls.fields()
+        now = timezone.datetime.now()
+        existed = {obj.task: obj for obj in cls.objects.all()}
+
+        to_create, to_update, update_fields = [], [], {'update_time'}
+
+        for task, item in {item['task']: item for item in native_tasks}.items():
+            attrs = {name: value for name, value in item.items() if name in fields}
+            attrs.update(is_hidden=task.startswith('celery.'), is_del=False)
+
+            obj = existed.pop(task, None)
+            if obj is None:
+                to_create.append(cls(**attrs))
+                continue
+
+            changed = [name for name, value in attrs.items() if getattr(obj, name) != value]
+            if changed:
+                for name in changed:
+                    setattr(obj, name, attrs[name])
+
+                obj.update_time = now
+                update_fields.update(changed)
+                to_update.append(obj)
+
+        to_delete = [obj.id for obj in existed.values() if not obj.is_del]
+
+        # Nothing changed, the rows are only read
+        if not (to_create or to_update or to_delete):
+            return dict(created=0, updated=0, deleted=0)
+
+        with transaction.atomic():
+            to_create and cls.objects.bulk_create(to_create)
+            to_update and cls.objects.bulk_update(to_update, fields=sorted(update_fields))
+            to_delete and cls.objects.filter(id__in=to_delete).update(is_del=True, desc=stopped_desc, update_time=now)
+
+        return dict(created=len(to_create), updated=len(to_update), deleted=len(to_delete))
+
 
 class BeatPeriodicTaskModel(PeriodicTask):
     """ django_celery_beat.models:PeriodicTask """
@@ -234,6 +300,14 @@ class BeatPeriodicTaskModel(PeriodicTask):
         proxy = True
 
 
+class JobScheduleVersionModel(BaseAbstractModel):
+    """ The single row counter of `schedule_version` when the cache is not shared by processes """
+    version = models.BigIntegerField("Version", default=1, blank=True)
+
+    class Meta:
+        db_table = 'django_celery_jobs_schedule_version'
+
+
 class JobScheduledResultModel(BaseAbstractModel):
     sched_id = models.CharField(verbose_name="Scheduled Id", max_length=100, default="", db_index=True, blank=True)
     name = models.CharField(verbose_name="Scheduled Name", max_length=300, default="", blank=True)
@@ -290,6 +364,77 @@ class CeleryTaskRunnerResultModel(TaskResult):
         proxy = True
 
 
+class JobResultRollupModel(BaseAbstractModel):
+    """ Hourly and daily aggregates of the result rows per job, they are kept after the rows were pruned """
+    SOURCE_CHOICES = [
+        (1, 'scheduled'),  # JobScheduledResultModel
+        (2, 'runner'),     # JobRunnerResultModel
+    ]
+    PERIOD_CHOICES = [
+        (1, 'hour'),
+        (2, 'day'),
+    ]
+    # Upper bounds(seconds) of the buckets of cost seconds, the last bucket is unbounded
+    COST_BUCKETS = (0, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+    source = models.SmallIntegerField("Source", choices=SOURCE_CHOICES, default=1, blank=True)
+    period = models.SmallIntegerField("Period", choices=PERIOD_CHOICES, default=1, blank=True)
+    period_start = models.DateTimeField("Period Start", default=DEFAULT_TIME, blank=True)
+    periodic_task_id = models.IntegerField("Periodic Task Id", default=0, blank=True)
+    total_cnt = models.IntegerField("Total Count", default=0, blank=True)
+    success_cnt = models.IntegerField("Success Count", default=0, blank=True)
+    failure_cnt = models.IntegerField("Failure Count", default=0, blank=True)
+    cost_histogram = models.JSONField("Cost Seconds Histogram", default=list, blank=True)
+    cost_p50 = models.FloatField("Cost Seconds P50", null=True, default=None, blank=True)
+    cost_p90 = models.FloatField("Cost Seconds P90", null=True, default=None, blank=True)
+    cost_p99 = models.FloatField("Cost Seconds P99", null=True, default=None, blank=True)
+
+    class Meta:
+        db_table = 'django_celery_jobs_result_rollup'
+        ordering = ["-id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source', 'period', 'period_start', 'periodic_task_id'], name='result_rollup_period_uniq'
+            ),
+        ]
+
+    @property
+    def success_rate(self):
+        return self.success_cnt / self.total_cnt if self.total_cnt else None
+
+    @classmethod
+    def cost_bucket(cls, cost_seconds):
+        for index, upper in enumerate(cls.COST_BUCKETS):
+            if cost_seconds <= upper:
+                return index
+
+        return len(cls.COST_BUCKETS)
+
+    def merge(self, total_cnt, success_cnt, failure_cnt, cost_histogram=None):
+        """ Add the counts of more rows, the percentiles are computed again from the merged histogram """
+        self.total_cnt += total_cnt
+        self.success_cnt += success_cnt
+        self.failure_cnt += failure_cnt
+
+        if cost_histogram:
+            histogram = list(self.cost_histogram or []) or [0] * (len(self.COST_BUCKETS) + 1)
+            self.cost_histogram = [a + b for a, b in zip(histogram, cost_histogram)]
+            self.cost_p50, self.cost_p90, self.cost_p99 = (self.cost_percentile(q) for q in (0.5, 0.9, 0.99))
+
+    def cost_percentile(self, q):
+        """ The upper bound of the bucket holding the `q` percentile, the unbounded bucket is the last bound """
+        histogram = self.cost_histogram or []
+        rank = q * sum(histogram)
+        accumulated = 0
+
+        for index, count in enumerate(histogram):
+            accumulated += count
+            if count and accumulated >= rank:
+                return float(self.COST_BUCKETS[min(index, len(self.COST_BUCKETS) - 1)])
+
+        return None
+
+
 class DeployOptionModel(BaseAbstractModel):
     MODE_CHOICES = DeployModeEnum.members()
 
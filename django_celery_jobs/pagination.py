@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import connections
+
+from rest_framework.settings import api_settings
+from rest_framework.pagination import CursorPagination
+
+__all__ = ('JobCursorPagination', 'CursorPaginationMixin', 'approximate_count')
+
+# Filtered rows are counted exactly up to it, beyond it the count is approximate
+APPROXIMATE_COUNT_LIMIT = getattr(settings, 'DJANGO_CELERY_JOBS_APPROXIMATE_COUNT_LIMIT', 10000)
+
+
+def estimate_table_rows(model):
+    """ Rows of the table estimated by the statistics of database, None if unknown """
+    connection = connections[model.objects.db]
+    table = model._meta.db_table
+
+    if connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def approximate_count(queryset, limit=APPROXIMATE_COUNT_LIMIT):
+    """ Exact count of the rows up to `limit`, the count stops scanning at it
+
+    Beyond `limit`, the estimated rows of the whole table is used if it is greater.
+    """
+    count = queryset.order_by()[:limit + 1].count()
+
+    if count <= limit:
+        return count
+
+    estimated = estimate_table_rows(queryset.model)
+    return max(estimated or 0, limit)
+
+
+class JobCursorPagination(CursorPagination):
+    """ Keyset pagination on `-id`, the same as `ordering` of the models, no COUNT(*) or OFFSET is run
+
+    The header `X-Approximate-Count` is added when the query param `approxCount` is true.
+    """
+    ordering = '-id'
+    page_size = api_settings.PAGE_SIZE or 10
+    page_size_query_param = 'pageSize'
+    max_page_size = 1000
+    approximate_count_query_param = 'approxCount'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+
+        if request.query_params.get(self.approximate_count_query_param) in ('1', 'true'):
+            self.approximate_count = approximate_count(queryset)
+
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+
+        if self.approximate_count is not None:
+            response['X-Approximate-Count'] = str(self.approximate_count)
+
+        return response
+
+
+class CursorPaginationMixin:
+    """ `?paginate=cursor` or a cursor in query params switches the page number pagination to the cursor one """
+    cursor_pagination_class = JobCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            cursor_class = self.cursor_pagination_class
+
+            if params.get('paginate') == 'cursor' or cursor_class.cursor_query_param in params:
+                self._paginator = cursor_class()
+            else:
+                self._paginator = self.pagination_class() if self.pagination_class else None
+
+        return self._paginator
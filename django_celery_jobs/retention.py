@@ -0,0 +1,138 @@
+import logging
+from itertools import takewhile
+from collections import defaultdict
+from datetime import timedelta
+
+from celery import states
+from django.conf import settings
+from django.utils import timezone
+from django.db import transaction
+
+from .models import DEFAULT_TIME, JobScheduledResultModel, JobRunnerResultModel, JobResultRollupModel
+
+__all__ = ('ResultRetention', )
+
+logger = logging.getLogger('celery.task')
+
+# `run_date` is never set
+DEFAULT_RUN_DATE = timezone.datetime.strptime(DEFAULT_TIME, "%Y-%m-%d %H:%M:%S")
+
+
+class ResultRetention:
+    """ Roll the result rows older than `days` up into JobResultRollupModel, then delete them
+
+    Rows are walked by `id` in chunks of `chunk_size`, the rollups and the deletion of a chunk are
+    in one transaction, so an interrupted run loses nothing and can be run again. The walk stops
+    at the first row which is not expired, the ids of the results grow with their create time.
+
+    :param days: int, days of the raw rows to keep
+    :param chunk_size: int, rows rolled up and deleted in one transaction
+    :param max_chunks: int, stop after it to bound the time of a run, None is unbounded
+    """
+    SOURCES = (
+        (1, JobScheduledResultModel),
+        (2, JobRunnerResultModel),
+    )
+    HOUR, DAY = 1, 2
+
+    def __init__(self, days=None, chunk_size=None, max_chunks=None):
+        self.days = days if days is not None else getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_RETENTION_DAYS', 30)
+        self.chunk_size = chunk_size or getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_RETENTION_CHUNK_SIZE', 2000)
+        self.max_chunks = max_chunks
+
+    def run(self, now=None):
+        """ Returns {model name: deleted rows} """
+        cutoff = (now or timezone.now()) - timedelta(days=self.days)
+        return {model.__name__: self.prune(source, model, cutoff) for source, model in self.SOURCES}
+
+    def prune(self, source, model, cutoff):
+        fields = ['id', 'create_time', 'run_date', 'periodic_task_id']
+        fields += ['is_success'] if model is JobScheduledResultModel else ['status', 'cost_seconds']
+
+        deleted, chunks, last_id = 0, 0, 0
+
+        while self.max_chunks is None or chunks < self.max_chunks:
+            rows = list(model.objects.filter(id__gt=last_id).order_by('id').values(*fields)[:self.chunk_size])
+            expired = list(takewhile(lambda row: row['create_time'] < cutoff, rows))
+
+            if not expired:
+                break
+
+            first_id, last_id = expired[0]['id'], expired[-1]['id']
+
+            with transaction.atomic():
+                self.rollup(source, expired)
+                count, _ = model.objects.filter(id__gte=first_id, id__lte=last_id).delete()
+
+            deleted += count
+            chunks += 1
+
+            if len(expired) < len(rows) or len(rows) < self.chunk_size:
+                break
+
+        logger.info('ResultRetention<%s> => deleted: %s, chunks: %s', model.__name__, deleted, chunks)
+        return deleted
+
+    def rollup(self, source, rows):
+        """ Merge the rows into the hourly and daily rollups of their jobs """
+        size = len(JobResultRollupModel.COST_BUCKETS) + 1
+        aggregates = defaultdict(lambda: [0, 0, 0, [0] * size])  # key -> [total, success, failure, histogram]
+
+        for row in rows:
+            run_date = row['run_date']
+            if not run_date or run_date.replace(tzinfo=None) == DEFAULT_RUN_DATE:
+                run_date = row['create_time']
+
+            if timezone.is_aware(run_date):
+                run_date = timezone.localtime(run_date)
+
+            if 'is_success' in row:
+                success, failure = row['is_success'], not row['is_success']
+            else:
+                success, failure = row['status'] == states.SUCCESS, row['status'] in states.PROPAGATE_STATES
+
+            hour = run_date.replace(minute=0, second=0, microsecond=0)
+            for period, period_start in ((self.HOUR, hour), (self.DAY, hour.replace(hour=0))):
+                aggregate = aggregates[(period, period_start, row['periodic_task_id'])]
+                aggregate[0] += 1
+                aggregate[1] += success
+                aggregate[2] += failure
+
+                if 'cost_seconds' in row:
+                    aggregate[3][JobResultRollupModel.cost_bucket(row['cost_seconds'])] += 1
+
+        existed = {
+            (rollup.period, rollup.period_start, rollup.periodic_task_id): rollup
+            for rollup in JobResultRollupModel.objects.filter(
+                source=source,
+                period_start__in={key[1] for key in aggregates},
+                periodic_task_id__in={key[2] for key in aggregates},
+            )
+        }
+        created, updated = [], []
+
+        for key, (total, success, failure, histogram) in aggregates.items():
+            rollup = existed.get(key)
+
+            if rollup is None:
+                period, period_start, periodic_task_id = key
+                rollup = JobResultRollupModel(
+                    source=source, period=period, period_start=period_start, periodic_task_id=periodic_task_id
+                )
+                created.append(rollup)
+            else:
+                updated.append(rollup)
+
+            rollup.merge(total, success, failure, cost_histogram=any(histogram) and histogram)
+
+        JobResultRollupModel.objects.bulk_create(created)
+
+        if updated:
+            now = timezone.now()
+            for rollup in updated:
+                rollup.update_time = now
+
+            JobResultRollupModel.objects.bulk_update(updated, [
+                'total_cnt', 'success_cnt', 'failure_cnt', 'cost_histogram',
+                'cost_p50', 'cost_p90', 'cost_p99', 'update_time',
+            ])
@@ -0,0 +1,276 @@
+import time
+import string
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.db.models.signals import post_save, post_delete
+from django.utils.module_loading import import_string
+
+__all__ = (
+    'NgramIndex', 'BaseSearchBackend', 'ContainsSearchBackend', 'MySQLFulltextSearchBackend',
+    'PostgresTrigramSearchBackend', 'NgramSearchBackend', 'get_search_backend', 'search_filter',
+)
+
+
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_lower(text):
+    """ The case folding of SQLite `LIKE`, only the ASCII letters """
+    return text.translate(ASCII_LOWER)
+
+
+class NgramIndex:
+    """ In-process n-gram index of the texts of a column, the substring search like `__contains`
+
+    It's case-sensitive, unless `fold` is given: it's applied to the texts and the queries,
+    e.g. `ascii_lower` to match SQLite `LIKE`.
+
+    Postings are compact arrays and only grow: an updated row is appended to the postings of its
+    new grams and the stale postings are filtered out by checking the current text, so updating
+    a row is cheap. `stale` counts them to decide when to rebuild.
+    """
+
+    def __init__(self, n=3, fold=None):
+        self.n = n
+        self.fold = fold
+        self.texts = {}
+        self.postings = {}
+        self.stale = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def grams(self, text):
+        n = self.n
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def add(self, pk, text):
+        text = text or ''
+        text = self.fold(text) if self.fold else text
+        old_text = self.texts.get(pk)
+
+        if old_text == text:
+            return
+
+        self.texts[pk] = text
+        new_grams = self.grams(text)
+
+        if old_text is not None:
+            old_grams = self.grams(old_text)
+            self.stale += len(old_grams - new_grams)
+            new_grams -= old_grams
+
+        postings = self.postings
+        for gram in new_grams:
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array('l')
+            posting.append(pk)
+
+    def remove(self, pk):
+        text = self.texts.pop(pk, None)
+
+        if text is not None:
+            self.stale += len(self.grams(text))
+
+    def search(self, query):
+        """ Returns the primary keys of the texts containing `query` """
+        texts = self.texts
+        query = self.fold(query) if self.fold else query
+
+        if len(query) < self.n:
+            return [pk for pk, text in texts.items() if query in text]
+
+        # The rarest gram gives the fewest candidates, each one is verified by the current text
+        rarest = None
+        for gram in self.grams(query):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+
+            if rarest is None or len(posting) < len(rarest):
+                rarest = posting
+
+        return [pk for pk in set(rarest) if query in texts.get(pk, '')]
+
+
+class BaseSearchBackend:
+    """ Filter a queryset by the substrings of the columns, e.g. {'title': 'sync'} """
+
+    def filter(self, queryset, lookups):
+        for field_name, value in lookups.items():
+            if value:
+                queryset = self.filter_field(queryset, field_name, value)
+
+        return queryset
+
+    def filter_field(self, queryset, field_name, value):
+        raise NotImplementedError
+
+
+class ContainsSearchBackend(BaseSearchBackend):
+    """ `LIKE '%value%'`, a B-tree index can't serve it """
+
+    def filter_field(self, queryset, field_name, value):
+        return queryset.filter(**{field_name + '__contains': value})
+
+
+class PostgresTrigramSearchBackend(ContainsSearchBackend):
+    """ `LIKE '%value%'` is served by the GIN index with `gin_trgm_ops` created by the migration """
+
+
+class MySQLFulltextSearchBackend(ContainsSearchBackend):
+    """ The FULLTEXT index with the ngram parser narrows the rows, `LIKE` keeps the exact semantics
+
+    Values shorter than `ngram_token_size` can't be matched by the index, only `LIKE` is used.
+    """
+    ngram_token_size = getattr(settings, 'DJANGO_CELERY_JOBS_MYSQL_NGRAM_TOKEN_SIZE', 2)
+
+    def filter_field(self, queryset, field_name, value):
+        queryset = super().filter_field(queryset, field_name, value)
+        phrase = value.replace('"', ' ').strip()
+
+        if len(phrase) < self.ngram_token_size:
+            return queryset
+
+        column = queryset.model._meta.get_field(field_name).column
+        table = queryset.model._meta.db_table
+
+        return queryset.extra(
+            where=['MATCH(`%s`.`%s`) AGAINST (%%s IN BOOLEAN MODE)' % (table, column)],
+            params=['"%s"' % phrase],
+        )
+
+
+class NgramSearchBackend(BaseSearchBackend):
+    """ In-process n-gram indexes of the columns, for the databases without a text index
+
+    The index of a column is loaded at the first search, then the rows updated since the last load
+    are applied every `refresh_interval` seconds, the saved or deleted rows of this process are
+    applied at once. It's rebuilt every `rebuild_interval` seconds to drop the rows deleted by other
+    processes, or when the stale postings are more than the alive ones.
+
+    Too many matched rows is not selective, `LIKE` is used instead of a long `IN` list. The index
+    folds the case as `LIKE` does on SQLite, both give the same rows.
+    """
+
+    def __init__(self, n=3, refresh_interval=5, rebuild_interval=600, overlap=60, max_ids=1000):
+        self.n = n
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.overlap = overlap
+        self.max_ids = max_ids
+
+        self._indexes = {}  # (model, field_name) -> [NgramIndex, loaded monotonic, refreshed monotonic, mark]
+        self._lock = threading.RLock()
+
+    def filter_field(self, queryset, field_name, value):
+        index = self.get_index(queryset.model, field_name, using=queryset.db)
+        pks = index.search(value)
+
+        if len(pks) > self.max_ids:
+            return queryset.filter(**{field_name + '__contains': value})
+
+        return queryset.filter(pk__in=pks)
+
+    def get_index(self, model, field_name, using='default'):
+        key = (model, field_name)
+
+        with self._lock:
+            state = self._indexes.get(key)
+            now = time.monotonic()
+
+            if state is None:
+                self._connect_signals(model)
+
+            if state is None or now - state[1] > self.rebuild_interval or state[0].stale > len(state[0]) + 1000:
+                state = self._indexes[key] = self._build(model, field_name, using)
+            elif now - state[2] > self.refresh_interval:
+                self._refresh(model, field_name, state)
+
+            return state[0]
+
+    @staticmethod
+    def get_fold(using):
+        """ `__contains` is `LIKE` on SQLite, which ignores the case of the ASCII letters """
+        return ascii_lower if connections[using].vendor == 'sqlite' else None
+
+    def _build(self, model, field_name, using='default'):
+        index = NgramIndex(self.n, fold=self.get_fold(using))
+        mark = self._sync_mark(model)
+
+        for pk, text in model.objects.values_list('pk', field_name).iterator(chunk_size=5000):
+            index.add(pk, text)
+
+        now = time.monotonic()
+        return [index, now, now, mark]
+
+    def _refresh(self, model, field_name, state):
+        index, mark = state[0], state[3]
+        next_mark = self._sync_mark(model)
+
+        if mark is not None:
+            since = mark - timedelta(seconds=self.overlap)
+            queryset = model.objects.filter(update_time__gte=since).values_list('pk', field_name)
+
+            for pk, text in queryset.iterator(chunk_size=5000):
+                index.add(pk, text)
+
+        state[2], state[3] = time.monotonic(), next_mark
+
+    @staticmethod
+    def _sync_mark(model):
+        # `update_time` is set by `auto_now` of BaseAbstractModel, other models are rebuilt only
+        field_names = {field.name for field in model._meta.fields}
+        return timezone.now() if 'update_time' in field_names else None
+
+    def _connect_signals(self, model):
+        uid = '%s:%s' % (id(self), model._meta.label)
+        post_save.connect(self._on_save, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(self._on_delete, sender=model, weak=False, dispatch_uid=uid)
+
+    def _on_save(self, sender, instance, **kwargs):
+        with self._lock:
+            for (model, field_name), state in self._indexes.items():
+                if model is sender:
+                    state[0].add(instance.pk, getattr(instance, field_name))
+
+    def _on_delete(self, sender, instance, **kwargs):
+        with self._lock:
+            for (model, field_name), state in self._indexes.items():
+                if model is sender:
+                    state[0].remove(instance.pk)
+
+
+_backends = {}
+
+
+def get_search_backend(using='default'):
+    """ The backend set by `DJANGO_CELERY_JOBS_SEARCH_BACKEND` (dotted path), or chosen by the database vendor """
+    backend = _backends.get(using)
+
+    if backend is None:
+        path = getattr(settings, 'DJANGO_CELERY_JOBS_SEARCH_BACKEND', None)
+
+        if path:
+            backend_class = import_string(path)
+        else:
+            vendor = connections[using].vendor
+            backend_class = {
+                'mysql': MySQLFulltextSearchBackend,
+                'postgresql': PostgresTrigramSearchBackend,
+            }.get(vendor, NgramSearchBackend)
+
+        backend = _backends[using] = backend_class()
+
+    return backend
+
+
+def search_filter(queryset, **lookups):
+    """ e.g. search_filter(JobPeriodicModel.objects.all(), title='sync', remark=None) """
+    return get_search_backend(queryset.db).filter(queryset, lookups)
@@ -1,11 +1,15 @@
 import logging
 import traceback
 
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
+from django_celery_beat.models import PeriodicTasks
 
 from ..jobScheduler.core.celery.utils import get_celery_app
 from ..jobScheduler.scheduler import default_scheduler
+from ..jobScheduler.core.version import schedule_version
+from ..jobScheduler.core.notifier import notify_jobs_changed
 from ..models import CeleryNativeTaskModel, JobPeriodicModel, BeatPeriodicTaskModel
 
 celery_app = get_celery_app()
@@ -15,15 +19,9 @@ logger = logging.getLogger('celery.task')
 @celery_app.task(ignore_result=False)
 def sync_celery_native_tasks(**kwargs):
     try:
-        task_list = []
         native_tasks = default_scheduler.get_celery_native_tasks()
-
-        for task in native_tasks:
-            task_list.append(task['task'])
-            CeleryNativeTaskModel.create_or_update_native_task(**task)
-
-        q = Q(task__in=task_list, is_del=False)
-        CeleryNativeTaskModel.objects.filter(~q).update(is_del=True, desc='自动监控->停止')
+        counts = CeleryNativeTaskModel.bulk_sync_native_tasks(native_tasks)
+        logger.info("sync_celery_native_tasks => %s", counts)
     except Exception as e:
         logger.warning('sync_celery_native_tasks error: %s', e)
         logger.error(traceback.format_exc())
@@ -31,26 +29,39 @@ def sync_celery_native_tasks(**kwargs):
 
 @celery_app.task
 def watch_periodic_tasks(**kwargs):
-    fields = ['id', 'title', 'periodic_task_id', 'deadline_run_time']
-    periodic_tasks = JobPeriodicModel.objects.filter(is_del=False, is_enabled=True).values(*fields)
-    logger.info("Watch Job heartbeat => periodic task count: %s", len(periodic_tasks))
-
-    for task in periodic_tasks:
-        try:
-            job_id = task['id']
-            job_title = task['title']
-            deadline = task['deadline_run_time']
-            beat_task_id = task['periodic_task_id']
-
-            if not deadline:
-                continue
-
-            deadline_run_time = timezone.datetime.strptime(deadline, "%Y-%m-%d %H:%M:%S")
-            if deadline_run_time < timezone.datetime.now():
-                logger.info('PeriodicJob<%s> Deadline Run Time: %s', job_title, deadline)
-
-                BeatPeriodicTaskModel.objects.filter(id=beat_task_id).update(enabled=False)
-                JobPeriodicModel.objects.filter(id=job_id).update(remark='自动监控->停止')
-        except Exception as e:
-            logger.warning('watch_periodic_tasks error: %s', e)
-            logger.error(traceback.format_exc())
+    now = timezone.datetime.now()
+    expired_queryset = JobPeriodicModel.objects.filter(is_enabled=True, is_del=False, deadline_run_time__lt=now)
+
+    try:
+        with transaction.atomic():
+            expired_ids = list(expired_queryset.values_list('id', flat=True))
+            expired_queryset = JobPeriodicModel.objects.filter(id__in=expired_ids)
+
+            beat_task_ids = expired_queryset.exclude(periodic_task_id=None).values('periodic_task_id')
+            BeatPeriodicTaskModel.objects.filter(id__in=beat_task_ids).update(enabled=False)
+            expired_count = expired_queryset.update(is_enabled=False, remark='自动监控->停止', update_time=now)
+
+        logger.info("Watch Job heartbeat => expired periodic task count: %s", expired_count)
+
+        # Bulk update doesn't send signals, notify beat that the schedule was changed
+        if expired_count:
+            PeriodicTasks.update_changed()
+            schedule_version.bump()
+            notify_jobs_changed(expired_ids)
+    except Exception as e:
+        logger.warning('watch_periodic_tasks error: %s', e)
+        logger.error(traceback.format_exc())
+
+
+@celery_app.task
+def prune_job_results(**kwargs):
+    """ Roll the expired result rows up and delete them, the chunks of a run are bounded """
+    from ..retention import ResultRetention
+
+    try:
+        max_chunks = getattr(settings, 'DJANGO_CELERY_JOBS_RESULT_RETENTION_MAX_CHUNKS', 100)
+        deleted = ResultRetention(max_chunks=max_chunks).run()
+        logger.info("prune_job_results => %s", deleted)
+    except Exception as e:
+        logger.warning('prune_job_results error: %s', e)
+        logger.error(traceback.format_exc())
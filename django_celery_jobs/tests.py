@@ -1,3 +1,1327 @@
-from django.test import TestCase
+import json
+import time
+import threading
+from datetime import timedelta
+from unittest import skipIf, mock
 
-# Create your tests here.
+from croniter import croniter
+from django.db import DatabaseError, transaction
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+from django.core.cache import caches
+from django.utils import timezone
+
+from django_celery_beat.models import PeriodicTask, PeriodicTasks, IntervalSchedule, CrontabSchedule
+from django_celery_beat.schedulers import ModelEntry
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from . import models, views
+from .jobScheduler import utils
+from .retention import ResultRetention
+from .search import NgramIndex, NgramSearchBackend, get_search_backend
+from .jobScheduler.core.celery.app import AppDispatcher
+from .jobScheduler.core.celery.pool import RemoteAppPool
+from .jobScheduler.core.celery.utils import get_celery_app
+from .jobScheduler.core.celery.scheduler import BeatScheduler, SyncScheduledTask
+from .jobScheduler.trigger import CronTrigger
+from .jobScheduler.scheduler import default_scheduler
+from .jobScheduler.core import notifier, metrics
+from .jobScheduler.core.cache import LRUCache
+from .jobScheduler.core.writer import BufferedWriter
+from .jobScheduler.core.version import ScheduleVersion, schedule_version
+from .tasks import task_synchronous_jobs
+from .jobScheduler.core.exceptions import BulkJobError
+from .jobScheduler.trigger.cronexpr import CompiledCron
+
+
+class BeatSchedulerTestMixin:
+    @classmethod
+    def create_beat_task(cls, name, every=60):
+        interval, _ = IntervalSchedule.objects.get_or_create(every=every, period=IntervalSchedule.SECONDS)
+        last_run_at = timezone.datetime.now() - timedelta(days=1)
+
+        return PeriodicTask.objects.create(name=name, task=name, interval=interval, last_run_at=last_run_at)
+
+    @staticmethod
+    def create_scheduler(redis_conn=None, **attrs):
+        scheduler = BeatScheduler(app=get_celery_app(), lazy=True)
+        scheduler.redis_conn = redis_conn
+
+        for name, value in attrs.items():
+            setattr(scheduler, name, value)
+
+        return scheduler
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class BatchLockTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        app = get_celery_app()
+
+        self.schedulers = [
+            self.create_scheduler(redis_conn=fakeredis.FakeStrictRedis(server=server), lock_mode='batch')
+            for _ in range(2)
+        ]
+        self.entries = [ModelEntry(self.create_beat_task('job.task_%s' % i), app=app) for i in range(3)]
+
+    def test_only_one_beat_wins_each_entry(self):
+        first, second = self.schedulers
+
+        self.assertEqual([state.is_due for state in first.is_due_many(self.entries)], [True] * 3)
+        self.assertEqual([state.is_due for state in second.is_due_many(self.entries)], [False] * 3)
+
+    def test_acquire_locks_in_one_round_trip(self):
+        scheduler = self.schedulers[0]
+        redis_conn, pipes = scheduler.redis_conn, []
+
+        def pipeline(*args, **kwargs):
+            pipe = redis_conn.__class__.pipeline(redis_conn, *args, **kwargs)
+            pipe.execute = mock.Mock(wraps=pipe.execute)
+            pipes.append(pipe)
+            return pipe
+
+        with mock.patch.object(redis_conn, 'pipeline', pipeline), mock.patch.object(redis_conn, 'set') as redis_set:
+            won_keys = scheduler.acquire_locks([('a', 10000), ('b', 10000), ('c', 0)])
+
+        self.assertEqual(won_keys, {'a', 'b'})
+        self.assertEqual([pipe.execute.call_count for pipe in pipes], [1])
+        redis_set.assert_not_called()
+        self.assertEqual(scheduler.acquire_locks([('a', 10000), ('d', 10000)]), {'d'})
+
+    def test_no_redis_falls_back_to_entry_state(self):
+        scheduler = self.create_scheduler(redis_conn=None, lock_mode='batch')
+        self.assertTrue(all(state.is_due for state in scheduler.is_due_many(self.entries)))
+
+
+class ScheduleHeapTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        self.beat_task = self.create_beat_task('job.heap_task')
+        self.scheduler = self.create_scheduler(apply_entry=mock.Mock())
+
+        self.scheduler.schedule  # Initial read
+        self.scheduler.populate_heap()
+        self.scheduler.schedule  # Last change of the schedule is read
+
+    def reload(self, **fields):
+        fields and PeriodicTask.objects.filter(id=self.beat_task.id).update(**fields)
+        PeriodicTasks.update_changed()
+
+        return self.scheduler.schedule
+
+    def test_due_entry_dispatched(self):
+        self.scheduler.tick()
+        self.assertEqual(self.scheduler.apply_entry.call_count, 1)
+
+        self.scheduler.tick()  # Not due until next interval
+        self.assertEqual(self.scheduler.apply_entry.call_count, 1)
+
+    def test_run_after_reload_is_persisted(self):
+        schedule = self.reload(description='reloaded')
+        self.assertIs(self.scheduler._heap._entries['job.heap_task'], schedule['job.heap_task'])
+
+        self.scheduler.tick()
+        self.scheduler.sync_entries()
+
+        beat_task = PeriodicTask.objects.get(id=self.beat_task.id)
+        self.assertEqual(self.scheduler.apply_entry.call_count, 1)
+        self.assertEqual(beat_task.total_run_count, 1)
+        self.assertGreater(beat_task.last_run_at, self.beat_task.last_run_at)
+
+    def test_edited_start_time_is_honoured(self):
+        self.reload(start_time=timezone.datetime.now() + timedelta(days=1))
+
+        self.scheduler.tick()
+        self.assertEqual(self.scheduler.apply_entry.call_count, 0)
+
+    def test_reset_last_run_at_is_timed_again(self):
+        self.scheduler.tick()
+        self.scheduler.sync_entries()
+
+        self.reload(last_run_at=self.beat_task.last_run_at)
+        self.scheduler.tick()
+
+        self.assertEqual(self.scheduler.apply_entry.call_count, 2)
+
+
+class ListJobPeriodicApiTests(TestCase):
+    def create_jobs(self, count):
+        crontab, _ = CrontabSchedule.objects.get_or_create(minute='*/5')
+        start = models.JobPeriodicModel.objects.count()
+
+        for i in range(start, start + count):
+            task = 'job.native_task_%s' % i
+            models.CeleryNativeTaskModel.objects.create(name='Native %s' % i, task=task)
+            periodic_task = PeriodicTask.objects.create(name='job_%s' % i, task=task, crontab=crontab)
+            models.JobPeriodicModel.objects.create(title='Job %s' % i, periodic_task=periodic_task)
+
+    def list_jobs(self):
+        request = APIRequestFactory().get('/', {'pageSize': 100})
+        response = views.ListJobPeriodicApi.as_view()(request)
+        response.render()
+
+        return response.data['results']
+
+    def test_constant_queries_per_page(self):
+        self.create_jobs(3)
+        with self.assertNumQueries(2):  # COUNT(*) + page
+            self.list_jobs()
+
+        self.create_jobs(50)
+        with self.assertNumQueries(2):
+            results = self.list_jobs()
+
+        self.assertEqual(len(results), 53)
+        self.assertEqual(results[0]['cron_expr'], '*/5 * * * *')
+        self.assertEqual(results[0]['native_task_name'], 'Native 52')
+
+    def test_cursor_pagination(self):
+        self.create_jobs(25)
+        view = views.ListJobPeriodicApi.as_view()
+        params, titles = {'paginate': 'cursor', 'pageSize': 10, 'approxCount': 1}, []
+
+        with self.assertNumQueries(2):  # Approximate count + page
+            response = view(APIRequestFactory().get('/', params))
+        self.assertEqual(response['X-Approximate-Count'], '25')
+
+        while True:
+            titles.extend(job['title'] for job in response.data['results'])
+            if not response.data['next']:
+                break
+
+            with self.assertNumQueries(2):  # The links keep `approxCount`
+                response = view(APIRequestFactory().get(response.data['next']))
+
+        self.assertEqual(titles, ['Job %s' % i for i in range(24, -1, -1)])
+
+
+class AppDispatcherTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        AppDispatcher.invalidate()
+        AppDispatcher.APPS_CACHE.invalidate()
+        self.addCleanup(AppDispatcher.APPS_CACHE.invalidate)
+
+        self.config = models.JobConfigModel.objects.create(category=1, transport='memory', host='localhost')
+        models.JobPeriodicModel.objects.create(
+            title='App job', config=self.config, periodic_task=self.create_beat_task('app_task'),
+            func_name='app_task', task_source_code='def app_task():\n    return None\n',
+        )
+        self.scheduler = self.create_scheduler()
+
+    def dispatcher(self, task_name='app_task'):
+        return AppDispatcher(self.scheduler, entry=mock.Mock(task=task_name))
+
+    def test_resolved_once(self):
+        dispatcher = self.dispatcher()
+        self.assertFalse(dispatcher.is_default_app('app_task'))
+        self.assertTrue(dispatcher.is_default_app('native_task'))
+        task = dispatcher.get_task()
+
+        with self.assertNumQueries(0):
+            dispatcher = self.dispatcher()
+            self.assertFalse(dispatcher.is_default_app('app_task'))
+            self.assertTrue(dispatcher.is_default_app('native_task'))
+            self.assertIs(dispatcher.get_task(), task)
+
+        self.assertEqual(dispatcher.celery_name, 'Celery:localhost:')
+
+    def test_synced_job_dispatches_new_code(self):
+        # Config not changed in the overlap of the sync, it doesn't invalidate the job
+        models.JobConfigModel.objects.update(update_time=timezone.datetime.now() - timedelta(days=1))
+        self.scheduler.sync_jobs()
+        self.assertIsNone(self.dispatcher().get_task().run())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            job = models.JobPeriodicModel.objects.get(title='App job')
+            job.task_source_code = 'def app_task():\n    return 2\n'
+            job.save()
+
+        self.assertFalse(self.scheduler.schedule_changed())  # The beat task isn't changed, only the job
+        self.assertEqual(self.dispatcher().get_task().run(), 2)
+
+    def test_saved_config_invalidates(self):
+        dispatcher = self.dispatcher()
+        task = dispatcher.get_task()
+
+        self.config.save()
+        self.assertNotIn('app_task', AppDispatcher.RESOLVED_CACHE)
+        self.assertNotIn(dispatcher.celery_name, AppDispatcher.APPS_CACHE)
+
+        new_task = self.dispatcher().get_task()
+        self.assertIsNot(new_task, task)
+        self.assertIn(dispatcher.celery_name, AppDispatcher.APPS_CACHE)
+
+    def test_deleted_config_invalidates(self):
+        dispatcher = self.dispatcher()
+        dispatcher.get_task()
+
+        self.config.delete()
+        self.assertNotIn('app_task', AppDispatcher.RESOLVED_CACHE)
+        self.assertNotIn(dispatcher.celery_name, AppDispatcher.APPS_CACHE)
+        self.assertIsNone(dispatcher._resolve('app_task').config)
+
+
+class RemoteAppPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.factory = mock.Mock(side_effect=lambda name, broker_url: mock.MagicMock(name=name))
+
+    def test_least_recently_used_evicted(self):
+        pool = RemoteAppPool(maxsize=2, health_check_interval=0)
+        app_a = pool.get('a', 'memory://a', self.factory)
+        pool.get('b', 'memory://b', self.factory)
+
+        self.assertIs(pool.get('a', 'memory://a', self.factory), app_a)  # `b` is the least recently used now
+        pool.get('c', 'memory://c', self.factory)
+
+        self.assertNotIn('b', pool)
+        self.assertEqual([app['name'] for app in pool.stats()['apps']], ['a', 'c'])
+        self.assertEqual(app_a.conf.broker_pool_limit, 4)
+
+    def test_expired_or_changed_app_created_again(self):
+        pool = RemoteAppPool(ttl=60, health_check_interval=0)
+        app = pool.get('a', 'memory://a', self.factory)
+
+        self.now += 61
+        expired_app = pool.get('a', 'memory://a', self.factory)
+        self.assertIsNot(expired_app, app)
+        app.close.assert_called_once_with()
+
+        self.assertIsNot(pool.get('a', 'memory://other', self.factory), expired_app)
+        self.assertEqual(self.factory.call_count, 3)
+
+    def check(self, pool, name, broker_url):
+        """ Get the app and wait for the health check started by it """
+        app = pool.get(name, broker_url, self.factory)
+        pool._apps[name].checker and pool._apps[name].checker.join(1)
+
+        return app
+
+    def test_health_check_of_idle_app(self):
+        pool = RemoteAppPool(health_check_interval=60)
+        app = pool.get('a', 'memory://a', self.factory)
+
+        self.now += 30  # Not idle long enough, not checked
+        self.assertIs(self.check(pool, 'a', 'memory://a'), app)
+        app.pool.acquire.assert_not_called()
+
+        self.now += 61
+        self.assertIs(self.check(pool, 'a', 'memory://a'), app)
+        app.pool.acquire.assert_called_once()
+
+        self.now += 61
+        app.pool.acquire.side_effect = ConnectionError
+        self.assertIs(self.check(pool, 'a', 'memory://a'), app)  # Used while it's checked
+        self.assertEqual(pool.failed_checks, 1)
+
+        self.assertIsNot(pool.get('a', 'memory://a', self.factory), app)
+        app.close.assert_called_once_with()
+
+    def test_health_check_not_blocking(self):
+        pool = RemoteAppPool(health_check_interval=60)
+        app = pool.get('a', 'memory://a', self.factory)
+
+        acquired, released = threading.Event(), threading.Event()
+        app.pool.acquire.side_effect = lambda **kwargs: acquired.set() or released.wait(5) or ConnectionError()
+        self.addCleanup(released.set)
+
+        self.now += 61
+        self.assertIs(pool.get('a', 'memory://a', self.factory), app)  # The broker hangs, the app is returned
+        self.assertTrue(acquired.wait(1))
+
+        self.now += 61  # A check is running, no other one is started
+        self.assertIs(pool.get('a', 'memory://a', self.factory), app)
+        self.assertEqual(app.pool.acquire.call_count, 1)
+
+    def test_stats(self):
+        pool = RemoteAppPool(maxsize=1, health_check_interval=0)
+
+        pool.get('a', 'memory://a', self.factory, tag=1)
+        pool.get('a', 'memory://a', self.factory, tag=1)
+        pool.get('b', 'memory://b', self.factory, tag=2)
+        self.now += 5
+
+        stats = pool.stats()
+        self.assertEqual({key: stats[key] for key in ('size', 'maxsize', 'hits', 'misses', 'evictions')},
+                         dict(size=1, maxsize=1, hits=1, misses=2, evictions=1))
+        self.assertEqual(stats['apps'], [dict(name='b', tag=2, age=5, idle=5, broker_pool_limit=4, has_producer=False)])
+
+        pool.invalidate(tag=2)
+        self.assertEqual(len(pool), 0)
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        self.assertEqual(cache.get('a'), 1)  # `b` is the least recently used now
+        cache.set('c', 3)
+
+        self.assertNotIn('b', cache)
+        self.assertEqual(list(cache._data), ['a', 'c'])
+
+        cache.set('a', 10)  # Updated, `c` is evicted next
+        cache.set('d', 4)
+        self.assertEqual(list(cache._data), ['a', 'd'])
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=8)
+        factory = mock.Mock(return_value='value')
+
+        self.assertEqual([cache.get_or_set('key', factory) for _ in range(3)], ['value'] * 3)
+        self.assertIsNone(cache.get('missing'))
+
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(cache.stats(), dict(hits=2, misses=2, size=1, maxsize=8))
+
+        cache.clear()
+        self.assertEqual(cache.stats(), dict(hits=0, misses=0, size=0, maxsize=8))
+
+    def test_compiled_once(self):
+        source_code = 'def job_func():\n    return 1\n'
+
+        with mock.patch.object(utils, 'compiled_func_cache', LRUCache(maxsize=1)) as cache:
+            func = utils.compile_func(source_code, 'job_func')
+
+            self.assertIs(utils.compile_func('\n' + source_code, 'job_func'), func)
+            self.assertEqual(cache.stats(), dict(hits=1, misses=1, size=1, maxsize=1))
+
+            self.assertIsNone(utils.compile_func(source_code, 'other_func'))  # Evicts `job_func`
+            self.assertIsNot(utils.compile_func(source_code, 'job_func'), func)
+            self.assertEqual(cache.misses, 3)
+
+
+class HostIdentityTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.pid = 100
+
+        patches = [
+            mock.patch('time.monotonic', side_effect=lambda: self.now),
+            mock.patch.object(utils.os, 'getpid', side_effect=lambda: self.pid),
+            mock.patch.object(utils, 'get_ip_addr', side_effect=['10.0.0.1', '10.0.0.2', '10.0.0.3']),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.identity = utils.HostIdentity(ttl=300)
+
+    def test_cached(self):
+        identity = self.identity.get()
+        self.assertEqual(identity['ip_address'], '10.0.0.1')
+        self.assertEqual(set(identity), {'system', 'node', 'ip_address'})
+
+        identity['ip_address'] = 'changed'  # A copy is returned
+        self.now += 300
+        self.assertEqual(self.identity.get()['ip_address'], '10.0.0.1')
+        self.assertEqual(utils.get_ip_addr.call_count, 1)
+
+    def test_ttl_expired(self):
+        self.identity.get()
+
+        self.now += 301
+        self.assertEqual(self.identity.get()['ip_address'], '10.0.0.2')
+        self.assertEqual(self.identity.get()['ip_address'], '10.0.0.2')
+
+    def test_forked(self):
+        self.identity.get()
+
+        self.pid = 101
+        self.assertEqual(self.identity.get()['ip_address'], '10.0.0.2')
+        self.assertEqual(self.identity.get()['ip_address'], '10.0.0.2')
+
+
+class IpAddrTests(SimpleTestCase):
+    def test_default_route(self):
+        with mock.patch.object(utils.socket, 'socket') as sock:
+            sock.return_value.__enter__.return_value.getsockname.return_value = ('10.0.0.1', 5000)
+            self.assertEqual(utils.get_ip_addr(), '10.0.0.1')
+
+    def test_air_gapped(self):
+        with mock.patch.object(utils.socket, 'socket') as sock, \
+                mock.patch.object(utils.socket, 'gethostbyname', return_value='192.168.1.2') as gethostbyname:
+            sock.return_value.__enter__.return_value.connect.side_effect = OSError('Network is unreachable')
+
+            self.assertEqual(utils.get_ip_addr(), '192.168.1.2')
+            gethostbyname.assert_called_once_with(utils.socket.gethostname())
+
+    def test_unresolved_hostname(self):
+        with mock.patch.object(utils.socket, 'socket', side_effect=OSError), \
+                mock.patch.object(utils.socket, 'gethostbyname', side_effect=OSError):
+            self.assertEqual(utils.get_ip_addr(), '127.0.0.1')
+
+
+class RemoteProducerTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        AppDispatcher.invalidate()
+        AppDispatcher.APPS_CACHE.invalidate()
+        self.addCleanup(AppDispatcher.APPS_CACHE.invalidate)
+
+        self.config = models.JobConfigModel.objects.create(category=1, transport='memory', host='localhost')
+        models.JobPeriodicModel.objects.create(
+            title='Producer job', config=self.config, periodic_task=self.create_beat_task('producer_task'),
+            func_name='producer_task', task_source_code='def producer_task():\n    return None\n', is_enabled=True,
+        )
+
+        self.scheduler = self.create_scheduler(result_writer=None)
+        self.scheduler.sync_jobs()  # The task is registered
+        self.entry = self.scheduler.schedule['producer_task']
+
+    def apply(self):
+        self.scheduler.apply_async(self.entry, advance=False)
+        return models.JobScheduledResultModel.objects.order_by('-id').values_list('is_success', flat=True).first()
+
+    @staticmethod
+    def producer():
+        return AppDispatcher.APPS_CACHE._apps['Celery:localhost:'].producer
+
+    def test_producer_reused(self):
+        self.assertTrue(self.apply())
+        producer = self.producer()
+
+        self.assertTrue(self.apply())
+        self.assertIs(self.producer(), producer)
+        self.assertTrue(AppDispatcher.APPS_CACHE.stats()['apps'][0]['has_producer'])
+
+    def test_producer_rebuilt_after_publish_failure(self):
+        self.apply()
+        producer = self.producer()
+
+        with mock.patch('celery.app.task.Task.apply_async', side_effect=ConnectionError):
+            self.assertFalse(self.apply())
+
+        self.assertIsNone(self.producer())  # Released, not used again
+
+        self.assertTrue(self.apply())
+        self.assertIsNot(self.producer(), producer)
+
+    def test_producer_rebuilt_after_config_invalidated(self):
+        self.apply()
+        producer = self.producer()
+
+        with mock.patch.object(producer, 'release', wraps=producer.release) as release:
+            self.config.save()
+
+        release.assert_called_once_with()
+        self.assertTrue(self.apply())
+        self.assertIsNot(self.producer(), producer)
+
+
+class BufferedWriterTests(SimpleTestCase):
+    @staticmethod
+    def create_writer(bulk_create=None, **options):
+        model = type('FakeResultModel', (), {'objects': mock.Mock(**{'bulk_create.side_effect': bulk_create})})
+        return BufferedWriter(model=model, builder=dict, **options)
+
+    @staticmethod
+    def batch_sizes(writer):
+        return [len(call.args[0]) for call in writer.model.objects.bulk_create.call_args_list]
+
+    def test_rows_written_in_batches(self):
+        writer = self.create_writer(batch_size=3, flush_interval=60)
+
+        for i in range(7):
+            self.assertTrue(writer.put(i=i))
+
+        writer.stop(timeout=5)
+
+        self.assertEqual(self.batch_sizes(writer), [3, 3, 1])
+        self.assertEqual(writer.stats(), dict(queued=0, written=7, dropped=0, failed=0))
+
+    def test_rows_dropped_when_full(self):
+        writing, release = threading.Event(), threading.Event()
+
+        def bulk_create(objs, **kwargs):
+            writing.set()
+            release.wait(5)
+
+        writer = self.create_writer(bulk_create=bulk_create, batch_size=1, maxsize=2)
+        writer.put(i=0)
+        writing.wait(5)  # The thread is blocked in writing the first row
+
+        self.assertEqual([writer.put(i=i) for i in range(1, 5)], [True, True, False, False])
+        self.assertEqual(writer.stats()['dropped'], 2)
+
+        release.set()
+        writer.stop(timeout=5)
+        self.assertEqual(writer.stats(), dict(queued=0, written=3, dropped=2, failed=0))
+
+    def test_stop_drains_buffer(self):
+        writer = self.create_writer(batch_size=100, flush_interval=60)
+
+        for i in range(5):
+            writer.put(i=i)
+
+        writer.stop(timeout=5)
+
+        self.assertFalse(writer._thread.is_alive())
+        self.assertEqual(self.batch_sizes(writer), [5])
+        self.assertEqual(writer.model.objects.bulk_create.call_args.args[0][0], dict(i=0))
+
+
+class NativeTaskSyncTests(TestCase):
+    @staticmethod
+    def native_tasks(*names, priority=None):
+        return [dict(task=name, backend='celery.backends.base:DisabledBackend', priority=priority) for name in names]
+
+    def sync(self, native_tasks, counts, queries):
+        with self.assertNumQueries(queries):
+            self.assertEqual(models.CeleryNativeTaskModel.bulk_sync_native_tasks(native_tasks), counts)
+
+    def test_create_update_stop(self):
+        # SELECT + SAVEPOINT + INSERT + RELEASE
+        self.sync(self.native_tasks('job.a', 'job.b', 'celery.ping'), dict(created=3, updated=0, deleted=0), 4)
+        self.assertEqual(
+            set(models.CeleryNativeTaskModel.objects.filter(is_hidden=True).values_list('task', flat=True)),
+            {'celery.ping'},
+        )
+
+        self.sync(self.native_tasks('job.a', 'job.b', 'celery.ping'), dict(created=0, updated=0, deleted=0), 1)
+
+        # SELECT + SAVEPOINT + UPDATE + UPDATE + RELEASE
+        self.sync(self.native_tasks('job.a', priority=5) + self.native_tasks('celery.ping'),
+                  dict(created=0, updated=1, deleted=1), 5)
+
+        stopped = models.CeleryNativeTaskModel.objects.get(task='job.b')
+        self.assertTrue(stopped.is_del)
+        self.assertEqual(stopped.desc, '自动监控->停止')
+        self.assertEqual(models.CeleryNativeTaskModel.objects.get(task='job.a').priority, 5)
+
+        # Stopped already, not written again
+        self.sync(self.native_tasks('job.a', 'celery.ping', priority=5), dict(created=0, updated=1, deleted=0), 4)
+        self.sync(self.native_tasks('job.a', 'celery.ping', priority=5), dict(created=0, updated=0, deleted=0), 1)
+
+    def test_stopped_task_revived(self):
+        models.CeleryNativeTaskModel.bulk_sync_native_tasks(self.native_tasks('job.a', 'job.b'))
+        models.CeleryNativeTaskModel.bulk_sync_native_tasks(self.native_tasks('job.a'))
+
+        self.sync(self.native_tasks('job.a', 'job.b'), dict(created=0, updated=1, deleted=0), 4)
+        self.assertEqual(models.CeleryNativeTaskModel.objects.filter(is_del=False).count(), 2)
+
+
+class CompiledCronTests(SimpleTestCase):
+    expressions = (
+        '* * * * *', '*/7 * * * *', '*/15 0-23/2 */3 jan-jun mon-fri', '0 0 13 * 5',
+        '0 12 * * 7', '59 23 31 12 *', '0 0 29 2 *', '30 8 1,15 * 1-5',
+    )
+
+    def test_same_as_croniter(self):
+        for expression in self.expressions:
+            for start in (timezone.datetime(2023, 12, 31, 23, 59, 30), timezone.datetime(2024, 2, 28, 8, 30)):
+                cron = croniter(expression, start)
+                expected = [cron.get_next(timezone.datetime) for _ in range(300)]
+
+                with self.subTest(expression=expression, start=start):
+                    compiled = CompiledCron.compile(expression)
+                    self.assertEqual(compiled.get_next_range(300, start), expected)
+                    self.assertEqual(
+                        [compiled.get_nth(n, start) for n in (1, 37, 300)],
+                        [expected[0], expected[36], expected[299]],
+                    )
+
+    def test_nth_of_many_runs(self):
+        start = timezone.datetime(2024, 1, 1, 0, 0, 30)
+        deadline = CompiledCron.compile('* * * * *').get_nth(100000, start)
+
+        self.assertEqual(deadline, start.replace(second=0) + timedelta(minutes=100000))
+
+    def test_not_compiled_expression(self):
+        self.assertIsNone(CompiledCron.compile('0 0 L * *'))
+        self.assertIsNone(CompiledCron.compile('0 0 * * 1#2'))
+
+
+class CrontabCacheTests(TestCase):
+    def setUp(self):
+        CronTrigger.warm_crontab_cache(force=True)
+
+    def test_resolved_without_query(self):
+        crontab = CrontabSchedule.objects.create(minute='*/5', timezone=CronTrigger.from_crontab('* * * * *').timezone)
+        CronTrigger.warm_crontab_cache(force=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(CronTrigger.from_crontab('*/5 * * * *').get_trigger_schedule()['crontab_id'], crontab.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created_id = CronTrigger.from_crontab('0 8 * * *').get_trigger_schedule()['crontab_id']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(CronTrigger.from_crontab('0 8 * * *').get_trigger_schedule()['crontab_id'], created_id)
+
+    def test_deleted_crontab_is_created_again(self):
+        trigger = CronTrigger.from_crontab('0 9 * * 1-5')
+        crontab_id = trigger.get_trigger_schedule()['crontab_id']
+
+        CrontabSchedule.objects.filter(id=crontab_id).get().delete()
+        self.assertNotEqual(trigger.get_trigger_schedule()['crontab_id'], crontab_id)
+
+    def test_rolled_back_crontab_not_cached(self):
+        trigger = CronTrigger.from_crontab('0 10 * * *')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                crontab_id = trigger.get_trigger_schedule()['crontab_id']
+                raise DatabaseError
+
+        self.assertNotIn(crontab_id, CronTrigger.CRONTAB_CACHE.values())
+        self.assertTrue(CrontabSchedule.objects.filter(id=trigger.get_trigger_schedule()['crontab_id']).exists())
+
+
+class BulkJobTests(TestCase):
+    def setUp(self):
+        CronTrigger.warm_crontab_cache(force=True)
+        self.config = models.JobConfigModel.objects.create(category=1, host='localhost')
+
+    def job_options(self, i, **options):
+        return dict(
+            title='Bulk job %s' % i, name='bulk_job_%s' % i, task='job.bulk_task',
+            config_id=self.config.id, minute='*/%s' % (i % 3 + 1), max_run_cnt=10, **options
+        )
+
+    def test_add_modify_remove(self):
+        jobs = default_scheduler.add_jobs([self.job_options(i) for i in range(20)])
+
+        self.assertEqual(len(jobs), 20)
+        self.assertEqual(PeriodicTask.objects.filter(name__startswith='bulk_job_').count(), 20)
+        self.assertEqual(CrontabSchedule.objects.filter(minute__in=['*/1', '*/2', '*/3']).count(), 3)
+
+        job_ids = [job.id for job in models.JobPeriodicModel.objects.filter(title__startswith='Bulk job').order_by('id')]
+        models.JobPeriodicModel.objects.filter(id__in=job_ids).update(is_enabled=True)
+
+        options_list = [dict(self.job_options(i, remark='modified'), job_id=job_id) for i, job_id in enumerate(job_ids)]
+        default_scheduler.modify_jobs(options_list)
+        self.assertEqual(models.JobPeriodicModel.objects.filter(remark='modified').count(), 20)
+
+        self.assertEqual(default_scheduler.remove_jobs(job_ids), 20)
+        self.assertFalse(PeriodicTask.objects.filter(name__startswith='bulk_job_', enabled=True).exists())
+
+    def test_nothing_written_when_any_row_invalid(self):
+        options_list = [self.job_options(i) for i in range(3)] + [self.job_options(1), dict(self.job_options(9), minute='61')]
+
+        with self.assertRaises(BulkJobError) as cm:
+            default_scheduler.add_jobs(options_list)
+
+        self.assertEqual([index for index, _ in cm.exception.errors], [3, 3, 4])
+        self.assertFalse(models.JobPeriodicModel.objects.exists())
+
+    def test_export_and_import_ndjson(self):
+        default_scheduler.add_jobs([self.job_options(i) for i in range(3)])
+
+        response = views.BulkJobPeriodicApi.as_view()(APIRequestFactory().get('/'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+
+        models.JobPeriodicModel.objects.all().delete()
+        PeriodicTask.objects.all().delete()
+
+        request = APIRequestFactory().post('/?action=add', '\n'.join(lines), content_type='application/x-ndjson')
+        response = views.BulkJobPeriodicApi.as_view()(request)
+
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(models.JobPeriodicModel.objects.get(title='Bulk job 2').cron_expr, '*/3 * * * *')
+
+    def test_errors_reported_by_line(self):
+        default_scheduler.add_jobs([self.job_options(0)])
+        lines = [json.dumps(self.job_options(i)) for i in range(1, 3)]
+        body = '\n'.join(['', lines[0], '', json.dumps(self.job_options(0)), lines[1], '{"title": '])
+
+        request = APIRequestFactory().post('/?action=add', body, content_type='application/x-ndjson')
+        response = views.BulkJobPeriodicApi.as_view()(request)
+        self.assertEqual([error['row'] for error in response.data['errors']], [5])
+
+        body = body.rsplit('\n', 1)[0]
+        request = APIRequestFactory().post('/?action=add', body, content_type='application/x-ndjson')
+        response = views.BulkJobPeriodicApi.as_view()(request)
+
+        self.assertEqual(response.data['code'], 6009)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 3])
+        self.assertEqual(models.JobPeriodicModel.objects.count(), 1)
+
+    def test_modified_code_reaches_running_beat(self):
+        AppDispatcher.invalidate()
+        self.addCleanup(AppDispatcher.APPS_CACHE.invalidate)
+
+        source_code, options = 'def bulk_task():\n    return %s\n', dict(name='bulk_task', task='bulk_task')
+        job = default_scheduler.add_jobs([dict(self.job_options(0, task_source_code=source_code % 1), **options)])[0]
+        models.JobConfigModel.objects.update(transport='memory', update_time=timezone.datetime.now() - timedelta(days=1))
+        models.JobPeriodicModel.objects.filter(id=job.id).update(is_enabled=True)
+
+        scheduler = BeatSchedulerTestMixin.create_scheduler()
+        scheduler.schedule_changed()
+        dispatcher = AppDispatcher(scheduler, entry=mock.Mock(task='bulk_task'))
+        self.assertEqual(dispatcher.get_task().run(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_scheduler.modify_jobs([dict(self.job_options(0, task_source_code=source_code % 2), job_id=job.id, **options)])
+
+        self.assertFalse(scheduler.schedule_changed())  # Only the job is changed, not its beat task
+        self.assertEqual(dispatcher.get_task().run(), 2)
+
+    def test_invalid_trigger_reported_by_line(self):
+        lines = [
+            json.dumps(self.job_options(0)), '',
+            json.dumps(dict(self.job_options(1), trigger='interval')),
+            json.dumps(dict(self.job_options(2), trigger=5)),
+        ]
+
+        request = APIRequestFactory().post('/?action=add', '\n'.join(lines), content_type='application/x-ndjson')
+        response = views.BulkJobPeriodicApi.as_view()(request)
+
+        self.assertEqual(response.data['code'], 6009)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 3])
+        self.assertFalse(models.JobPeriodicModel.objects.exists())
+
+    def test_interval_job_not_exported(self):
+        default_scheduler.add_jobs([self.job_options(0)])
+        periodic_task = BeatSchedulerTestMixin.create_beat_task('job.interval_task')
+        models.JobPeriodicModel.objects.create(title='Interval job', periodic_task=periodic_task)
+
+        response = views.BulkJobPeriodicApi.as_view()(APIRequestFactory().get('/'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([row['title'] for row in rows], ['Bulk job 0'])
+
+
+class ExportResultTests(TestCase):
+    def export(self, view_class, **params):
+        response = view_class.as_view()(APIRequestFactory().get('/', params))
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_keyset_chunks_and_filters(self):
+        models.JobScheduledResultModel.objects.bulk_create([
+            models.JobScheduledResultModel(
+                sched_id=str(i), periodic_task_id=i % 2, is_success=i % 3 == 0,
+                run_date=timezone.datetime(2023, 1, 1) + timedelta(hours=i),
+            )
+            for i in range(50)
+        ])
+        view_class = type('ExportApi', (views.ExportScheduledResultApi, ), dict(chunk_size=7))
+
+        with self.assertNumQueries(8):  # 50 rows in chunks of 7
+            rows = [json.loads(line) for line in self.export(view_class)]
+        self.assertEqual([row['sched_id'] for row in rows], [str(i) for i in range(50)])
+
+        rows = [json.loads(line) for line in self.export(view_class, job=1, status='success', start='2023-01-01 10:00:00')]
+        self.assertEqual([row['sched_id'] for row in rows], ['15', '21', '27', '33', '39', '45'])
+
+        rows = [json.loads(line) for line in self.export(view_class, after_id=rows[2]['id'], limit=2)]
+        self.assertEqual(len(rows), 2)
+
+        lines = self.export(view_class, fmt='csv', end='2023-01-01 02:00')
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,'))
+
+
+
+class NgramSearchTests(TestCase):
+    def test_index_search(self):
+        index = NgramIndex()
+        for pk, text in enumerate(['sync orders', 'sync users', 'clean logs', '同步订单']):
+            index.add(pk, text)
+
+        self.assertEqual(sorted(index.search('sync')), [0, 1])
+        self.assertEqual(index.search('订单'), [3])
+        self.assertEqual(sorted(index.search('s')), [0, 1, 2])
+
+        index.add(0, 'export orders')
+        index.remove(1)
+        self.assertEqual(index.search('sync'), [])
+        self.assertEqual(index.search('orders'), [0])
+
+    def test_list_api_on_sqlite(self):
+        self.assertIsInstance(get_search_backend(), NgramSearchBackend)
+
+        crontab, _ = CrontabSchedule.objects.get_or_create(minute='*/5')
+        for i in range(30):
+            periodic_task = PeriodicTask.objects.create(name='job_%s' % i, task='job.task', crontab=crontab)
+            models.JobPeriodicModel.objects.create(title='Job %s %s' % (i, 'sync' if i % 3 else 'clean'), periodic_task=periodic_task)
+
+        def search(title):
+            request = APIRequestFactory().get('/', {'pageSize': 100, 'title': title})
+            response = views.ListJobPeriodicApi.as_view()(request)
+            return sorted(job['title'] for job in response.data['results'])
+
+        expected = sorted(models.JobPeriodicModel.objects.filter(title__contains='2 sy').values_list('title', flat=True))
+        self.assertEqual(search('2 sy'), expected)
+        self.assertEqual(len(search('clean')), 10)
+
+        # Saved in this process, the index is updated at once
+        models.JobPeriodicModel.objects.filter(title='Job 1 sync').get().save_attrs(title='Job 1 clean')
+        self.assertEqual(len(search('clean')), 11)
+
+    def test_case_folded_as_sqlite(self):
+        backend = NgramSearchBackend()
+        for i in range(10):
+            models.JobPeriodicModel.objects.create(title=('Sync Orders %d' if i % 2 else 'sync users %d') % i)
+
+        queryset = models.JobPeriodicModel.objects.all()
+
+        def search(query, max_ids):
+            backend.max_ids = max_ids  # 1: too many matched, `LIKE` is used
+            return set(backend.filter_field(queryset, 'title', query).values_list('title', flat=True))
+
+        for query in ('sync', 'SYNC', 'Orders', 'users 4'):
+            expected = set(queryset.filter(title__contains=query).values_list('title', flat=True))
+
+            self.assertTrue(expected)
+            self.assertEqual(search(query, 1000), expected)
+            self.assertEqual(search(query, 1), expected)
+
+        self.assertEqual(len(search('sync', 1000)), 10)
+
+
+class ResultRetentionTests(TestCase):
+    def test_rollup_then_delete_in_chunks(self):
+        now = timezone.now()
+        old = now - timedelta(days=40)
+
+        models.JobRunnerResultModel.objects.bulk_create([
+            models.JobRunnerResultModel(
+                periodic_task_id=i % 2, status='SUCCESS' if i % 4 else 'FAILURE', cost_seconds=i,
+                run_date=old.replace(hour=i % 3),
+            )
+            for i in range(30)
+        ])
+        models.JobRunnerResultModel.objects.update(create_time=old)
+        models.JobRunnerResultModel.objects.create(periodic_task_id=0, status='SUCCESS', run_date=now)
+
+        deleted = ResultRetention(days=30, chunk_size=7).run(now=now)
+        self.assertEqual(deleted['JobRunnerResultModel'], 30)
+        self.assertEqual(models.JobRunnerResultModel.objects.count(), 1)
+
+        rollups = models.JobResultRollupModel.objects.filter(source=2)
+        day = rollups.get(period=ResultRetention.DAY, periodic_task_id=0)
+
+        self.assertEqual((day.total_cnt, day.success_cnt, day.failure_cnt), (15, 7, 8))
+        self.assertEqual(sum(day.cost_histogram), 15)
+        self.assertEqual(day.cost_p50, 30.0)  # Even costs 0..28, the bucket (10, 30]
+        self.assertEqual(sum(rollups.filter(period=ResultRetention.HOUR).values_list('total_cnt', flat=True)), 30)
+
+
+class ScheduleVersionTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        CronTrigger.warm_crontab_cache(force=True)
+        config = models.JobConfigModel.objects.create(category=1, host='localhost')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_scheduler.add_jobs([dict(
+                title='Version job', name='version_job', task='job.version_task',
+                config_id=config.id, minute='*/5', max_run_cnt=10,
+            )])
+
+        models.JobPeriodicModel.objects.filter(title='Version job').update(is_enabled=True)
+        self.job = models.JobPeriodicModel.objects.get(title='Version job')
+        self.scheduler = self.create_scheduler()
+        self.scheduler.sync_jobs()
+
+    def test_idle_beat_reads_version_only(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(self.scheduler.jobs_changed())
+
+    def test_saved_job_bumps_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job.remark = 'changed'
+            self.job.save()
+
+        self.assertTrue(self.scheduler.jobs_changed())
+
+        self.scheduler.sync_jobs()
+        self.assertFalse(self.scheduler.jobs_changed())
+
+    def test_evicted_counter_not_reused(self):
+        version = ScheduleVersion(backend='cache')
+        version._bump()
+        seen = {version.get()}
+
+        for _ in range(3):
+            caches['default'].delete(version.key)  # Evicted, the counter starts again
+            version._bump()
+            version._bump()
+
+            self.assertNotIn(version.get(), seen)
+            seen.add(version.get())
+
+    def test_reached_deadline_forces_sync(self):
+        self.assertEqual(self.scheduler._next_deadline, self.job.deadline_run_time)
+
+        self.scheduler._next_deadline = timezone.datetime.now() - timedelta(seconds=1)
+        self.assertTrue(self.scheduler.jobs_changed())
+
+
+class IncrementalSyncTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        CronTrigger.warm_crontab_cache(force=True)
+        config = models.JobConfigModel.objects.create(category=1, host='localhost')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_scheduler.add_jobs([dict(
+                title='Sync job %s' % i, name='sync_job_%s' % i, task='job.sync_task_%s' % i,
+                config_id=config.id, minute='*/5', max_run_cnt=10,
+            ) for i in range(4)])
+
+        self.old = timezone.datetime.now() - timedelta(days=1)
+        models.JobPeriodicModel.objects.update(is_enabled=True, update_time=self.old)
+        self.jobs = list(models.JobPeriodicModel.objects.order_by('id'))
+
+        self.scheduler = self.create_scheduler()
+        self.sync_task = SyncScheduledTask(scheduler=self.scheduler)
+
+    def sync(self, since=None):
+        """ Returns the high-water mark and the ids of the re-read jobs """
+        with mock.patch.object(SyncScheduledTask, '_sync_jobs') as sync_jobs:
+            mark = self.sync_task.sync_changed_schedules(since=since)
+
+        return mark, sorted(job.id for job in sync_jobs.call_args.args[0])
+
+    def test_only_changed_rows_read(self):
+        mark, job_ids = self.sync()
+        self.assertEqual(job_ids, [job.id for job in self.jobs])
+
+        self.assertEqual(self.sync(since=mark)[1], [])
+
+        models.JobPeriodicModel.objects.filter(id=self.jobs[1].id).update(update_time=timezone.datetime.now())
+        self.assertEqual(self.sync(since=mark)[1], [self.jobs[1].id])
+
+    def test_late_commit_caught_by_overlap(self):
+        mark, _ = self.sync()
+
+        # Saved before the mark by a clock behind, or committed after the last pass read the rows
+        models.JobPeriodicModel.objects.filter(id=self.jobs[2].id).update(update_time=mark - timedelta(seconds=30))
+        models.JobPeriodicModel.objects.filter(id=self.jobs[3].id).update(update_time=mark - timedelta(seconds=90))
+
+        self.assertEqual(self.sync(since=mark)[1], [self.jobs[2].id])
+
+    def test_reached_deadline_read(self):
+        mark, _ = self.sync()
+        deadline_run_time = timezone.datetime.now() - timedelta(seconds=1)
+        models.JobPeriodicModel.objects.filter(id=self.jobs[0].id).update(deadline_run_time=deadline_run_time)
+
+        self.assertEqual(self.sync(since=mark)[1], [self.jobs[0].id])
+
+    def test_removed_or_disabled_jobs_leave_schedule(self):
+        self.assertTrue({'sync_job_0', 'sync_job_1'}.issubset(self.scheduler.schedule))
+        self.scheduler.schedule  # Last change of the schedule is read
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_scheduler.remove_jobs([self.jobs[0].id])
+
+            job = self.jobs[1]
+            job.is_enabled = job.periodic_task.enabled = False
+            job.periodic_task.save()
+            job.save()
+
+        schedule = self.scheduler.schedule
+        self.assertNotIn('sync_job_0', schedule)
+        self.assertNotIn('sync_job_1', schedule)
+        self.assertIn('sync_job_2', schedule)
+
+
+class WatchPeriodicTasksTests(BeatSchedulerTestMixin, TestCase):
+    def create_job(self, title, deadline_days, with_task=True, **fields):
+        periodic_task = self.create_beat_task('job.%s' % title) if with_task else None
+        deadline_run_time = timezone.datetime.now() + timedelta(days=deadline_days)
+
+        return models.JobPeriodicModel.objects.create(
+            title=title, periodic_task=periodic_task, deadline_run_time=deadline_run_time, **fields)
+
+    def test_only_due_jobs_stopped(self):
+        due_jobs = [
+            self.create_job('due', -1, is_enabled=True),
+            self.create_job('due_no_task', -1, with_task=False, is_enabled=True),
+        ]
+        others = [
+            self.create_job('future', 1, is_enabled=True),
+            self.create_job('disabled', -1, is_enabled=False),
+            self.create_job('deleted', -1, is_enabled=True, is_del=True),
+        ]
+
+        with mock.patch.object(schedule_version, '_bump') as bump, \
+                mock.patch.object(task_synchronous_jobs, 'notify_jobs_changed') as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            task_synchronous_jobs.watch_periodic_tasks()
+
+        enabled = dict(models.JobPeriodicModel.objects.values_list('title', 'is_enabled'))
+        self.assertEqual(enabled, dict(due=False, due_no_task=False, future=True, disabled=False, deleted=True))
+        self.assertFalse(PeriodicTask.objects.get(id=due_jobs[0].periodic_task_id).enabled)
+        self.assertTrue(all(PeriodicTask.objects.get(id=job.periodic_task_id).enabled for job in others))
+
+        bump.assert_called_once_with()
+        notify.assert_called_once()
+        self.assertEqual(sorted(notify.call_args.args[0]), sorted(job.id for job in due_jobs))
+
+    def test_nothing_due_nothing_signaled(self):
+        self.create_job('future', 1, is_enabled=True)
+
+        with mock.patch.object(schedule_version, '_bump') as bump, \
+                mock.patch.object(task_synchronous_jobs, 'notify_jobs_changed') as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            task_synchronous_jobs.watch_periodic_tasks()
+
+        bump.assert_not_called()
+        notify.assert_not_called()
+
+
+class ChangeNotifierTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        CronTrigger.warm_crontab_cache(force=True)
+        config = models.JobConfigModel.objects.create(category=1, host='localhost')
+
+        patcher = mock.patch.object(notifier, '_notifier', notifier.LocalChangeNotifier())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.scheduler = self.create_scheduler()
+        self.scheduler.schedule  # Initial read
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_scheduler.add_jobs([dict(
+                title='Notified job', name='notified_job', task='job.notified_task',
+                config_id=config.id, minute='*/5', max_run_cnt=10,
+            )])
+
+        self.job = models.JobPeriodicModel.objects.select_related('periodic_task').get(title='Notified job')
+
+    def test_notified_jobs_applied_without_polling(self):
+        self.scheduler._next_poll = float('inf')
+
+        self.assertIn('notified_job', self.scheduler.schedule)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job.periodic_task.enabled = False
+            self.job.periodic_task.save()
+            self.job.save()
+
+        self.assertNotIn('notified_job', self.scheduler.schedule)
+        self.assertEqual(self.scheduler.change_subscription.poll(), set())
+
+    def test_removed_jobs_notified(self):
+        subscription = notifier.get_change_notifier().subscribe()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_scheduler.remove_jobs([self.job.id])
+
+        self.assertEqual(subscription.poll(), {self.job.id})
+
+    @skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_redis_notifier(self):
+        redis_notifier = notifier.RedisChangeNotifier(redis_conn=fakeredis.FakeStrictRedis(server=fakeredis.FakeServer()))
+        subscription = redis_notifier.subscribe()
+
+        redis_notifier.publish([3, 1])
+        redis_notifier.publish([2])
+
+        self.assertEqual(subscription.poll(), {1, 2, 3})
+        self.assertEqual(subscription.poll(), set())
+
+
+class MetricsTests(BeatSchedulerTestMixin, TestCase):
+    @staticmethod
+    def lock_counts():
+        values = metrics.registry.snapshot().get(metrics.BEAT_LOCKS.name, {})
+        return values.get(('won', ), 0), values.get(('lost', ), 0)
+
+    @skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_lock_results_counted(self):
+        redis_conn = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+        schedulers = [self.create_scheduler(redis_conn=redis_conn, lock_mode='batch') for _ in range(2)]
+        entries = [ModelEntry(self.create_beat_task('job.metric_%s' % i), app=get_celery_app()) for i in range(3)]
+
+        won, lost = self.lock_counts()
+        for scheduler in schedulers:
+            scheduler.is_due_many(entries)
+
+        self.assertEqual(self.lock_counts(), (won + 3, lost + 3))
+
+    @skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_redis_exporter_sums_beats(self):
+        redis_conn = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+        exporter = metrics.RedisMetricsExporter(redis_conn=redis_conn)
+
+        for observed in ([0.2, 3], [0.002]):
+            beat_registry = metrics.MetricsRegistry()
+            histogram = beat_registry.histogram(metrics.BEAT_TICK_SECONDS.name, 'Duration of a beat tick')
+            beat_exporter = metrics.RedisMetricsExporter(redis_conn=redis_conn)
+
+            for value in observed:
+                histogram.observe(value)
+                beat_exporter.export(beat_registry)  # Only the increments are added
+
+        text = metrics.render_text(exporter.collect(metrics.registry))
+
+        self.assertIn('django_celery_jobs_beat_tick_seconds_bucket{le="0.005"} 1', text)
+        self.assertIn('django_celery_jobs_beat_tick_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('django_celery_jobs_beat_tick_seconds_count 3', text)
+
+    @skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_default_exporter_with_redis(self):
+        redis_conn = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+
+        with mock.patch.object(metrics, '_exporter', None), \
+                mock.patch('django_celery_jobs.jobScheduler.core.notifier.get_redis_connection', return_value=redis_conn):
+            exporter = metrics.get_metrics_exporter()
+            metrics.BEAT_TICK_SECONDS.observe(0.1)
+            exporter.export(metrics.registry)
+
+            self.assertIsInstance(exporter, metrics.RedisMetricsExporter)
+            self.assertNotIn('# WARNING', metrics.render_text())
+            self.assertTrue(redis_conn.hlen(exporter.key))
+
+    def test_default_exporter_without_redis(self):
+        with mock.patch.object(metrics, '_exporter', None), \
+                mock.patch('django_celery_jobs.jobScheduler.core.notifier.get_redis_connection', return_value=None), \
+                self.assertLogs('celery.worker', 'WARNING') as logs:
+            self.assertIsInstance(metrics.get_metrics_exporter(), metrics.LocalMetricsExporter)
+            self.assertTrue(metrics.render_text().startswith('# WARNING The local metrics exporter'))
+
+        self.assertIn('DJANGO_CELERY_JOBS_METRICS_EXPORTER', logs.output[0])
+
+    def test_metrics_api(self):
+        metrics.DISPATCH_FAILURES.inc(broker='Celery:localhost:/')
+        response = views.MetricsApi.as_view()(APIRequestFactory().get('/'))
+
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'# TYPE django_celery_jobs_beat_tick_seconds histogram', response.content)
+        self.assertIn(b'django_celery_jobs_dispatch_failures_total{broker="Celery:localhost:/"}', response.content)
+
+    def test_metrics_api_behind_jwt(self):
+        with self.assertRaises(InvalidToken):
+            self.client.get(reverse('api_metrics'))
+
+    @override_settings(DJANGO_CELERY_JOBS_METRICS_TOKEN='secret')
+    def test_metrics_api_with_static_token(self):
+        self.assertEqual(self.client.get(reverse('api_metrics')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('api_metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+        response = self.client.get(reverse('api_metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE django_celery_jobs_beat_tick_seconds histogram', response.content)
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class LeaderLeaseTests(BeatSchedulerTestMixin, TestCase):
+    def setUp(self):
+        # The lease is timed by `time.monotonic`, its key expires in fakeredis by `time.time`
+        clock, self.elapsed = (time.time(), time.monotonic()), 0
+        for name, base in zip(('time.time', 'time.monotonic'), clock):
+            patcher = mock.patch(name, lambda base=base: base + self.elapsed)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        server = fakeredis.FakeServer()
+        self.schedulers = [
+            self.create_scheduler(
+                redis_conn=fakeredis.FakeStrictRedis(server=server), lock_mode='lease',
+                lease_ttl=0.3, lease_renew_interval=0.05,
+            )
+            for _ in range(2)
+        ]
+
+    def sleep(self, seconds):
+        self.elapsed += seconds
+
+    def test_only_one_leader(self):
+        first, second = self.schedulers
+
+        self.assertTrue(first.is_leader())
+        self.assertFalse(second.is_leader())
+
+        self.sleep(0.1)  # Renewed by the leader, the follower still fails
+        self.assertTrue(first.is_leader())
+        self.assertFalse(second.is_leader())
+
+    def test_failover_after_ttl(self):
+        first, second = self.schedulers
+        self.assertTrue(first.is_leader())
+
+        self.sleep(0.35)  # The leader is dead, its lease is not renewed
+        self.assertTrue(second.is_leader())
+        self.assertFalse(first.is_leader())
+
+    def test_leader_expires_locally_without_redis(self):
+        first, _ = self.schedulers
+        self.assertTrue(first.is_leader())
+
+        broken_conn = mock.Mock(**{'set.side_effect': ConnectionError, 'pipeline.side_effect': ConnectionError})
+
+        with mock.patch.object(first.leader_lease, 'redis_conn', broken_conn):
+            self.sleep(0.1)
+            self.assertTrue(first.is_leader())
+
+            self.sleep(0.25)
+            self.assertFalse(first.is_leader())
+
+    def test_released_lease_taken_at_once(self):
+        first, second = self.schedulers
+        self.assertTrue(first.is_leader())
+
+        first.leader_lease.release()
+        self.assertTrue(second.is_leader())
+
+    def test_only_leader_dispatches(self):
+        self.create_beat_task('job.lease_task')
+        first, second = self.schedulers
+
+        for scheduler in self.schedulers:
+            scheduler.apply_entry = mock.Mock()
+            scheduler.sync_entries = mock.Mock()
+            scheduler.tick()
+
+        self.assertEqual(first.apply_entry.call_count, 1)
+        self.assertEqual(second.apply_entry.call_count, 0)
+        self.assertEqual(first.leader_lease.redis_conn.keys(), [first.leader_lease.key.encode()])
+
+    def test_lease_lost_during_tick(self):
+        for name in ('job.lease_task_1', 'job.lease_task_2', 'job.lease_task_3'):
+            self.create_beat_task(name)
+
+        first, _ = self.schedulers
+        first.sync_entries = mock.Mock()
+        self.assertTrue(first.is_leader())
+
+        def apply_entry(entry, producer=None):
+            self.sleep(0.35)  # A slow dispatch, the lease is not renewed in the tick
+
+        first.apply_entry = mock.Mock(side_effect=apply_entry)
+
+        with self.assertLogs('celery.worker', 'WARNING'):
+            first.tick()
+
+        self.assertEqual(first.apply_entry.call_count, 1)
+        self.assertEqual(len(first._heap), 3)  # The others are kept, not sent
+
+    def test_promoted_follower_not_dispatch_again(self):
+        beat_task = self.create_beat_task('job.failover_task')
+        first, second = self.schedulers
+
+        for scheduler in self.schedulers:
+            scheduler.apply_entry = mock.Mock()
+
+        first.tick()  # Dispatched and saved by the leader
+        second.tick()
+        self.assertEqual((first.apply_entry.call_count, second.apply_entry.call_count), (1, 0))
+
+        self.sleep(0.1)
+        PeriodicTask.objects.filter(id=beat_task.id).update(description='reloaded')
+        PeriodicTasks.update_changed()
+
+        for scheduler in self.schedulers:
+            scheduler.tick()
+
+        self.sleep(0.35)  # The leader is dead, the follower is promoted and reads the run state
+        second.tick()
+
+        self.assertTrue(second.is_leader())
+        self.assertEqual((first.apply_entry.call_count, second.apply_entry.call_count), (1, 0))
+        self.assertEqual(PeriodicTask.objects.get(id=beat_task.id).total_run_count, 1)
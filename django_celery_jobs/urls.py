@@ -25,4 +25,11 @@ urlpatterns = [
     re_path(f"^{API_PREFIX}/periodic/job/list$", view=views.ListJobPeriodicApi.as_view(), name='api_job_list'),
     re_path(f"^{API_PREFIX}/periodic/job/add$", view=views.CreateJobPeriodicApi.as_view(), name='api_job_create'),
     re_path(f"^{API_PREFIX}/periodic/job/update$", view=views.UpdateDestroyJobPeriodicApi.as_view(), name='api_job_update'),
+    re_path(f"^{API_PREFIX}/periodic/job/bulk$", view=views.BulkJobPeriodicApi.as_view(), name='api_job_bulk'),
+
+    re_path(f"^{API_PREFIX}/result/scheduled/export$", view=views.ExportScheduledResultApi.as_view(), name='api_result_scheduled_export'),
+    re_path(f"^{API_PREFIX}/result/runner/export$", view=views.ExportRunnerResultApi.as_view(), name='api_result_runner_export'),
+    re_path(f"^{API_PREFIX}/result/celery/export$", view=views.ExportCeleryResultApi.as_view(), name='api_result_celery_export'),
+
+    re_path(f"^{API_PREFIX}/metrics$", view=views.MetricsApi.as_view(), name='api_metrics'),
 ]
@@ -1,8 +1,16 @@
+import csv
+import hmac
+import json
 import logging
 
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from django.core.serializers.json import DjangoJSONEncoder
 from django.views.generic import TemplateView
-from django.db.models import Q
+from django.db.models import Q, OuterRef
 from django.db import transaction
 from django.contrib.auth import logout
 from django.contrib.auth.models import AnonymousUser
@@ -17,8 +25,13 @@ from rest_framework.generics import RetrieveAPIView, ListAPIView, UpdateAPIView,
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 from . import serializers, models
+from .search import search_filter
+from .pagination import CursorPaginationMixin
 from .jobScheduler.trigger.cron import CronTrigger
 from .jobScheduler.utils import get_trigger_next_range
+from .jobScheduler.scheduler import default_scheduler
+from .jobScheduler.core import metrics
+from .jobScheduler.core.exceptions import BulkJobError
 from django_celery_jobs.tasks.task_synchronous_jobs import sync_celery_native_tasks
 
 User = get_user_model()
@@ -87,7 +100,7 @@ class JobUserLogOutApi(GenericAPIView):
         return Response(data=None)
 
 
-class ListNativeJobApi(ListAPIView):
+class ListNativeJobApi(CursorPaginationMixin, ListAPIView):
     pagination_class = PageNumberPagination
     serializer_class = serializers.CeleryNativeTaskSerializer
 
@@ -97,11 +110,9 @@ class ListNativeJobApi(ListAPIView):
 
         native_task = sync_celery_native_tasks.name
         q = Q(('is_hidden', False), ('is_del', False), _connector='AND')
+        queryset = models.CeleryNativeTaskModel.objects.filter(~Q(task=native_task), q).all()
 
-        name and q.children.append(('name__contains', name))
-        task and q.children.append(('task__contains', task))
-
-        return models.CeleryNativeTaskModel.objects.filter(~Q(task=native_task), q).all()
+        return search_filter(queryset, name=name, task=task)
 
 
 class UpdateNativeJobApi(UpdateAPIView):
@@ -128,7 +139,7 @@ class CronExpressionApi(APIView):
         return Response(data=run_next_range)
 
 
-class ListJobPeriodicApi(ListAPIView):
+class ListJobPeriodicApi(CursorPaginationMixin, ListAPIView):
     pagination_class = PageNumberPagination
     serializer_class = serializers.JobPeriodicSerializer
 
@@ -138,10 +149,12 @@ class ListJobPeriodicApi(ListAPIView):
         remark = query_params.get('remark')
 
         q = Q(('is_del', False), _connector='AND')
-        title and q.children.append(('title__contains', title))
-        remark and q.children.append(('remark__contains', remark))
+        queryset = models.JobPeriodicModel.objects\
+            .filter(q)\
+            .select_related('periodic_task__crontab', 'config')\
+            .annotate(native_name=models.CeleryNativeTaskModel.name_subquery(OuterRef('periodic_task__task')))
 
-        return models.JobPeriodicModel.objects.filter(q).select_related("periodic_task")
+        return search_filter(queryset, title=title, remark=remark)
 
 
 class CreateJobPeriodicApi(CreateAPIView):
@@ -202,3 +215,247 @@ class UpdateDestroyJobPeriodicApi(UpdateAPIView):
 
         return getattr(self, action)(request, *args, **kwargs)
 
+
+class BulkJobPeriodicApi(APIView):
+    """ Import or export jobs in NDJSON, one job per line
+
+    GET: export all cron jobs, the jobs of other schedules can't be imported by `cron_expr`
+    POST: `?action=add|modify|remove`, each line is the options of `JobSchedulerHandler.add_job`,
+        `cron_expr` can be used instead of the cron fields, `id` is required to modify or remove.
+        Nothing is written if any line is invalid.
+    """
+    EXPORT_FIELDS = (
+        'id', 'title', 'config_id', 'max_run_cnt', 'func_name', 'task_source_code', 'remark',
+    )
+    EXPORT_TASK_FIELDS = ('name', 'task', 'args', 'kwargs', 'priority', 'exchange', 'routing_key')
+
+    def get(self, request, *args, **kwargs):
+        queryset = models.JobPeriodicModel.objects\
+            .filter(is_del=False, periodic_task__crontab__isnull=False)\
+            .select_related('periodic_task__crontab')\
+            .order_by('id')
+
+        response = StreamingHttpResponse(self._export_lines(queryset), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="jobs.ndjson"'
+        return response
+
+    def post(self, request, *args, **kwargs):
+        action = request.query_params.get('action', 'add')
+        if action not in ('add', 'modify', 'remove'):
+            return Response(data=dict(message=f'不合法的操作<{action}>', code=6009))
+
+        try:
+            line_numbers, options_list = self._parse_lines(request.body, with_id=action != 'add')
+
+            if action == 'remove':
+                count = default_scheduler.remove_jobs([options['job_id'] for options in options_list])
+            else:
+                # The errors of the rows are reported by their line numbers
+                count = len(getattr(default_scheduler, action + '_jobs')(options_list, rows=line_numbers))
+        except BulkJobError as e:
+            errors = [dict(row=index, message=message) for index, message in e.errors]
+            return Response(data=dict(message=str(e), code=6009, errors=errors))
+
+        return Response(data=dict(message=f'批量操作<{action}>任务成功', count=count))
+
+    def _export_lines(self, queryset):
+        for job in queryset.iterator(chunk_size=2000):
+            row = {name: getattr(job, name) for name in self.EXPORT_FIELDS}
+            row.update({name: getattr(job.periodic_task, name) for name in self.EXPORT_TASK_FIELDS})
+            row['cron_expr'] = job.cron_expr
+
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+    def _parse_lines(self, body, with_id=False):
+        """ Returns the line numbers and the job options of the lines, line numbers are counted from 0
+            and blank lines are counted too
+        """
+        line_numbers, options_list, errors = [], [], []
+
+        for index, line in enumerate(body.decode('utf-8').splitlines()):
+            if not line.strip():
+                continue
+
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('line must be a json object')
+
+                options_list.append(self._job_options(row, with_id=with_id))
+                line_numbers.append(index)
+            except (ValueError, TypeError) as e:
+                errors.append((index, str(e)))
+
+        if errors:
+            raise BulkJobError(errors)
+
+        return line_numbers, options_list
+
+    @staticmethod
+    def _job_options(row, with_id=False):
+        options = dict(row)
+        job_id = options.pop('id', None)
+        cron_expr = options.pop('cron_expr', None)
+
+        if with_id:
+            if not job_id:
+                raise ValueError('`id` is required')
+            options['job_id'] = int(job_id)
+
+        if cron_expr:
+            trigger = CronTrigger.from_crontab(cron_expr)
+            options.update({name: getattr(trigger, name) for name in CronTrigger.ORDERED_FIELDS})
+
+        # `_get_beat_task_opts` expects the json text
+        for name in ('args', 'kwargs'):
+            if name in options and not isinstance(options[name], str):
+                options[name] = json.dumps(options[name])
+
+        return options
+
+
+class _Echo:
+    """ File-like object of `csv.writer`, the written line is returned to be streamed """
+    def write(self, value):
+        return value
+
+
+class ExportResultApi(APIView):
+    """ Stream all rows of a result table in NDJSON (default) or CSV
+
+    The rows are read by keyset pagination on `id`, so the cost of each chunk doesn't grow with the offset.
+    Query params:
+        fmt: ndjson|csv, `format` is taken by the content negotiation of DRF
+        start, end: range of `time_field`, e.g. 2023-01-01 or 2023-01-01 08:00:00
+        job: value of `job_field`
+        status: value of `status_field`
+        after_id: only rows whose id is greater than it, to resume an interrupted export
+        limit: maximum count of rows
+    """
+    model = None
+    time_field = 'run_date'
+    job_field = 'periodic_task_id'
+    status_field = 'status'
+    chunk_size = getattr(settings, 'DJANGO_CELERY_JOBS_EXPORT_CHUNK_SIZE', 2000)
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        export_format = params.get('fmt', 'ndjson')
+
+        try:
+            queryset = self.filter_queryset(self.model.objects.all(), params)
+            after_id = int(params.get('after_id') or 0)
+            limit = int(params['limit']) if params.get('limit') else None
+        except ValueError as e:
+            return Response(data=dict(message=str(e), code=6010))
+
+        fields = [field.attname for field in self.model._meta.concrete_fields]
+        rows = self.iter_rows(queryset.values(*fields), after_id, limit)
+
+        if export_format == 'csv':
+            content, content_type = self.iter_csv(fields, rows), 'text/csv'
+        elif export_format == 'ndjson':
+            content, content_type = self.iter_ndjson(rows), 'application/x-ndjson'
+        else:
+            return Response(data=dict(message=f'不支持的导出格式<{export_format}>', code=6010))
+
+        filename = '%s.%s' % (self.model._meta.db_table, export_format)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+    def filter_queryset(self, queryset, params):
+        start, end = params.get('start'), params.get('end')
+        job, status = params.get('job'), params.get('status')
+
+        q = Q(_connector='AND')
+        start and q.children.append((self.time_field + '__gte', self.parse_time(start)))
+        end and q.children.append((self.time_field + '__lt', self.parse_time(end)))
+        job and q.children.append((self.job_field, job))
+        status and q.children.append(self.status_q(status))
+
+        return queryset.filter(q)
+
+    def status_q(self, status):
+        return Q(**{self.status_field: status})
+
+    @staticmethod
+    def parse_time(value):
+        dt = parse_datetime(value)
+
+        if dt is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError(f'时间<{value}>格式错误')
+            dt = timezone.datetime(date.year, date.month, date.day)
+
+        if settings.USE_TZ and timezone.is_naive(dt):
+            dt = timezone.make_aware(dt)
+
+        return dt
+
+    def iter_rows(self, queryset, after_id=0, limit=None):
+        last_id, count = after_id, 0
+
+        while limit is None or count < limit:
+            size = self.chunk_size if limit is None else min(self.chunk_size, limit - count)
+            rows = 0
+
+            for row in queryset.filter(id__gt=last_id).order_by('id')[:size].iterator(chunk_size=size):
+                rows += 1
+                last_id = row['id']
+                yield row
+
+            count += rows
+            if rows < size:
+                break
+
+    @staticmethod
+    def iter_ndjson(rows):
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+    @staticmethod
+    def iter_csv(fields, rows):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+
+        for row in rows:
+            yield writer.writerow([row[name] for name in fields])
+
+
+class ExportScheduledResultApi(ExportResultApi):
+    model = models.JobScheduledResultModel
+
+    def status_q(self, status):
+        # SUCCESS or FAILURE, the same as the states of celery
+        return Q(is_success=status.upper() == 'SUCCESS')
+
+
+class ExportRunnerResultApi(ExportResultApi):
+    model = models.JobRunnerResultModel
+
+
+class ExportCeleryResultApi(ExportResultApi):
+    model = models.CeleryTaskRunnerResultModel
+    time_field = 'date_done'
+    job_field = 'periodic_task_name'
+
+
+class MetricsApi(APIView):
+    """ Metrics of beat and dispatch in the Prometheus text format, collected by the metrics exporter
+
+    It's authenticated by the JWT header (`XX-Token`) like other apis. If `DJANGO_CELERY_JOBS_METRICS_TOKEN`
+    is set, the JWT check is skipped and the scraper sends `Authorization: Bearer <token>` instead.
+    """
+    authentication_classes = ()
+    permission_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        token = getattr(settings, 'DJANGO_CELERY_JOBS_METRICS_TOKEN', None)
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+
+        if token and not hmac.compare_digest(authorization.encode(), ('Bearer %s' % token).encode()):
+            return HttpResponse('Invalid metrics token\n', status=401, content_type='text/plain')
+
+        return HttpResponse(metrics.render_text(), content_type='text/plain; version=0.0.4; charset=utf-8')